@@ -1,17 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from db_connection import get_db, initialize_database
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, jsonify, stream_with_context
+from db_connection import get_connection, get_read_connection, initialize_database
 from auth import register_user, login_user, logout_user, require_login
+from passwords import PasswordBusyError, check_password, hash_password
+from rate_limit import get_login_limiter, retry_after_header
 from dialogflow_handler import DialogflowHandler
+from chat_service import SSE_DONE, chat_reply, chat_reply_stream, sse_event, wants_stream
 from notification_scheduler import schedule_notification
 from appointment_scheduler import AppointmentScheduler
 from payment_handler import PaymentHandler
 from prescription_handler import PrescriptionHandler
 from health_records_handler import HealthRecordsHandler
-import os
+from app_logging import configure_logging, current_request_id, http_request_context
+from session_store import configure_sessions, regenerate_session
+import tracing
+import logging
+from contextlib import ExitStack
 from datetime import datetime
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
 
 # Initialize handlers
 dialogflow = DialogflowHandler('chatbotproject-444010')
@@ -22,6 +31,29 @@ appointment_scheduler = AppointmentScheduler()
 
 # Initialize database when the app starts
 initialize_database()
+# Stable secret key and server-side sessions, shared by every worker
+configure_sessions(app)
+# Load the reference data snapshot now rather than on the first FAQ
+dialogflow.reference_data.snapshot()
+
+@app.before_request
+def bind_request_logging():
+    # Closed in teardown, which for a streamed reply is after the last chunk
+    g.log_scope = ExitStack()
+    g.log_scope.enter_context(http_request_context(request.headers.get))
+
+@app.after_request
+def add_request_id(response):
+    request_id = current_request_id()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.teardown_request
+def unbind_request_logging(exc):
+    log_scope = g.pop('log_scope', None)
+    if log_scope is not None:
+        log_scope.close()
 
 @app.route('/')
 def index():
@@ -42,8 +74,8 @@ def register():
             username, 
             password, 
             email,
-            first_name,
-            last_name
+            first_name=first_name,
+            last_name=last_name
         )
         
         if success:
@@ -56,9 +88,17 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        limiter = get_login_limiter()
+        retry_after = limiter.acquire(username, request.remote_addr)
+        if retry_after:
+            return (render_template('login.html', error="Too many login attempts, please try again later"),
+                    429, retry_after_header(retry_after))
         success, result = login_user(username, password)
         
         if success:
+            limiter.reset_user(username)
+            # A session id that existed before login must not become the logged-in one
+            regenerate_session(session)
             session['user_id'] = result['id']
             session['username'] = result['username']
             return redirect(url_for('chat'))
@@ -83,99 +123,37 @@ def chat():
     # Handle POST request for chat messages
     try:
         message = request.json.get('message', '')
-        user_id = session['user_id']
-        
-        print(f"Processing message: {message}")
-        
-        # Handle profile updates
-        update_commands = {
-            'phone': r'[Uu]pdate my (?:phone|telephone|mobile)(?: number)? to (\d+)',
-            'address': r'[Uu]pdate my address to (.+)',
-            'blood_type': r'[Mm]y blood type is (A\+|A-|B\+|B-|O\+|O-|AB\+|AB-)',
-            'allergies': r'[Uu]pdate my allergies to (.+)',
-            'emergency_contact': r'[Uu]pdate my emergency contact to (.+)'
-        }
-        
-        for field, pattern in update_commands.items():
-            import re
-            match = re.search(pattern, message)
-            if match:
-                value = match.group(1).strip()
-                try:
-                    conn = get_db()
-                    cursor = conn.cursor()
-                    
-                    if field in ['phone', 'address', 'emergency_contact']:
-                        # Update users table
-                        cursor.execute(f"UPDATE users SET {field} = ? WHERE id = ?", (value, user_id))
-                    else:
-                        # Check if profile exists
-                        cursor.execute("SELECT id FROM patient_profiles WHERE user_id = ?", (user_id,))
-                        profile = cursor.fetchone()
-                        if not profile:
-                            cursor.execute("INSERT INTO patient_profiles (user_id) VALUES (?)", (user_id,))
-                        
-                        # Update patient_profiles table
-                        cursor.execute(f"""
-                            UPDATE patient_profiles 
-                            SET {field} = ?
-                            WHERE user_id = ?
-                        """, (value, user_id))
-                    
-                    conn.commit()
-                    return jsonify({'response': f'✅ Your {field.replace("_", " ")} has been updated to: {value}'})
-                
-                except Exception as e:
-                    print(f"Error updating profile: {str(e)}")
-                    return jsonify({'response': f"Sorry, I couldn't update your {field.replace('_', ' ')} at this moment."})
-                finally:
-                    if 'conn' in locals():
-                        conn.close()
-        
-        # Handle profile information request
-        if message.lower().strip() == 'show my profile information':
-            try:
-                conn = get_db()
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    SELECT u.*, p.*
-                    FROM users u
-                    LEFT JOIN patient_profiles p ON u.id = p.user_id
-                    WHERE u.id = ?
-                """, (user_id,))
-                
-                profile = cursor.fetchone()
-                if profile:
-                    response = f"""👤 Your Profile Information:
-📋 Name: {profile['username']}
-📧 Email: {profile['email']}
-📞 Phone: {profile['phone'] or 'Not provided'}
-📍 Address: {profile['address'] or 'Not provided'}
-🏥 Blood Type: {profile.get('blood_type') or 'Not provided'}
-⚕️ Allergies: {profile.get('allergies') or 'Not provided'}
-🆘 Emergency Contact: {profile['emergency_contact'] or 'Not provided'}"""
-                    return jsonify({'response': response})
-                else:
-                    return jsonify({'response': "Sorry, I couldn't find your profile information."})
-            except Exception as e:
-                print(f"Error getting profile: {str(e)}")
-                return jsonify({'response': "Sorry, I couldn't retrieve your profile information at this moment."})
-            finally:
-                if 'conn' in locals():
-                    conn.close()
-        
-        # If not a profile update or info request, proceed with Dialogflow
-        try:
-            response = dialogflow.handle_intent(user_id, message)
-            return jsonify({'response': response})
-        except Exception as e:
-            print(f"Error in Dialogflow request: {str(e)}")
-            return jsonify({'response': "I'm having trouble understanding. Could you please try again?"})
+        if wants_stream(request.headers.get('Accept'), request.json):
+            return stream_chat_reply(message)
+        return jsonify({'response': chat_reply(dialogflow, session['user_id'], message)})
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        logger.error("Error processing request: %s", e)
         return jsonify({'response': "Sorry, there was an error processing your request."})
 
+def stream_chat_reply(message):
+    """Send the reply as Server-Sent Events, one event per chunk"""
+    chunks = chat_reply_stream(dialogflow, session['user_id'], message)
+    # The first chunk is produced before the response starts, so session
+    # changes made while answering (e.g. deactivation) are still saved
+    first = next(chunks, None)
+
+    def events():
+        if first is not None:
+            yield sse_event(first)
+        for chunk in chunks:
+            yield sse_event(chunk)
+        yield SSE_DONE
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    """Chat latency histograms in the Prometheus text format"""
+    if not tracing.ENABLED:
+        return Response("Metrics are disabled", status=404, mimetype='text/plain')
+    return Response(tracing.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/change-password', methods=['POST'])
 def change_password():
     if 'user_id' not in session:
@@ -192,35 +170,46 @@ def change_password():
         if not current_password or not new_password:
             return jsonify({"error": "Missing required fields"}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
+        # Shares the username's login bucket: both are password guesses
+        limiter = get_login_limiter()
+        retry_after = limiter.acquire(session.get('username'), request.remote_addr)
+        if retry_after:
+            return jsonify({"error": "Too many attempts, please try again later"}), 429, retry_after_header(retry_after)
         
-        # Verify current password
-        cursor.execute("SELECT password FROM users WHERE id = ?", (session['user_id'],))
-        user = cursor.fetchone()
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT password FROM users WHERE id = ?", (session['user_id'],))
+            user = cursor.fetchone()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
-            
-        if user['password'] != current_password:
+        
+        # Verify and hash outside the write connection, the KDF is deliberately slow
+        if not check_password(current_password, user['password'])[0]:
             return jsonify({"error": "Current password is incorrect"}), 400
+        limiter.reset_user(session.get('username'))
+        new_hash = hash_password(new_password)
         
-        # Update password
-        cursor.execute("""
-            UPDATE users 
-            SET password = ?
-            WHERE id = ?
-        """, (new_password, session['user_id']))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Only replace the hash that was verified, not one changed meanwhile
+            cursor.execute("""
+                UPDATE users 
+                SET password = ?
+                WHERE id = ? AND password = ?
+            """, (new_hash, session['user_id'], user['password']))
+            changed = cursor.rowcount
+            conn.commit()
         
-        conn.commit()
+        if not changed:
+            return jsonify({"error": "Password was changed by another request, please try again"}), 409
         return jsonify({"message": "Password changed successfully"})
         
+    except PasswordBusyError:
+        return jsonify({"error": "The server is busy, please try again shortly"}), 503
     except Exception as e:
-        print(f"Error changing password: {str(e)}")
+        logger.error("Error changing password: %s", e)
         return jsonify({"error": f"Failed to change password: {str(e)}"}), 500
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,168 @@
+"""Structured logging: JSON lines through a non-blocking queue.
+
+``configure_logging()`` puts a QueueHandler on the root logger, so a log
+call only formats a record and enqueues it; a QueueListener thread turns
+records into one JSON object per line on stderr. Levels come from the
+environment:
+
+    LOG_LEVEL=INFO                                   # root level
+    LOG_LEVELS=dialogflow_handler=DEBUG,queries=DEBUG # per module
+
+Modules log with ``logging.getLogger(__name__)`` and %-style arguments,
+so nothing is formatted for records below the level.
+
+SQL is logged through ``log_query`` on the ``queries`` logger, which is
+off by default. ``request_context(debug=True)`` turns it on for one
+request (or task) only; the flag lives in a contextvar, so the normal path
+pays one lookup.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+query_logger = logging.getLogger('queries')
+
+_debug_queries = ContextVar('debug_queries', default=False)
+_request_id = ContextVar('request_id', default=None)
+
+# LogRecord attributes that are not user-supplied ``extra`` fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request id and extras"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """Resolves what depends on the calling thread, leaves the JSON to the listener"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.request_id = _request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_configure_lock = threading.Lock()
+
+def parse_levels(spec):
+    """'a=DEBUG,b.c=warning' -> {'a': 'DEBUG', 'b.c': 'WARNING'}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(level=None, levels=None, stream=None):
+    """Install the JSON queue logging once per process; later calls only adjust levels"""
+    global _listener
+    with _configure_lock:
+        root = logging.getLogger()
+        root.setLevel((level or os.environ.get('LOG_LEVEL', 'INFO')).upper())
+        query_logger.setLevel(logging.WARNING)
+        for name, name_level in (levels or parse_levels(os.environ.get('LOG_LEVELS'))).items():
+            logging.getLogger(name).setLevel(name_level)
+
+        if _listener is None:
+            records = queue.SimpleQueue()
+            output = logging.StreamHandler(stream or sys.stderr)
+            output.setFormatter(JsonFormatter())
+            _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+            _listener.start()
+            root.handlers[:] = [_ContextQueueHandler(records)]
+            atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _configure_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+_REQUEST_ID = re.compile(r'^[\w.:-]{1,64}$')
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+def current_request_id():
+    return _request_id.get()
+
+@contextmanager
+def request_context(request_id=None, debug=False):
+    """Tag log records with a request id and optionally log this request's SQL"""
+    id_token = _request_id.set(request_id or new_request_id())
+    debug_token = _debug_queries.set(bool(debug))
+    try:
+        yield
+    finally:
+        _debug_queries.reset(debug_token)
+        _request_id.reset(id_token)
+
+def query_debug_header_allowed():
+    """Per-request query logging from a header is opt-in, as it can write patient data"""
+    return os.environ.get('LOG_DEBUG_HEADER', '').lower() in ('1', 'true', 'yes')
+
+def http_request_context(get_header):
+    """request_context for an HTTP request, given a header lookup.
+
+    Keeps the caller's X-Request-ID when it looks like one; X-Debug-Queries
+    turns on query logging only where LOG_DEBUG_HEADER allows it.
+    """
+    request_id = get_header('X-Request-ID')
+    if not request_id or not _REQUEST_ID.match(request_id):
+        request_id = None
+    debug = bool(get_header('X-Debug-Queries')) and query_debug_header_allowed()
+    return request_context(request_id, debug)
+
+def log_query(query, params=()):
+    """Log an SQL statement and its parameters at DEBUG on the ``queries`` logger.
+
+    Emitted when that logger is enabled for DEBUG or the current request
+    asked for query logging; otherwise this is two cheap checks.
+    """
+    if _debug_queries.get():
+        record = query_logger.makeRecord(
+            query_logger.name, logging.DEBUG, __file__, 0, "query", (), None,
+            extra={'sql': ' '.join(query.split()), 'params': list(params)}
+        )
+        query_logger.handle(record)
+    elif query_logger.isEnabledFor(logging.DEBUG):
+        query_logger.debug("query", extra={'sql': ' '.join(query.split()), 'params': list(params)})
@@ -0,0 +1,266 @@
+"""Batch appointment scheduling and CSV/JSONL import.
+
+Rows are validated in memory against the compiled doctor schedules, users
+are checked with a few IN queries, and clashing slots (inside the batch and
+against existing bookings) are rejected in bulk. Accepted rows are written
+with ``executemany`` in chunked BEGIN IMMEDIATE transactions; each chunk
+re-checks its date range for slots booked since validation, and its bills
+are created with one INSERT ... SELECT over the new appointment ids.
+
+Usage: python appointment_import.py bookings.csv [--format jsonl] [--chunk-size N] [--no-bills] [--dry-run]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from availability import format_time, parse_time
+from db_connection import get_connection, get_read_connection, retry_on_busy
+from doctor_schedules import get_schedule_cache
+from user_cache import APPOINTMENTS, BILLS, invalidate_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+VALID_STATUSES = ('scheduled', 'confirmed', 'completed', 'rescheduled', 'cancelled')
+# Keep below SQLite's default host parameter limit
+_IN_BATCH = 900
+
+
+class ImportReport:
+    """Outcome of a batch: counts, rejected rows with reasons and throughput"""
+
+    def __init__(self):
+        self.total = 0
+        self.imported = 0
+        self.rejected = []
+        self.seconds = 0.0
+        self.dry_run = False
+
+    def reject(self, row_number, reason):
+        self.rejected.append((row_number, reason))
+
+    @property
+    def rows_per_second(self):
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        verb = "would import" if self.dry_run else "imported"
+        return (f"{self.total} rows: {self.imported} {verb}, {len(self.rejected)} rejected "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)")
+
+
+def _normalize(row, schedules):
+    """Row dict -> (user_id, doctor_name, date, time, type, status); ValueError says why not"""
+    try:
+        user_id = int(row.get('user_id'))
+    except (TypeError, ValueError):
+        raise ValueError("user_id must be an integer")
+
+    doctor_name = str(row.get('doctor_name') or row.get('doctor') or '').strip().title()
+    schedule = schedules.get(doctor_name)
+    if not schedule:
+        raise ValueError(f"unknown or inactive doctor '{doctor_name}'")
+
+    try:
+        day = datetime.strptime(str(row.get('appointment_date') or row.get('date') or '').strip(), '%Y-%m-%d')
+    except ValueError:
+        raise ValueError("appointment_date must be YYYY-MM-DD")
+    try:
+        minute = parse_time(str(row.get('appointment_time') or row.get('time') or ''))
+    except ValueError:
+        raise ValueError("appointment_time must be HH:MM")
+    if not schedule.covers(day.weekday(), minute):
+        raise ValueError(f"Dr. {doctor_name} does not work at {format_time(minute)} on {day:%A}s")
+
+    appointment_type = str(row.get('appointment_type') or row.get('type') or 'General Checkup').strip()
+    status = str(row.get('status') or 'scheduled').strip().lower()
+    if status not in VALID_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(VALID_STATUSES)}")
+    return user_id, doctor_name, day.strftime('%Y-%m-%d'), format_time(minute), appointment_type, status
+
+
+def _existing_users(user_ids):
+    found = set()
+    user_ids = list(user_ids)
+    with get_read_connection() as conn:
+        for i in range(0, len(user_ids), _IN_BATCH):
+            batch = user_ids[i:i + _IN_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            found.update(row['id'] for row in conn.execute(
+                f"SELECT id FROM users WHERE id IN ({placeholders})", batch
+            ))
+    return found
+
+
+@retry_on_busy
+def _insert_chunk(chunk, create_bills, dry_run):
+    """Write one chunk in one transaction; returns (inserted, [(row number, reason)])"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Chunks are sorted by date, so this range is tight
+            cursor.execute("""
+                SELECT doctor_name, appointment_date, appointment_time
+                FROM appointments
+                WHERE appointment_date BETWEEN ? AND ?
+                AND status != 'cancelled'
+            """, (chunk[0][1][2], chunk[-1][1][2]))
+            taken = {tuple(row) for row in cursor.fetchall()}
+
+            rows = []
+            conflicts = []
+            for row_number, values in chunk:
+                if values[5] != 'cancelled' and values[1:4] in taken:
+                    conflicts.append((row_number, "slot is already booked"))
+                else:
+                    rows.append(values)
+            if dry_run or not rows:
+                return len(rows), conflicts
+
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM appointments")
+            last_id = cursor.fetchone()['id']
+            cursor.executemany("""
+                INSERT INTO appointments
+                (user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            if create_bills:
+                # AUTOINCREMENT ids only grow, and we hold the write lock, so
+                # everything above last_id was inserted by this chunk
+                cursor.execute("""
+                    INSERT INTO bills (user_id, appointment_id, amount, description, status, due_date)
+                    SELECT user_id, id,
+                           CASE WHEN appointment_type = 'General Checkup' THEN 150.00 ELSE 200.00 END,
+                           appointment_type || ' Appointment',
+                           CASE WHEN status = 'cancelled' THEN 'CANCELLED' ELSE 'PENDING' END,
+                           date(appointment_date, '+30 days')
+                    FROM appointments
+                    WHERE id > ?
+                """, (last_id,))
+            conn.commit()
+            return len(rows), conflicts
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+
+def schedule_batch(rows, chunk_size=DEFAULT_CHUNK_SIZE, create_bills=True, dry_run=False):
+    """Validate and insert many appointments; returns an ImportReport.
+
+    ``rows`` is an iterable of dicts (user_id, doctor_name, appointment_date,
+    appointment_time, optional appointment_type and status) or of
+    (row number, dict) pairs. A dict may carry an ``_error`` key to reject
+    it outright, which the file readers use for unparseable lines.
+    """
+    start = time.perf_counter()
+    report = ImportReport()
+    report.dry_run = dry_run
+    schedules = get_schedule_cache().schedules()
+
+    accepted = []
+    slots = {}
+    for index, item in enumerate(rows, 1):
+        row_number, row = item if isinstance(item, tuple) else (index, item)
+        report.total += 1
+        if row.get('_error'):
+            report.reject(row_number, row['_error'])
+            continue
+        try:
+            values = _normalize(row, schedules)
+        except ValueError as e:
+            report.reject(row_number, str(e))
+            continue
+        if values[5] != 'cancelled':
+            slot = values[1:4]
+            if slot in slots:
+                report.reject(row_number, f"same slot as row {slots[slot]}")
+                continue
+            slots[slot] = row_number
+        accepted.append((row_number, values))
+
+    known_users = _existing_users({values[0] for _, values in accepted})
+    valid = []
+    for row_number, values in accepted:
+        if values[0] in known_users:
+            valid.append((row_number, values))
+        else:
+            report.reject(row_number, f"unknown user {values[0]}")
+
+    valid.sort(key=lambda item: (item[1][2], item[1][3]))
+    for i in range(0, len(valid), chunk_size):
+        chunk = valid[i:i + chunk_size]
+        try:
+            inserted, conflicts = _insert_chunk(chunk, create_bills, dry_run)
+        except Exception as e:
+            logger.error("Error importing rows %s-%s: %s", chunk[0][0], chunk[-1][0], e)
+            for row_number, _ in chunk:
+                report.reject(row_number, f"chunk failed: {e}")
+            continue
+        report.imported += inserted
+        if inserted and not dry_run:
+            for user_id in {values[0] for _, values in chunk}:
+                invalidate_user(user_id, APPOINTMENTS, BILLS)
+        for row_number, reason in conflicts:
+            report.reject(row_number, reason)
+
+    report.rejected.sort()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def read_csv(path):
+    """(row number, dict) pairs; row 1 is the header"""
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row_number, row in enumerate(csv.DictReader(handle), 2):
+            yield row_number, row
+
+
+def read_jsonl(path):
+    """(line number, dict) pairs, skipping blank lines"""
+    with open(path, encoding='utf-8') as handle:
+        for line_number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                row = {'_error': f"invalid JSON: {e.msg}"}
+            if not isinstance(row, dict):
+                row = {'_error': "line is not a JSON object"}
+            yield line_number, row
+
+
+def import_file(path, file_format=None, **options):
+    """Import a .csv or .jsonl file of appointments with schedule_batch"""
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    reader = read_jsonl if file_format == 'jsonl' else read_csv
+    return schedule_batch(reader(path), **options)
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Import appointments from CSV or JSONL")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--no-bills', action='store_true', help="do not create a bill per appointment")
+    parser.add_argument('--dry-run', action='store_true', help="validate and check conflicts only")
+    parser.add_argument('--show', type=int, default=20, help="rejected rows to list")
+    args = parser.parse_args()
+
+    from db_connection import initialize_database
+    initialize_database()
+    report = import_file(args.path, args.format, chunk_size=args.chunk_size,
+                         create_bills=not args.no_bills, dry_run=args.dry_run)
+    print(report.summary())
+    for row_number, reason in report.rejected[:args.show]:
+        print(f"  row {row_number}: {reason}")
+    if len(report.rejected) > args.show:
+        print(f"  ... and {len(report.rejected) - args.show} more")
+    sys.exit(1 if report.rejected else 0)
@@ -1,11 +1,35 @@
-from db_connection import get_db
+from db_connection import get_connection, get_read_connection, retry_on_busy
 from datetime import datetime, timedelta
-import json
+from collections import namedtuple
+import logging
+import sqlite3
+from availability import AvailabilityEngine, WEEKDAYS, format_time, iter_slots, parse_time, slot_time, to_date
+from doctor_schedules import get_schedule_cache
+from appointment_import import DEFAULT_CHUNK_SIZE, schedule_batch
+from user_cache import APPOINTMENTS, BILLS, invalidate_user
+
+logger = logging.getLogger(__name__)
+
+# BookingResult.status values
+BOOKED = 'booked'
+SLOT_TAKEN = 'slot_taken'
+UNAVAILABLE = 'unavailable'
+FAILED = 'failed'
+
+# ``alternative`` is the nearest free (date, time) with the same doctor, if any
+BookingResult = namedtuple('BookingResult', ['status', 'appointment_id', 'message', 'alternative'])
 
 class AppointmentScheduler:
     @staticmethod
     def schedule_appointment(user_id, doctor_name, appointment_date, appointment_type, appointment_time):
-        """Schedule a new appointment"""
+        """Schedule a new appointment, returning its id or None"""
+        return AppointmentScheduler.book_appointment(
+            user_id, doctor_name, appointment_date, appointment_type, appointment_time
+        ).appointment_id
+
+    @staticmethod
+    def book_appointment(user_id, doctor_name, appointment_date, appointment_type, appointment_time):
+        """Schedule a new appointment and return a BookingResult"""
         try:
             # Convert date string to proper format if needed
             if isinstance(appointment_date, str) and appointment_date.lower() == 'tomorrow':
@@ -14,97 +38,137 @@ class AppointmentScheduler:
             # Capitalize doctor name properly
             doctor_name = doctor_name.title()
             
-            print(f"Scheduling appointment for user {user_id} with Dr. {doctor_name}")
-            print(f"Date: {appointment_date}, Time: {appointment_time}")
+            logger.debug("Scheduling appointment for user %s with Dr. %s", user_id, doctor_name)
+            logger.debug("Date: %s, Time: %s", appointment_date, appointment_time)
             
-            conn = get_db()
+            return AppointmentScheduler._book_appointment(
+                user_id, doctor_name, appointment_date, appointment_type, appointment_time
+            )
+        except Exception as e:
+            logger.error("Error scheduling appointment: %s", e)
+            return BookingResult(FAILED, None, "The appointment could not be booked.", None)
+
+    @staticmethod
+    def schedule_appointments(bookings, chunk_size=DEFAULT_CHUNK_SIZE, create_bills=True):
+        """Schedule many appointments at once (clinic onboarding, vaccination drives).
+
+        ``bookings`` are dicts with the schedule_appointment fields; returns
+        an ImportReport with the rejected rows and the import rate.
+        """
+        return schedule_batch(bookings, chunk_size=chunk_size, create_bills=create_bills)
+
+    @staticmethod
+    @retry_on_busy
+    def _book_appointment(user_id, doctor_name, appointment_date, appointment_type, appointment_time):
+        """Validate the slot and write the appointment plus its bill in one transaction.
+
+        BEGIN IMMEDIATE takes the write lock before the availability check,
+        so no other writer (in any process) can book the slot in between.
+        The unique partial index on active slots backs this up for writers
+        that skip the check.
+        """
+        day = datetime.strptime(appointment_date.strip(), '%Y-%m-%d')
+        minute = parse_time(appointment_time)
+        # One spelling per slot, so '9:00' and '09:00' (or '2026-1-5' and
+        # '2026-01-05') hit the same index entry
+        appointment_date = day.strftime('%Y-%m-%d')
+        appointment_time = format_time(minute)
+        
+        with get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Check if doctor exists and is active; passing the connection
+                # makes the cache confirm it is current inside this transaction
+                schedule = get_schedule_cache().get(doctor_name, conn)
+            
+                if not schedule:
+                    logger.debug("Doctor %s not found or not active", doctor_name)
+                    return BookingResult(UNAVAILABLE, None, f"Dr. {doctor_name} is not available for booking.", None)
+            
+                # Check if slot is within doctor's schedule
+                weekday = day.weekday()
+                engine = AvailabilityEngine([schedule])
+            
+                if not schedule.covers(weekday, minute):
+                    if schedule.ranges[weekday]:
+                        logger.debug("Appointment time %s is outside doctor's working hours", appointment_time)
+                        message = f"Dr. {doctor_name} does not see patients at {appointment_time}."
+                    else:
+                        logger.debug("Doctor %s does not work on %s", doctor_name, WEEKDAYS[weekday])
+                        message = f"Dr. {doctor_name} does not work on {WEEKDAYS[weekday].title()}s."
+                    return BookingResult(UNAVAILABLE, None, message,
+                                         engine.nearest_free(cursor, doctor_name, day.date(), minute))
+            
+                # Check if slot is available
+                cursor.execute("""
+                    SELECT COUNT(*) as count 
+                    FROM appointments 
+                    WHERE doctor_name = ? 
+                    AND appointment_date = ? 
+                    AND appointment_time = ? 
+                    AND status != 'cancelled'
+                """, (doctor_name, appointment_date, appointment_time))
+            
+                if cursor.fetchone()['count'] > 0:
+                    logger.debug("Slot %s is already booked", appointment_time)
+                    return BookingResult(SLOT_TAKEN, None,
+                                         f"Dr. {doctor_name} is already booked at {appointment_time} on {appointment_date}.",
+                                         engine.nearest_free(cursor, doctor_name, day.date(), minute))
+            
+                # Insert the appointment
+                cursor.execute("""
+                    INSERT INTO appointments 
+                    (user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
+                    VALUES (?, ?, ?, ?, ?, 'scheduled')
+                """, (user_id, doctor_name, appointment_date, appointment_time, appointment_type))
             
-            # Check if doctor exists and is active
-            cursor.execute("""
-                SELECT * FROM doctors 
-                WHERE name = ? AND status = 'active'
-            """, (doctor_name,))
-            doctor = cursor.fetchone()
-            
-            if not doctor:
-                print(f"Doctor {doctor_name} not found or not active")
-                return None
-            
-            # Check if slot is within doctor's schedule
-            day_of_week = datetime.strptime(appointment_date, '%Y-%m-%d').strftime('%A').lower()
-            schedule = json.loads(doctor['schedule'])
-            
-            if day_of_week not in schedule:
-                print(f"Doctor {doctor_name} does not work on {day_of_week}")
-                return None
-            
-            work_hours = schedule[day_of_week].split('-')
-            work_start = datetime.strptime(work_hours[0], '%H:%M').time()
-            work_end = datetime.strptime(work_hours[1], '%H:%M').time()
-            appointment_time_obj = datetime.strptime(appointment_time, '%H:%M').time()
-            
-            if appointment_time_obj < work_start or appointment_time_obj > work_end:
-                print(f"Appointment time {appointment_time} is outside doctor's working hours")
-                return None
-            
-            # Check if slot is available
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM appointments 
-                WHERE doctor_name = ? 
-                AND appointment_date = ? 
-                AND appointment_time = ? 
-                AND status != 'cancelled'
-            """, (doctor_name, appointment_date, appointment_time))
-            
-            if cursor.fetchone()['count'] > 0:
-                print(f"Slot {appointment_time} is already booked")
-                return None
-            
-            # Insert the appointment
-            cursor.execute("""
-                INSERT INTO appointments 
-                (user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
-                VALUES (?, ?, ?, ?, ?, 'scheduled')
-            """, (user_id, doctor_name, appointment_date, appointment_time, appointment_type))
-            
-            appointment_id = cursor.lastrowid
-            
-            # Create a bill for the appointment
-            amount = 150.00 if appointment_type == 'General Checkup' else 200.00
-            cursor.execute("""
-                INSERT INTO bills 
-                (user_id, appointment_id, amount, description, status, due_date)
-                VALUES (?, ?, ?, ?, 'PENDING', date(?, '+30 days'))
-            """, (user_id, appointment_id, amount, f"{appointment_type} Appointment", appointment_date))
+                appointment_id = cursor.lastrowid
             
-            conn.commit()
-            print(f"Appointment scheduled successfully with ID: {appointment_id}")
-            return appointment_id
+                # Create a bill for the appointment
+                amount = 150.00 if appointment_type == 'General Checkup' else 200.00
+                cursor.execute("""
+                    INSERT INTO bills 
+                    (user_id, appointment_id, amount, description, status, due_date)
+                    VALUES (?, ?, ?, ?, 'PENDING', date(?, '+30 days'))
+                """, (user_id, appointment_id, amount, f"{appointment_type} Appointment", appointment_date))
             
-        except Exception as e:
-            print(f"Error scheduling appointment: {str(e)}")
-            if 'conn' in locals():
+                conn.commit()
+                invalidate_user(user_id, APPOINTMENTS, BILLS)
+                logger.info("Appointment scheduled successfully with ID: %s", appointment_id)
+                return BookingResult(BOOKED, appointment_id, "Appointment booked.", None)
+            except sqlite3.IntegrityError:
+                # The unique slot index caught a booking that got past the check
                 conn.rollback()
-            return None
-        finally:
-            if 'conn' in locals():
-                conn.close()
+                logger.debug("Slot %s was taken concurrently", appointment_time)
+                return BookingResult(SLOT_TAKEN, None,
+                                     f"Dr. {doctor_name} was just booked at {appointment_time} on {appointment_date}.",
+                                     engine.nearest_free(cursor, doctor_name, day.date(), minute))
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
 
     @staticmethod
     def cancel_appointment(appointment_id, user_id):
         """Cancel an appointment"""
         try:
-            conn = get_db()
+            return AppointmentScheduler._cancel_appointment(appointment_id, user_id)
+        except Exception as e:
+            logger.error("Error cancelling appointment: %s", e)
+            return False
+
+    @staticmethod
+    @retry_on_busy
+    def _cancel_appointment(appointment_id, user_id):
+        with get_connection() as conn:
             cursor = conn.cursor()
-            
+        
             cursor.execute("""
                 UPDATE appointments 
                 SET status = 'cancelled' 
                 WHERE id = ? AND user_id = ?
             """, (appointment_id, user_id))
-            
+        
             if cursor.rowcount > 0:
                 cursor.execute("""
                     UPDATE bills 
@@ -112,231 +176,189 @@ class AppointmentScheduler:
                     WHERE appointment_id = ?
                 """, (appointment_id,))
                 conn.commit()
+                invalidate_user(user_id, APPOINTMENTS, BILLS)
                 return True
-            return False
+        return False
+
+    @staticmethod
+    def reschedule_appointment(appointment_id, user_id, new_date, new_time, expected_version=None):
+        """Move an appointment to a new slot with the same doctor.
+
+        Optimistic: the update only applies if the row still has the version
+        that was read (or ``expected_version``, when the caller showed the
+        user an earlier copy), so concurrent edits never overwrite each other.
+        """
+        try:
+            return AppointmentScheduler._reschedule_appointment(
+                appointment_id, user_id, new_date, new_time, expected_version
+            )
         except Exception as e:
-            print(f"Error cancelling appointment: {str(e)}")
+            logger.error("Error rescheduling appointment: %s", e)
             return False
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     @staticmethod
-    def reschedule_appointment(appointment_id, user_id, new_date, new_time):
-        conn = get_db()
-        cursor = conn.cursor()
+    @retry_on_busy
+    def _reschedule_appointment(appointment_id, user_id, new_date, new_time, expected_version):
+        minute = parse_time(new_time)
+        new_time = format_time(minute)
+        day = datetime.strptime(new_date.strip(), '%Y-%m-%d')
+        new_date = day.strftime('%Y-%m-%d')
+        weekday = day.weekday()
         
-        try:
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
             # Verify appointment belongs to user
             cursor.execute("""
-                SELECT * FROM appointments 
+                SELECT doctor_name, version FROM appointments 
                 WHERE id = ? AND user_id = ? AND status != 'cancelled'
             """, (appointment_id, user_id))
             appointment = cursor.fetchone()
-            
-            if not appointment:
-                return False
-            
-            # Validate new time is during clinic hours
-            time_obj = datetime.strptime(new_time, '%H:%M').time()
-            if time_obj.hour < 8 or time_obj.hour > 18:
+        
+        if not appointment:
+            return False
+        
+        # Validate the new time against the doctor's working hours
+        schedule = get_schedule_cache().get(appointment['doctor_name'])
+        if not schedule or not schedule.covers(weekday, minute):
+            return False
+        
+        version = appointment['version'] if expected_version is None else expected_version
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # A taken slot fails on the unique slot index, a concurrent
+                # edit leaves no row with the expected version
+                cursor.execute("""
+                    UPDATE appointments 
+                    SET appointment_date = ?,
+                        appointment_time = ?,
+                        status = 'rescheduled',
+                        version = version + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND user_id = ? AND version = ? AND status != 'cancelled'
+                """, (new_date, new_time, appointment_id, user_id, version))
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                logger.debug("Slot %s on %s is already booked", new_time, new_date)
                 return False
             
-            # Check if new slot is available
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM appointments 
-                WHERE appointment_date = ? AND appointment_time = ? AND status != 'cancelled'
-            """, (new_date, new_time))
-            result = cursor.fetchone()
-            
-            if result['count'] > 0:
+            if cursor.rowcount == 0:
+                conn.rollback()
+                logger.debug("Appointment %s changed since version %s, not rescheduled", appointment_id, version)
                 return False
-            
-            # Reschedule the appointment
-            cursor.execute("""
-                UPDATE appointments 
-                SET appointment_date = ?,
-                    appointment_time = ?,
-                    status = 'rescheduled',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (new_date, new_time, appointment_id))
-            
             conn.commit()
-            return True
-            
-        except Exception as e:
-            print(f"Error rescheduling appointment: {str(e)}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+        invalidate_user(user_id, APPOINTMENTS)
+        return True
 
     @staticmethod
     def get_available_slots(date):
         """Get available appointment slots for a given date"""
         try:
-            conn = get_db()
-            cursor = conn.cursor()
+            day = to_date(date)
+            with get_read_connection() as conn:
+                cursor = conn.cursor()
+                engine = AvailabilityEngine(get_schedule_cache().schedules().values())
+                days = engine.free_slots(cursor, day, day)
             
-            # Convert date string to proper format if needed
-            if isinstance(date, str) and date.lower() == 'tomorrow':
-                date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-            
-            # Get all doctors
-            cursor.execute("SELECT * FROM doctors WHERE status = 'active'")
-            doctors = cursor.fetchall()
-            
-            # Get booked slots
-            cursor.execute("""
-                SELECT appointment_time, doctor_name 
-                FROM appointments 
-                WHERE appointment_date = ? AND status != 'cancelled'
-            """, (date,))
-            booked_slots = cursor.fetchall()
-            
-            # Generate available slots (9 AM to 5 PM, 30-minute intervals)
             available_slots = []
-            for doctor in doctors:
-                doctor_name = doctor['name']
-                schedule = json.loads(doctor['schedule'])
-                
-                # Get day of week for the date
-                day_of_week = datetime.strptime(date, '%Y-%m-%d').strftime('%A').lower()
-                
-                if day_of_week in schedule:
-                    work_hours = schedule[day_of_week].split('-')
-                    start_time = datetime.strptime(work_hours[0], '%H:%M')
-                    end_time = datetime.strptime(work_hours[1], '%H:%M')
-                    
-                    current_slot = start_time
-                    while current_slot < end_time:
-                        slot_time = current_slot.strftime('%H:%M')
-                        # Check if slot is not booked for this doctor
-                        if not any(b['appointment_time'] == slot_time and b['doctor_name'] == doctor_name for b in booked_slots):
-                            available_slots.append({
-                                'time': slot_time,
-                                'doctor': doctor_name
-                            })
-                        current_slot += timedelta(minutes=30)
-            
+            for _, doctors in days:
+                for doctor_name, free in doctors:
+                    available_slots.extend({'time': slot_time(i), 'doctor': doctor_name} for i in iter_slots(free))
             return available_slots
         except Exception as e:
-            print(f"Error getting available slots: {str(e)}")
+            logger.error("Error getting available slots: %s", e)
             return []
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     @staticmethod
     def get_appointment_details(appointment_id):
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT a.*, u.email, u.phone
-            FROM appointments a
-            JOIN users u ON a.user_id = u.id
-            WHERE a.id = ?
-        """, (appointment_id,))
-        appointment = cursor.fetchone()
-        conn.close()
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT a.*, u.email, u.phone
+                FROM appointments a
+                JOIN users u ON a.user_id = u.id
+                WHERE a.id = ?
+            """, (appointment_id,))
+            appointment = cursor.fetchone()
         return appointment
 
     @staticmethod
     def get_available_doctors(date=None, time=None):
         """Get list of available doctors"""
         try:
-            conn = get_db()
-            cursor = conn.cursor()
-            
-            # Get all active doctors
-            cursor.execute("""
-                SELECT DISTINCT doctor_name 
-                FROM appointments 
-                WHERE status != 'cancelled'
-                UNION
-                SELECT 'Smith' as doctor_name
-                UNION
-                SELECT 'Johnson' as doctor_name
-                UNION
-                SELECT 'Williams' as doctor_name
-            """)
+            with get_read_connection() as conn:
+                cursor = conn.cursor()
             
-            doctors = cursor.fetchall()
+                # Get all active doctors
+                cursor.execute("""
+                    SELECT DISTINCT doctor_name 
+                    FROM appointments 
+                    WHERE status != 'cancelled'
+                    UNION
+                    SELECT 'Smith' as doctor_name
+                    UNION
+                    SELECT 'Johnson' as doctor_name
+                    UNION
+                    SELECT 'Williams' as doctor_name
+                """)
+            
+                doctors = cursor.fetchall()
             return [{'name': doc['doctor_name'], 'speciality': 'General Practice'} for doc in doctors]
         except Exception as e:
-            print(f"Error getting available doctors: {str(e)}")
+            logger.error("Error getting available doctors: %s", e)
             return []
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     @staticmethod
     def get_next_available_slots(days=7):
         """Get next available appointment slots for the next X days"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
         try:
+            start = datetime.now().date()
+            end = start + timedelta(days=days - 1)
+            with get_read_connection() as conn:
+                cursor = conn.cursor()
+                engine = AvailabilityEngine(get_schedule_cache().schedules().values())
+                free_days = engine.free_slots(cursor, start, end)
+            
+            # Ordered by date, then time, then doctor
             available_slots = []
-            current_date = datetime.now().date()
-            
-            for i in range(days):
-                check_date = current_date + timedelta(days=i)
-                if check_date.weekday() < 7:  # Monday to Sunday
-                    # Get booked slots for this date
-                    cursor.execute("""
-                        SELECT appointment_time, doctor_id 
-                        FROM appointments 
-                        WHERE appointment_date = ? 
-                        AND status != 'cancelled'
-                    """, (check_date.strftime('%Y-%m-%d'),))
-                    booked_slots = cursor.fetchall()
-                    
-                    # Get all doctors
-                    cursor.execute("SELECT * FROM doctors WHERE status = 'active'")
-                    doctors = cursor.fetchall()
-                    
-                    # Generate available slots
-                    for hour in range(8, 18):  # 8 AM to 6 PM
-                        time_slot = f"{hour:02d}:00"
-                        for doctor in doctors:
-                            if not any(b['appointment_time'] == time_slot and b['doctor_id'] == doctor['id'] for b in booked_slots):
-                                available_slots.append({
-                                    'date': check_date.strftime('%Y-%m-%d'),
-                                    'time': time_slot,
-                                    'doctor': doctor['name']
-                                })
-            
+            for check_date, doctors in free_days:
+                any_free = 0
+                for _, free in doctors:
+                    any_free |= free
+                for i in iter_slots(any_free):
+                    bit = 1 << i
+                    time_slot = slot_time(i)
+                    for doctor_name, free in doctors:
+                        if free & bit:
+                            available_slots.append({
+                                'date': check_date,
+                                'time': time_slot,
+                                'doctor': doctor_name
+                            })
             return available_slots
-            
         except Exception as e:
-            print(f"Error getting next available slots: {str(e)}")
+            logger.error("Error getting next available slots: %s", e)
             return []
-        finally:
-            conn.close()
 
     @staticmethod
     def confirm_appointment(appointment_id):
         """Confirm a scheduled appointment"""
         try:
-            conn = get_db()
-            cursor = conn.cursor()
+            with get_connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute("""
-                UPDATE appointments 
-                SET status = 'confirmed' 
-                WHERE id = ? AND status = 'scheduled'
-            """, (appointment_id,))
+                cursor.execute("""
+                    UPDATE appointments 
+                    SET status = 'confirmed' 
+                    WHERE id = ? AND status = 'scheduled'
+                """, (appointment_id,))
             
-            success = cursor.rowcount > 0
-            if success:
-                conn.commit()
+                success = cursor.rowcount > 0
+                if success:
+                    conn.commit()
+                    cursor.execute("SELECT user_id FROM appointments WHERE id = ?", (appointment_id,))
+                    invalidate_user(cursor.fetchone()['user_id'], APPOINTMENTS)
             return success
         except Exception as e:
-            print(f"Error confirming appointment: {str(e)}")
+            logger.error("Error confirming appointment: %s", e)
             return False
-        finally:
-            if 'conn' in locals():
-                conn.close()
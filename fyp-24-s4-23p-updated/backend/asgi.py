@@ -0,0 +1,176 @@
+"""ASGI entry point with a non-blocking chat endpoint.
+
+``POST /chat`` is served natively on the event loop: SQLite work runs on the
+bounded DB executor and the Dialogflow call is awaited, so one process can
+hold hundreds of chat requests in flight. Clients that ask for
+``text/event-stream`` get listings as Server-Sent Events, a row per event.
+Every other route is the regular Flask app behind asgiref's WSGI adapter.
+
+Run with any ASGI server, e.g.::
+
+    uvicorn asgi:application --workers 2
+"""
+import json
+import logging
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+from werkzeug.utils import redirect
+from app import app, dialogflow
+from app_logging import current_request_id, http_request_context
+from chat_service import SSE_DONE, chat_reply_async, chat_reply_stream_async, sse_event, wants_stream
+from db_connection import get_db_executor, run_in_db_executor, shutdown_db_executor
+
+logger = logging.getLogger(__name__)
+
+MAX_CHAT_BODY = 64 * 1024
+
+flask_application = WsgiToAsgi(app)
+
+
+def _build_environ(scope, body=b''):
+    """Just enough of a WSGI environ for Flask's session interface and Request"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ[key] = value.decode('latin-1')
+        elif key != 'CONTENT_LENGTH':
+            environ[f'HTTP_{key}'] = value.decode('latin-1')
+    return environ
+
+
+async def _read_body(receive):
+    """Request body, or None if the client went away or sent too much"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_CHAT_BODY:
+            return None
+        if not message.get('more_body', False):
+            return body
+
+
+async def _send_start(send, response):
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+
+async def _send(send, response):
+    await _send_start(send, response)
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def _send_events(send, first, stream):
+    """Body of a streamed reply: each chunk as it is produced, then the done event"""
+    try:
+        if first is not None:
+            await send({'type': 'http.response.body', 'body': sse_event(first).encode(), 'more_body': True})
+        async for chunk in stream:
+            await send({'type': 'http.response.body', 'body': sse_event(chunk).encode(), 'more_body': True})
+    except Exception as e:
+        logger.error("Error streaming reply: %s", e)
+        await send({'type': 'http.response.body', 'more_body': True,
+                    'body': sse_event("Sorry, there was an error processing your request.").encode()})
+    await send({'type': 'http.response.body', 'body': SSE_DONE.encode()})
+
+
+def _header(scope, name):
+    """First value of a request header, or None"""
+    wanted = name.lower().encode('latin-1')
+    for key, value in scope.get('headers', []):
+        if key.lower() == wanted:
+            return value.decode('latin-1')
+    return None
+
+
+async def chat_endpoint(scope, receive, send):
+    with http_request_context(lambda name: _header(scope, name)):
+        await _chat(scope, receive, send)
+
+
+async def _chat(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        await _send(send, app.response_class('Request body too large', status=413))
+        return
+
+    request = Request(_build_environ(scope, body))
+    session_interface = app.session_interface
+    # The session store is SQLite, so loading and saving run on the DB executor too
+    session = await run_in_db_executor(session_interface.open_session, app, request)
+    if session is None:
+        session = session_interface.make_null_session(app)
+
+    user_id = session.get('user_id')
+    if user_id is None:
+        await _send(send, redirect(f"{scope.get('root_path', '')}/login"))
+        return
+
+    stream = None
+    try:
+        payload = json.loads(body)
+        message = payload.get('message', '')
+        if wants_stream(request.headers.get('Accept'), payload):
+            # Wait for the first chunk so session changes go out with the headers
+            stream = chat_reply_stream_async(dialogflow, user_id, message)
+            reply = await stream.__anext__()
+        else:
+            reply = await chat_reply_async(dialogflow, user_id, message)
+    except StopAsyncIteration:
+        reply = None
+    except Exception as e:
+        logger.error("Error processing request: %s", e)
+        reply = "Sorry, there was an error processing your request."
+
+    if isinstance(reply, dict) and reply.get('action') == 'logout':
+        session.clear()
+
+    if stream is not None:
+        response = app.response_class(mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    else:
+        response = app.response_class(json.dumps({'response': reply}), mimetype='application/json')
+    response.headers['X-Request-ID'] = current_request_id()
+    if not session_interface.is_null_session(session):
+        await run_in_db_executor(session_interface.save_session, app, session, response)
+    if stream is None:
+        await _send(send, response)
+        return
+    await _send_start(send, response)
+    await _send_events(send, reply, stream)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_db_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            shutdown_db_executor(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/chat' and scope['method'] == 'POST':
+        await chat_endpoint(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
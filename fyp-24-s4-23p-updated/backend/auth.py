@@ -1,67 +1,112 @@
 import sqlite3
-from db_connection import get_db
+import logging
+from db_connection import get_connection, get_read_connection
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import session, redirect, url_for
+from user_cache import PROFILE, invalidate_user
+from passwords import PasswordBusyError, check_password, hash_password
 
-def register_user(username, password, email, phone=None, address=None, emergency_contact=None):
-    """Register a new user"""
+logger = logging.getLogger(__name__)
+
+
+def register_user(username, password, email, phone=None, address=None, emergency_contact=None,
+                  first_name=None, last_name=''):
+    """Register a new user and their profile in one transaction"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Check if username already exists
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            return False, "Username already exists"
-        
-        # Insert new user
-        cursor.execute("""
-            INSERT INTO users (username, password, email, phone, address, emergency_contact)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (username, password, email, phone, address, emergency_contact))
-        
-        user_id = cursor.lastrowid
-        conn.commit()
-        
-        # Create sample data for new user
-        create_sample_data(user_id)
+        # Hash before taking the write connection, the KDF is deliberately slow
+        password_hash = hash_password(password)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                user_id = insert_patient(cursor, username, password_hash, email, phone, address,
+                                         emergency_contact, first_name, last_name)
+                conn.commit()
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                return False, duplicate_reason(e)
         
+        invalidate_user(user_id, PROFILE)
         return True, {"id": user_id, "username": username}
+    except PasswordBusyError:
+        return False, "The server is busy, please try again shortly"
     except Exception as e:
-        print(f"Error in user registration: {str(e)}")
+        logger.error("Error in user registration: %s", e)
         return False, "Registration failed"
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+def insert_patient(cursor, username, password_hash, email, phone=None, address=None, emergency_contact=None,
+                   first_name=None, last_name=''):
+    """Insert a user and their blank profile; returns the new user id.
+
+    Relies on the UNIQUE constraints on username and email instead of
+    checking first: a duplicate raises sqlite3.IntegrityError before the
+    profile is written, and only that statement is undone, so the caller's
+    transaction can go on.
+    """
+    cursor.execute("""
+        INSERT INTO users (username, password, email, phone, address, emergency_contact)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (username, password_hash, email, phone, address, emergency_contact))
+    user_id = cursor.lastrowid
+    cursor.execute("""
+        INSERT INTO patient_profiles (user_id, first_name, last_name, blood_type, allergies)
+        VALUES (?, ?, ?, 'Not provided', 'Not provided')
+    """, (user_id, first_name or username, last_name or ''))
+    return user_id
+
+def duplicate_reason(error):
+    """User-facing reason for an IntegrityError from insert_patient"""
+    message = str(error)
+    if 'users.username' in message:
+        return "Username already exists"
+    if 'users.email' in message:
+        return "Email is already registered"
+    return "Registration failed"
 
 def login_user(username, password):
     """Login a user"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, username, status 
-            FROM users 
-            WHERE username = ? AND password = ?
-        """, (username, password))
-        
-        user = cursor.fetchone()
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT id, username, password, status 
+                FROM users 
+                WHERE username = ?
+            """, (username,))
+            
+            user = cursor.fetchone()
         
-        if not user:
+        # A missing user still pays for a dummy hash, so timing does not tell which names exist
+        matches, new_hash = check_password(password, user['password'] if user else None)
+        if not matches:
             return False, "Invalid username or password"
+        if new_hash:
+            upgrade_password_hash(user['id'], user['password'], new_hash)
             
         if user['status'] == 'deactivated':
             return False, "Account is deactivated"
             
         return True, {"id": user['id'], "username": user['username']}
+    except PasswordBusyError:
+        return False, "The server is busy, please try again shortly"
     except Exception as e:
-        print(f"Error in user login: {str(e)}")
+        logger.error("Error in user login: %s", e)
         return False, "Login failed"
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+def upgrade_password_hash(user_id, old_hash, new_hash):
+    """Replace a plaintext or outdated hash after a successful login.
+
+    Only if the row still holds ``old_hash``, so a password changed in the
+    meantime is never overwritten. A failure here does not fail the login.
+    """
+    try:
+        with get_connection() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                         (new_hash, user_id, old_hash))
+            conn.commit()
+    except Exception as e:
+        logger.error("Error upgrading password hash for user_id %s: %s", user_id, e)
 
 def logout_user():
     """Logout a user"""
@@ -69,76 +114,48 @@ def logout_user():
         session.clear()
         return True, "Logged out successfully"
     except Exception as e:
-        print(f"Error in user logout: {str(e)}")
+        logger.error("Error in user logout: %s", e)
         return False, "Logout failed"
 
-def create_sample_data(user_id):
-    """Create sample data for a new user."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Get user's username
-        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        if not user:
-            return False
-            
-        # Create patient profile with all fields set to 'Not provided'
-        cursor.execute("""
-            INSERT INTO patient_profiles (user_id, first_name, last_name, blood_type, allergies)
-            VALUES (?, ?, '', 'Not provided', 'Not provided')
-        """, (user_id, user['username']))
-
-        conn.commit()
-        print(f"Sample data created for user_id: {user_id}")
-        return True
-    except Exception as e:
-        print(f"Error creating sample data: {str(e)}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
-
 def reset_password(token, new_password):
     """Reset password using token"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Find valid token
-        cursor.execute("""
-            SELECT user_id FROM password_resets 
-            WHERE token = ? AND expiry > CURRENT_TIMESTAMP 
-            AND used = 0
-        """, (token,))
-        reset = cursor.fetchone()
-        
-        if not reset:
-            return False, "Invalid or expired reset token"
-        
-        # Update password
-        cursor.execute("""
-            UPDATE users 
-            SET password = ? 
-            WHERE id = ?
-        """, (new_password, reset['user_id']))
-        
-        # Mark token as used
-        cursor.execute("""
-            UPDATE password_resets 
-            SET used = 1 
-            WHERE token = ?
-        """, (token,))
-        
-        conn.commit()
+        password_hash = hash_password(new_password)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Find valid token
+            cursor.execute("""
+                SELECT user_id FROM password_resets 
+                WHERE token = ? AND expiry > CURRENT_TIMESTAMP 
+                AND used = 0
+            """, (token,))
+            reset = cursor.fetchone()
+            
+            if not reset:
+                return False, "Invalid or expired reset token"
+            
+            # Update password
+            cursor.execute("""
+                UPDATE users 
+                SET password = ? 
+                WHERE id = ?
+            """, (password_hash, reset['user_id']))
+            
+            # Mark token as used
+            cursor.execute("""
+                UPDATE password_resets 
+                SET used = 1 
+                WHERE token = ?
+            """, (token,))
+            
+            conn.commit()
         return True, "Password reset successful"
+    except PasswordBusyError:
+        return False, "The server is busy, please try again shortly"
     except Exception as e:
-        print(f"Error in password reset: {str(e)}")
+        logger.error("Error in password reset: %s", e)
         return False, "Failed to reset password"
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 def require_login(f):
     @wraps(f)
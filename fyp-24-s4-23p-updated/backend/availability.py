@@ -0,0 +1,119 @@
+"""Appointment slot availability as per-doctor, per-day bitmaps.
+
+Bit ``i`` of a day bitmap stands for the slot starting ``i * SLOT_MINUTES``
+after midnight; a set bit means the doctor works then and nobody has booked
+it. Working hours come precompiled as one mask per weekday (see
+doctor_schedules), bookings for a whole date range come from a single
+query, and each doctor/day is then one ``mask & ~booked``.
+"""
+from datetime import datetime, timedelta
+
+SLOT_MINUTES = 30
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_time(value):
+    """'HH:MM' -> minutes after midnight"""
+    hours, minutes = value.strip().split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f"invalid time '{value}'")
+    return hours * 60 + minutes
+
+
+def format_time(minute):
+    """Minutes after midnight -> 'HH:MM'"""
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def slot_time(index):
+    """Slot index -> 'HH:MM'"""
+    return format_time(index * SLOT_MINUTES)
+
+
+def range_mask(start_minute, end_minute):
+    """Slots that start in [start_minute, end_minute)"""
+    first = -(-start_minute // SLOT_MINUTES)
+    last = -(-end_minute // SLOT_MINUTES)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def iter_slots(mask):
+    """Indexes of the set bits, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class AvailabilityEngine:
+    """Free-slot bitmaps for the active doctors over a date range"""
+
+    def __init__(self, schedules):
+        # [(doctor name, weekly masks)] in display order
+        self.doctors = [(schedule.name, schedule.masks) for schedule in schedules]
+
+    @staticmethod
+    def booked_masks(cursor, start_date, end_date):
+        """{(doctor name, 'YYYY-MM-DD'): bitmap of booked slots} from one range query"""
+        cursor.execute("""
+            SELECT doctor_name, appointment_date, appointment_time
+            FROM appointments
+            WHERE appointment_date BETWEEN ? AND ?
+            AND status != 'cancelled'
+        """, (start_date.isoformat(), end_date.isoformat()))
+        booked = {}
+        for row in cursor.fetchall():
+            try:
+                minute = parse_time(row['appointment_time'])
+            except (ValueError, AttributeError):
+                continue
+            if minute % SLOT_MINUTES:
+                continue
+            key = (row['doctor_name'], row['appointment_date'])
+            booked[key] = booked.get(key, 0) | (1 << minute // SLOT_MINUTES)
+        return booked
+
+    def free_slots(self, cursor, start_date, end_date):
+        """[(date string, [(doctor name, free bitmap)])] for each day in start..end"""
+        booked = self.booked_masks(cursor, start_date, end_date)
+        days = []
+        day = start_date
+        while day <= end_date:
+            iso = day.isoformat()
+            weekday = day.weekday()
+            days.append((iso, [(name, masks[weekday] & ~booked.get((name, iso), 0))
+                               for name, masks in self.doctors]))
+            day += timedelta(days=1)
+        return days
+
+    def nearest_free(self, cursor, doctor_name, day, minute, days=14):
+        """(date string, 'HH:MM') of the free slot closest to ``minute`` on ``day``,
+        else the earliest one on the following days, or None"""
+        wanted = minute // SLOT_MINUTES
+        for offset, (iso, doctors) in enumerate(self.free_slots(cursor, day, day + timedelta(days=days - 1))):
+            free = dict(doctors).get(doctor_name, 0)
+            if not free:
+                continue
+            if offset == 0:
+                best = min(iter_slots(free), key=lambda i: (abs(i - wanted), i))
+            else:
+                best = (free & -free).bit_length() - 1
+            return iso, slot_time(best)
+        return None
+
+
+def to_date(value):
+    """'YYYY-MM-DD', 'tomorrow', 'today' or a date -> date"""
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered == 'today':
+            return datetime.now().date()
+        if lowered == 'tomorrow':
+            return (datetime.now() + timedelta(days=1)).date()
+        return datetime.strptime(value.strip(), '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
@@ -0,0 +1,123 @@
+"""Chat message processing shared by the Flask view and the ASGI chat endpoint.
+
+Profile commands are matched in process (see profile_commands); everything
+else goes to DialogflowHandler. ``chat_reply`` is the blocking version used by the
+WSGI app, ``chat_reply_async`` keeps the event loop free by running SQLite
+work on the DB executor and awaiting Dialogflow. The ``*_stream`` variants
+yield listings row by row for Server-Sent Events replies.
+"""
+import json
+import logging
+from db_connection import iterate_in_db_executor, run_in_db_executor
+from profile_commands import SHOW, apply_profile_update, match_profile_command
+from user_cache import get_profile
+
+logger = logging.getLogger(__name__)
+
+
+def update_profile_field(user_id, field, value):
+    """Apply a chat profile update; ``field`` is a ProfileField"""
+    try:
+        if apply_profile_update(user_id, field, value):
+            return f'✅ Your {field.label} has been updated to: {value}'
+    except Exception as e:
+        logger.error("Error updating profile: %s", e)
+    return f"Sorry, I couldn't update your {field.label} at this moment."
+
+
+def get_profile_information(user_id):
+    try:
+        profile = get_profile(user_id)
+        if profile:
+            return f"""👤 Your Profile Information:
+📋 Name: {profile['username']}
+📧 Email: {profile['email']}
+📞 Phone: {profile['phone'] or 'Not provided'}
+📍 Address: {profile['address'] or 'Not provided'}
+🏥 Blood Type: {profile['blood_type'] or 'Not provided'}
+⚕️ Allergies: {profile['allergies'] or 'Not provided'}
+🆘 Emergency Contact: {profile['emergency_contact'] or 'Not provided'}"""
+        return "Sorry, I couldn't find your profile information."
+    except Exception as e:
+        logger.error("Error getting profile: %s", e)
+        return "Sorry, I couldn't retrieve your profile information at this moment."
+
+
+def run_profile_command(user_id, command):
+    if command.op == SHOW:
+        return get_profile_information(user_id)
+    return update_profile_field(user_id, command.field, command.value)
+
+
+def chat_reply(dialogflow, user_id, message):
+    """Reply to one chat message (blocking)"""
+    logger.debug("Processing message: %s", message)
+    command = match_profile_command(message)
+    if command:
+        return run_profile_command(user_id, command)
+    try:
+        return dialogflow.handle_intent(user_id, message)
+    except Exception as e:
+        logger.error("Error in Dialogflow request: %s", e)
+        return "I'm having trouble understanding. Could you please try again?"
+
+
+async def chat_reply_async(dialogflow, user_id, message):
+    """Reply to one chat message without blocking the event loop"""
+    logger.debug("Processing message: %s", message)
+    command = match_profile_command(message)
+    if command:
+        return await run_in_db_executor(run_profile_command, user_id, command)
+    try:
+        return await dialogflow.handle_intent_async(user_id, message)
+    except Exception as e:
+        logger.error("Error in Dialogflow request: %s", e)
+        return "I'm having trouble understanding. Could you please try again?"
+
+
+# Server-Sent Events framing for streamed replies
+SSE_DONE = "event: done\ndata: {}\n\n"
+
+
+def wants_stream(accept_header, payload):
+    """True when the client asked for an SSE reply (Accept header or {"stream": true})"""
+    if isinstance(payload, dict) and payload.get('stream'):
+        return True
+    return 'text/event-stream' in (accept_header or '')
+
+
+def sse_event(chunk):
+    """One reply chunk as an SSE event: text is a delta, a dict is a whole response"""
+    data = {'response': chunk} if isinstance(chunk, dict) else {'delta': chunk}
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def chat_reply_stream(dialogflow, user_id, message):
+    """chat_reply as a generator of chunks; listings come a row at a time"""
+    stream = None
+    if not match_profile_command(message):
+        try:
+            stream = dialogflow.listing_stream(user_id, message)
+        except Exception as e:
+            logger.error("Error starting listing stream: %s", e)
+    if stream is None:
+        yield chat_reply(dialogflow, user_id, message)
+        return
+    logger.debug("Streaming reply to: %s", message)
+    yield from stream
+
+
+async def chat_reply_stream_async(dialogflow, user_id, message):
+    """chat_reply_stream for the event loop; listing rows are read on the DB executor"""
+    stream = None
+    if not match_profile_command(message):
+        try:
+            stream = dialogflow.listing_stream(user_id, message)
+        except Exception as e:
+            logger.error("Error starting listing stream: %s", e)
+    if stream is None:
+        yield await chat_reply_async(dialogflow, user_id, message)
+        return
+    logger.debug("Streaming reply to: %s", message)
+    async for chunk in iterate_in_db_executor(stream):
+        yield chunk
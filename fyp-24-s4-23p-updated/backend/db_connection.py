@@ -1,16 +1,449 @@
+import asyncio
+import contextvars
+import logging
 import sqlite3
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from tracing import connection_factory
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'database.db'))
+
+# Storage profiles, selected with DB_STORAGE_PROFILE. 'wal' lets readers run
+# alongside a writer; 'legacy' keeps SQLite's rollback-journal defaults.
+STORAGE_PROFILES = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # negative means KiB, so ~64 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    },
+    'legacy': {
+        'busy_timeout': 5000
+    }
+}
+
+BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', 5))
+BUSY_BACKOFF = float(os.environ.get('DB_BUSY_BACKOFF', 0.02))
+BUSY_BACKOFF_MAX = 1.0
+
+def get_storage_profile():
+    """Active storage profile, with DB_<PRAGMA> environment overrides applied"""
+    name = os.environ.get('DB_STORAGE_PROFILE', 'wal')
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}', expected one of {sorted(STORAGE_PROFILES)}")
+    profile = dict(STORAGE_PROFILES[name])
+    for pragma in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout'):
+        override = os.environ.get(f'DB_{pragma.upper()}')
+        if override is not None:
+            profile[pragma] = override
+    return profile
+
+def apply_pragmas(conn, profile, readonly=False):
+    """Apply a storage profile to a freshly opened connection"""
+    # journal_mode is persistent in the file, setting it again is a cheap no-op
+    if profile.get('journal_mode'):
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    for pragma in ('synchronous', 'mmap_size', 'cache_size', 'temp_store', 'busy_timeout'):
+        if pragma in profile:
+            conn.execute(f"PRAGMA {pragma} = {profile[pragma]}")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+
+def is_busy_error(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED style errors worth retrying"""
+    if not isinstance(error, sqlite3.OperationalError) or isinstance(error, PoolTimeout):
+        return False
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def retry_on_busy(func=None, retries=None, backoff=None):
+    """Retry a callable on SQLITE_BUSY with bounded, jittered exponential backoff.
+
+    Usable as ``@retry_on_busy`` or ``retry_on_busy(retries=3)(func)``. The
+    callable must be safe to re-run, i.e. it owns its whole transaction.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            attempts = BUSY_RETRIES if retries is None else retries
+            delay = BUSY_BACKOFF if backoff is None else backoff
+            for attempt in range(attempts + 1):
+                try:
+                    return f(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if attempt == attempts or not is_busy_error(e):
+                        raise
+                    logger.warning("Database busy, retrying %s (%s/%s)", f.__name__, attempt + 1, attempts)
+                    time.sleep(min(delay * (2 ** attempt), BUSY_BACKOFF_MAX) * random.uniform(0.5, 1.0))
+        return wrapper
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections with per-thread reuse.
+
+    Connections are checked out with ``with pool.connection() as conn:``.
+    A thread that already holds a connection gets the same one back on
+    nested checkouts, so a request touches a single connection no matter
+    how many handlers it goes through.
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=10.0, health_check_interval=30.0,
+                 profile=None, readonly=False):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.profile = profile or {}
+        self.readonly = readonly
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+        self._idle = []  # LIFO stack of (conn, last_used) so hot connections are reused first
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            'checkouts': 0,
+            'reused': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'high_water': 0
+        }
+
+    def _connect(self):
+        busy_timeout = int(self.profile.get('busy_timeout', 5000)) / 1000.0
+        conn = sqlite3.connect(self.db_path, timeout=busy_timeout, check_same_thread=False,
+                               factory=connection_factory())
+        conn.row_factory = sqlite3.Row
+        try:
+            apply_pragmas(conn, self.profile, readonly=self.readonly)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        if not self.readonly:
+            # Take the write lock up front so a transaction never has to upgrade mid-way
+            conn.isolation_level = 'IMMEDIATE'
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def _acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot now, open the connection outside the lock
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+            self._stats['high_water'] = max(self._stats['high_water'], self._in_use)
+
+        try:
+            if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+                if not self._is_healthy(conn):
+                    # Keep the slot reserved and replace the dead connection
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._stats['discarded'] += 1
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self._stats['created'] += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def _release(self, conn):
+        try:
+            # Never hand a half-finished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._cond:
+                self._in_use -= 1
+            self._discard(conn)
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def held(self):
+        """Connection the calling thread currently has checked out, if any"""
+        return getattr(self._local, 'conn', None)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, reusing the one this thread already holds"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            with self._cond:
+                self._stats['reused'] += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._release(conn)
+
+    def health_check(self):
+        """Ping every idle connection and drop the broken ones"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        healthy = []
+        for conn, last_used in idle:
+            if self._is_healthy(conn):
+                healthy.append((conn, last_used))
+            else:
+                self._discard(conn)
+        with self._cond:
+            self._idle.extend(healthy)
+            self._cond.notify_all()
+        return len(healthy)
+
+    def stats(self):
+        """Snapshot of pool metrics"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle)
+            })
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+    def close_all(self):
+        """Close idle connections; checked-out ones are closed on release"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_pool(readonly=False):
+    """Get the process-wide writer (or reader) pool, creating it on first use.
+
+    SQLite allows one writer at a time, so the writer pool defaults to a
+    single connection and in-process writers queue on it instead of
+    spinning on SQLITE_BUSY. Readers get their own query_only pool.
+    """
+    pool = _pools.get(readonly)
+    # A forked worker must not share its parent's SQLite handles
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            pool = _pools.get(readonly)
+            if pool is None or pool.pid != os.getpid():
+                if readonly:
+                    max_size = int(os.environ.get('DB_POOL_SIZE', 8))
+                else:
+                    max_size = int(os.environ.get('DB_WRITE_POOL_SIZE', 1))
+                pool = ConnectionPool(
+                    DB_PATH,
+                    max_size=max_size,
+                    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                    profile=get_storage_profile(),
+                    readonly=readonly
+                )
+                _pools[readonly] = pool
+    return pool
+
+def get_connection():
+    """Check out the writer connection: ``with get_connection() as conn:``"""
+    return get_pool().connection()
+
+@contextmanager
+def get_read_connection():
+    """Check out a read-only connection for lookups.
+
+    In WAL mode these never wait on the writer. A thread that is already
+    inside a write checkout keeps using that connection so it reads its
+    own uncommitted changes.
+    """
+    writer = get_pool().held()
+    if writer is not None:
+        yield writer
+        return
+    with get_pool(readonly=True).connection() as conn:
+        yield conn
+
+def get_table_version(conn, table):
+    """Version stamp of ``table`` from table_versions, None if it is not tracked"""
+    try:
+        row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row['version'] if row else None
 
 def get_db():
-    """Get a connection to the database"""
-    db_path = os.path.join(os.path.dirname(__file__), 'database.db')
-    conn = sqlite3.connect(db_path)
+    """Open a standalone connection outside the pool (scripts and maintenance)"""
+    conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
+    apply_pragmas(conn, get_storage_profile())
     return conn
 
+_executor = None
+_executor_pid = None
+
+def get_db_executor():
+    """Bounded thread pool that async code hands blocking database work to.
+
+    Sized like the reader pool by default (DB_EXECUTOR_WORKERS overrides it),
+    so its threads do not pile up waiting for a connection.
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _pool_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                workers = int(os.environ.get('DB_EXECUTOR_WORKERS', os.environ.get('DB_POOL_SIZE', 8)))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+                _executor_pid = os.getpid()
+    return _executor
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Await ``func(*args, **kwargs)`` running on the DB executor, in the caller's context"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_db_executor(), partial(context.run, func, *args, **kwargs))
+
+async def iterate_in_db_executor(iterator):
+    """Async-iterate a blocking iterator, e.g. a generator over a cursor.
+
+    The whole iteration runs as one task on the DB executor, so a connection
+    the iterator holds stays on one thread; items are handed to the event
+    loop as they are produced. If the consumer stops early the iterator is
+    closed after its next item.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def drain():
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+                if stopped.is_set():
+                    break
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    loop.run_in_executor(get_db_executor(), contextvars.copy_context().run, drain)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def shutdown_db_executor(wait=True):
+    """Stop the DB executor, e.g. from an ASGI lifespan shutdown"""
+    global _executor
+    with _pool_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
 def initialize_database():
-    """Initialize the database with required tables"""
-    conn = get_db()
+    """Initialize the database with required tables and apply migrations"""
+    with get_connection() as conn:
+        _create_schema(conn)
+
+    # Imported here because migrations depends on this module
+    from migrations import run_migrations
+    try:
+        run_migrations()
+    except Exception as e:
+        # A half-migrated schema fails at request time instead; refuse to start
+        logger.error("Error applying migrations: %s", e)
+        raise
+
+def _create_schema(conn):
     cursor = conn.cursor()
     
     try:
@@ -173,9 +606,9 @@ def initialize_database():
         if cursor.fetchone()['count'] == 0:
             sample_doctors = [
                 ('Smith', 'General Practice', '{"monday": "09:00-17:00", "tuesday": "09:00-17:00", "wednesday": "09:00-17:00", "thursday": "09:00-17:00", "friday": "09:00-17:00", "saturday": "09:00-17:00", "sunday": "09:00-17:00"}'),
-                ('Johnson', 'Cardiology', '{"monday": "10:00-18:00", "tuesday": "10:00-18:00", "wednesday": "10:00-18:00", "thursday": "10:00-18:00", "friday": "10:00-18:00"}, "saturday": "09:00-17:00", "sunday": "09:00-17:00"'),
-                ('Williams', 'Pediatrics', '{"monday": "08:00-16:00", "tuesday": "08:00-16:00", "wednesday": "08:00-16:00", "thursday": "08:00-16:00", "friday": "08:00-16:00"}, "saturday": "09:00-17:00", "sunday": "09:00-17:00"'),
-                ('Davis', 'General Practice', '{"monday": "09:00-17:00", "wednesday": "09:00-17:00", "friday": "09:00-17:00"}, "saturday": "09:00-17:00", "sunday": "09:00-17:00"')
+                ('Johnson', 'Cardiology', '{"monday": "10:00-18:00", "tuesday": "10:00-18:00", "wednesday": "10:00-18:00", "thursday": "10:00-18:00", "friday": "10:00-18:00", "saturday": "09:00-17:00", "sunday": "09:00-17:00"}'),
+                ('Williams', 'Pediatrics', '{"monday": "08:00-16:00", "tuesday": "08:00-16:00", "wednesday": "08:00-16:00", "thursday": "08:00-16:00", "friday": "08:00-16:00", "saturday": "09:00-17:00", "sunday": "09:00-17:00"}'),
+                ('Davis', 'General Practice', '{"monday": "09:00-17:00", "wednesday": "09:00-17:00", "friday": "09:00-17:00", "saturday": "09:00-17:00", "sunday": "09:00-17:00"}')
             ]
             
             cursor.executemany("""
@@ -216,10 +649,8 @@ def initialize_database():
             """, sample_services)
         
         conn.commit()
-        print("Database initialized successfully")
+        logger.info("Database initialized successfully")
         
     except Exception as e:
-        print(f"Error initializing database: {str(e)}")
+        logger.error("Error initializing database: %s", e)
         conn.rollback()
-    finally:
-        conn.close()
@@ -0,0 +1,343 @@
+"""Dialogflow backends: the real Google client and local stand-ins.
+
+DialogflowHandler talks to a backend with ``detect_intent`` and
+``detect_intent_async``, both returning a DetectIntentResult. Pick one with
+DIALOGFLOW_BACKEND:
+
+* ``google`` (default): Dialogflow ES through google-cloud-dialogflow
+* ``stub``: in process, deterministic, with configurable latency and errors
+* ``http``: the stub served over HTTP by ``python dialogflow_backends.py serve``,
+  so benchmarks include a real network hop without Google credentials
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DetectIntentResult = namedtuple(
+    'DetectIntentResult',
+    ['fulfillment_text', 'intent', 'contexts', 'all_required_params_present']
+)
+
+CREDENTIALS_PATH = os.path.abspath(os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    'dialogflow_key',
+    'chatbotproject-444010-cfe5f28c003c.json'
+))
+
+
+class DialogflowBackendError(Exception):
+    """Raised when a backend cannot produce a detect-intent result"""
+
+
+def _active_contexts(output_contexts):
+    return tuple(sorted(
+        context.name.rsplit('/', 1)[-1] for context in output_contexts if context.lifespan_count > 0
+    ))
+
+
+class GoogleDialogflowBackend:
+    """Dialogflow ES through the official client library"""
+
+    def __init__(self, project_id, credentials_path=None):
+        from google.cloud import dialogflow_v2 as dialogflow
+        from google.oauth2 import service_account
+
+        self.project_id = project_id
+        self._dialogflow = dialogflow
+        credentials_path = credentials_path or os.environ.get('DIALOGFLOW_CREDENTIALS', CREDENTIALS_PATH)
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+
+        try:
+            self.credentials = service_account.Credentials.from_service_account_file(
+                credentials_path,
+                scopes=[
+                    "https://www.googleapis.com/auth/dialogflow",
+                    "https://www.googleapis.com/auth/cloud-platform"
+                ]
+            )
+            self.session_client = dialogflow.SessionsClient(credentials=self.credentials)
+            # The asyncio client binds to the running event loop, so it is
+            # created on first use from async code
+            self._async_session_client = None
+            logger.info("Dialogflow client initialized successfully")
+        except Exception as e:
+            logger.error("Error initializing Dialogflow client: %s", e)
+            raise
+
+    def _request(self, session_id, text, language_code):
+        session = self.session_client.session_path(self.project_id, session_id)
+        text_input = self._dialogflow.TextInput(text=text, language_code=language_code)
+        query_input = self._dialogflow.QueryInput(text=text_input)
+        return {"session": session, "query_input": query_input}
+
+    @staticmethod
+    def _result(response):
+        result = response.query_result
+        return DetectIntentResult(
+            result.fulfillment_text,
+            result.intent.display_name,
+            _active_contexts(result.output_contexts),
+            result.all_required_params_present
+        )
+
+    def detect_intent(self, session_id, text, language_code='en'):
+        response = self.session_client.detect_intent(request=self._request(session_id, text, language_code))
+        return self._result(response)
+
+    async def detect_intent_async(self, session_id, text, language_code='en'):
+        if self._async_session_client is None:
+            self._async_session_client = self._dialogflow.SessionsAsyncClient(credentials=self.credentials)
+        response = await self._async_session_client.detect_intent(
+            request=self._request(session_id, text, language_code)
+        )
+        return self._result(response)
+
+
+class StubDialogflowBackend:
+    """Deterministic in-process stand-in for load tests and offline runs.
+
+    Replies come from ``responses`` (normalized text -> reply) or echo the
+    message. Each call sleeps ``latency`` seconds plus up to ``jitter``
+    seconds and fails with probability ``error_rate``. With a fixed ``seed``
+    the same sequence of calls gets the same delays and failures.
+    """
+
+    DEFAULT_RESPONSES = {
+        'hi': "Hello! How can I help you today?",
+        'hello': "Hello! How can I help you today?",
+        'thanks': "You're welcome!",
+        'thank you': "You're welcome!",
+        'bye': "Goodbye, take care!",
+    }
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, responses=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.responses = dict(self.DEFAULT_RESPONSES if responses is None else responses)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _plan(self):
+        """(delay, fail) for the next call, drawn in call order"""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+            fail = bool(self.error_rate) and self._random.random() < self.error_rate
+        return delay, fail
+
+    def _answer(self, text):
+        key = ' '.join(text.lower().split()).rstrip('.!?')
+        reply = self.responses.get(key)
+        if reply is not None:
+            return DetectIntentResult(reply, 'stub.' + key.replace(' ', '_'), (), True)
+        return DetectIntentResult(f"You said: {text}", 'stub.fallback', (), True)
+
+    def detect_intent(self, session_id, text, language_code='en'):
+        delay, fail = self._plan()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise DialogflowBackendError("stub backend injected failure")
+        return self._answer(text)
+
+    async def detect_intent_async(self, session_id, text, language_code='en'):
+        delay, fail = self._plan()
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            raise DialogflowBackendError("stub backend injected failure")
+        return self._answer(text)
+
+
+def _result_to_json(project_id, session_id, result):
+    """Shape a result like Dialogflow's REST detectIntent response"""
+    session = f"projects/{project_id}/agent/sessions/{session_id}"
+    return {
+        'queryResult': {
+            'fulfillmentText': result.fulfillment_text,
+            'intent': {'displayName': result.intent},
+            'outputContexts': [{'name': f"{session}/contexts/{name}", 'lifespanCount': 5}
+                               for name in result.contexts],
+            'allRequiredParamsPresent': result.all_required_params_present
+        }
+    }
+
+
+def _result_from_json(payload):
+    result = payload.get('queryResult', {})
+    contexts = tuple(sorted(
+        context['name'].rsplit('/', 1)[-1]
+        for context in result.get('outputContexts', []) if context.get('lifespanCount', 0) > 0
+    ))
+    return DetectIntentResult(
+        result.get('fulfillmentText', ''),
+        result.get('intent', {}).get('displayName', ''),
+        contexts,
+        result.get('allRequiredParamsPresent', True)
+    )
+
+
+class HttpDialogflowBackend:
+    """Client for the local stub server, speaking Dialogflow's REST shape"""
+
+    def __init__(self, project_id, base_url='http://127.0.0.1:8765', timeout=10.0):
+        self.project_id = project_id
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _path(self, session_id):
+        return f"/v2/projects/{quote(self.project_id)}/agent/sessions/{quote(session_id)}:detectIntent"
+
+    @staticmethod
+    def _body(text, language_code):
+        return json.dumps({'queryInput': {'text': {'text': text, 'languageCode': language_code}}}).encode('utf-8')
+
+    def detect_intent(self, session_id, text, language_code='en'):
+        # One keep-alive connection per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request('POST', self._path(session_id), body=self._body(text, language_code),
+                         headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            payload = response.read()
+        except OSError as e:
+            conn.close()
+            self._local.conn = None
+            raise DialogflowBackendError(f"stub server unreachable: {e}") from e
+        if response.status != 200:
+            raise DialogflowBackendError(f"stub server returned {response.status}: {payload[:200]!r}")
+        return _result_from_json(json.loads(payload))
+
+    async def detect_intent_async(self, session_id, text, language_code='en'):
+        body = self._body(text, language_code)
+        head = (f"POST {self._path(session_id)} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n").encode('latin-1')
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                raw = await asyncio.wait_for(reader.read(), self.timeout)
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DialogflowBackendError(f"stub server unreachable: {e}") from e
+        header, _, payload = raw.partition(b'\r\n\r\n')
+        status = int(header.split(b' ', 2)[1])
+        if status != 200:
+            raise DialogflowBackendError(f"stub server returned {status}: {payload[:200]!r}")
+        return _result_from_json(json.loads(payload))
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes concurrent benchmark clients wait on SYN retries
+    request_queue_size = 1024
+
+
+def make_stub_server(backend, host='127.0.0.1', port=8765):
+    """ThreadingHTTPServer answering detectIntent calls from ``backend``"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            # /v2/projects/<project>/agent/sessions/<session>:detectIntent
+            parts = self.path.split('/')
+            if len(parts) != 7 or not parts[6].endswith(':detectIntent'):
+                self._reply(404, {'error': {'message': 'not found'}})
+                return
+            project_id, session_id = unquote(parts[3]), unquote(parts[6][:-len(':detectIntent')])
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            text_input = body.get('queryInput', {}).get('text', {})
+            try:
+                result = backend.detect_intent(session_id, text_input.get('text', ''),
+                                               text_input.get('languageCode', 'en'))
+            except DialogflowBackendError as e:
+                self._reply(503, {'error': {'message': str(e)}})
+                return
+            self._reply(200, _result_to_json(project_id, session_id, result))
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return _StubServer((host, port), Handler)
+
+
+def stub_from_env():
+    return StubDialogflowBackend(
+        latency=float(os.environ.get('DIALOGFLOW_STUB_LATENCY', 0)),
+        jitter=float(os.environ.get('DIALOGFLOW_STUB_JITTER', 0)),
+        error_rate=float(os.environ.get('DIALOGFLOW_STUB_ERROR_RATE', 0)),
+        seed=int(os.environ.get('DIALOGFLOW_STUB_SEED', 0))
+    )
+
+
+def create_backend(project_id, name=None):
+    """Backend selected by ``name`` or DIALOGFLOW_BACKEND"""
+    name = name or os.environ.get('DIALOGFLOW_BACKEND', 'google')
+    if name == 'google':
+        return GoogleDialogflowBackend(project_id)
+    if name == 'stub':
+        logger.info("Using stub Dialogflow backend")
+        return stub_from_env()
+    if name == 'http':
+        url = os.environ.get('DIALOGFLOW_HTTP_URL', 'http://127.0.0.1:8765')
+        logger.info("Using Dialogflow stub server at %s", url)
+        return HttpDialogflowBackend(project_id, url)
+    raise ValueError(f"Unknown Dialogflow backend '{name}', expected google, stub or http")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the stub Dialogflow backend over HTTP")
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random delay, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stub = StubDialogflowBackend(args.latency, args.jitter, args.error_rate, args.seed)
+    server = make_stub_server(stub, args.host, args.port)
+    print(f"Stub Dialogflow serving on http://{args.host}:{args.port} "
+          f"(latency {args.latency}s, jitter {args.jitter}s, error rate {args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,52 +1,127 @@
-from google.cloud import dialogflow_v2 as dialogflow
-from google.protobuf.json_format import MessageToDict
-from google.oauth2 import service_account
-from db_connection import get_db
+from db_connection import get_connection, get_read_connection, run_in_db_executor
+import logging
 import os
+import re
 import json
+import time
 from datetime import datetime, timedelta
 from health_reminders_handler import HealthRemindersHandler
-from appointment_scheduler import AppointmentScheduler
+from appointment_scheduler import AppointmentScheduler, BOOKED
+from intent_classifier import build_default_engine
+from cache import TTLCache
+from dialogflow_backends import create_backend
+from profile_commands import FIELD_ALIASES, apply_profile_update, resolve_field
+from reference_data import get_reference_data
+from user_cache import APPOINTMENTS, BILLS, PRESCRIPTIONS, get_profile, get_user_cache, invalidate_user
+from app_logging import log_query
+from tracing import DIALOGFLOW, chat_request, record_span, set_intent, span, traced_chunks
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HELP_TEXT = """You can update your profile information using these commands:
+• Update my phone to [your phone number]
+• Update my address to [your address]
+• Update my blood type to [your blood type]
+• Update my allergies to [your allergies]
+• Update my emergency contact to [contact info]
+
+For example: "Update my phone to +1234567890" or "My blood type is A+"
+"""
+
+# Dialogflow intents whose answers depend on who is asking or on earlier turns
+UNCACHED_INTENTS = {
+    name.strip() for name in os.environ.get('DIALOGFLOW_UNCACHED_INTENTS', '').split(',') if name.strip()
+}
+
+# Rows per page of the appointment, prescription and bill listings
+LISTING_PAGE_SIZE = int(os.environ.get('LISTING_PAGE_SIZE', 10))
+LISTING_PAGE_LIMIT = 50
+
+def normalize_query(query):
+    """Cache key form of a message: lower case, single spaces, no trailing punctuation"""
+    return ' '.join(query.lower().split()).rstrip('.!?')
 
 class DialogflowHandler:
-    def __init__(self, project_id):
+    def __init__(self, project_id, intent_engine=None, backend=None):
         self.project_id = project_id
         self.appointment_scheduler = AppointmentScheduler()
         
-        credentials_path = os.path.abspath(os.path.join(
-            os.path.dirname(__file__), 
-            '..', 
-            'dialogflow_key',
-            'chatbotproject-444010-cfe5f28c003c.json'
-        ))
+        # Messages the local engine is confident about never reach Dialogflow
+        self.intent_engine = intent_engine or build_default_engine(
+            threshold=float(os.environ.get('INTENT_CONFIDENCE_THRESHOLD', 0.5))
+        )
+        self.intent_handlers = {
+            'account_deactivation': lambda user_id, query: self.handle_account_deactivation_request(user_id),
+            'doctors': self._handle_doctors_query,
+            'clinic_hours': lambda user_id, query: self.get_clinic_info('opening_hours')['text'],
+            'clinic_location': lambda user_id, query: self.get_clinic_info('location')['text'],
+            'clinic_contact': lambda user_id, query: self.get_clinic_info('contact')['text'],
+            'clinic_info': lambda user_id, query: self.get_clinic_info('all')['text'],
+            'show_appointments': lambda user_id, query: self.get_user_appointments(user_id),
+            'show_prescriptions': lambda user_id, query: self.get_user_prescriptions(user_id),
+            'show_billing': lambda user_id, query: self.get_billing_info(user_id),
+            'listing_next': lambda user_id, query: ''.join(self._iter_next_page(user_id, query)),
+            'show_profile': lambda user_id, query: self.get_health_records(user_id),
+            'profile_help': lambda user_id, query: PROFILE_HELP_TEXT,
+            'schedule_appointment': lambda user_id, query: self.handle_appointment_scheduling(user_id, query, {}),
+            'prescriptions': self._handle_prescription_query
+        }
+        # Listings that can be sent a row at a time
+        self.stream_handlers = {
+            'show_appointments': lambda user_id, query: self.iter_user_appointments(user_id),
+            'show_prescriptions': lambda user_id, query: self.iter_user_prescriptions(user_id),
+            'show_billing': lambda user_id, query: self.iter_billing_info(user_id),
+            'listing_next': self._iter_next_page
+        }
         
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
+        # Repeated small talk and FAQ answers are served without a round trip
+        self.intent_cache = TTLCache(
+            max_size=int(os.environ.get('DIALOGFLOW_CACHE_SIZE', 1024)),
+            ttl=float(os.environ.get('DIALOGFLOW_CACHE_TTL', 3600))
+        )
+        # Active Dialogflow contexts per session; they expire after 20 minutes server side
+        self.session_contexts = TTLCache(max_size=10000, ttl=20 * 60)
+        # Where each user's last paged listing stopped: (listing, last row key)
+        self.listing_cursors = TTLCache(max_size=10000, ttl=30 * 60)
+        # First pages of the listings and the profile, dropped when the user's data changes
+        self.user_cache = get_user_cache()
+        # Clinic info, services, doctors, advice and events with replies pre-rendered
+        self.reference_data = get_reference_data()
+        
+        # Google by default; DIALOGFLOW_BACKEND=stub or http runs without credentials
+        self.backend = backend or create_backend(project_id)
         
-        try:
-            credentials = service_account.Credentials.from_service_account_file(
-                credentials_path,
-                scopes=[
-                    "https://www.googleapis.com/auth/dialogflow",
-                    "https://www.googleapis.com/auth/cloud-platform"
-                ]
-            )
-            self.session_client = dialogflow.SessionsClient(credentials=credentials)
-            print("Dialogflow client initialized successfully")
-        except Exception as e:
-            print(f"Error initializing Dialogflow client: {str(e)}")
-            raise
-
         self.health_reminders = HealthRemindersHandler()
 
-    def get_user_appointments(self, user_id):
+    def get_user_appointments(self, user_id, limit=None, after=None):
+        return ''.join(self.iter_user_appointments(user_id, limit, after))
+
+    def iter_user_appointments(self, user_id, limit=None, after=None):
+        """Yield the upcoming-appointments reply a row at a time.
+
+        Shows ``limit`` rows (LISTING_PAGE_SIZE by default) starting after
+        the keyset ``after``; when more remain, the position is remembered
+        for "show next appointments".
+        """
         try:
-            print(f"Fetching appointments for user_id: {user_id}")
+            logger.debug("Fetching appointments for user_id: %s", user_id)
             if not user_id:
-                return "Please log in to view your appointments."
-                
-            conn = get_db()
-            cursor = conn.cursor()
+                yield "Please log in to view your appointments."
+                return
+            page = self._appointments_page(user_id, limit or LISTING_PAGE_SIZE, after)
+            last_key = yield from self._cached_page(user_id, APPOINTMENTS, None, page, limit, after)
+            yield from self._page_footer(user_id, 'appointments', last_key)
+        except Exception as e:
+            logger.exception("Error fetching appointments")
+            yield "Sorry, I couldn't retrieve your appointments at this moment."
+
+    def _appointments_page(self, user_id, limit, after):
+        """Yield one page of appointments; returns the key to continue from, or None"""
+        after_date, after_time, after_id = after or ('', '', 0)
             
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+        
             query = """
                 SELECT 
                     id,
@@ -57,168 +132,259 @@ class DialogflowHandler:
                     status
                 FROM appointments 
                 WHERE user_id = ? 
-                AND date(appointment_date) >= date('now', 'localtime')
+                AND appointment_date >= date('now', 'localtime')
                 AND status != 'cancelled'
-                ORDER BY date(appointment_date), time(appointment_time)
+                AND (appointment_date, appointment_time, id) > (?, ?, ?)
+                ORDER BY appointment_date, appointment_time, id
+                LIMIT ?
             """
-            print(f"Executing query: {query} with user_id: {user_id}")
-            cursor.execute(query, (user_id,))
-            appointments = cursor.fetchall()
-            print(f"Found {len(appointments) if appointments else 0} appointments")
-            
-            if not appointments:
-                return "You don't have any upcoming appointments scheduled."
-            
-            response = "📅 Your upcoming appointments:\n\n"
-            for apt in appointments:
-                response += f"🗓 ID: {apt['id']}\n"
-                response += f"🗓️ Date: {apt['appointment_date']}\n"
-                response += f"⏰ Time: {apt['appointment_time']}\n"
-                response += f"👨‍⚕️ Doctor: Dr. {apt['doctor_name']}\n"
-                response += f"📋 Type: {apt['appointment_type']}\n"
-                response += f"📊 Status: {apt['status'].title()}\n"
-                response += "─────────────────\n"
-            return response
-        except Exception as e:
-            print(f"Error fetching appointments: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return "Sorry, I couldn't retrieve your appointments at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
-
-    def get_user_prescriptions(self, user_id, status='active'):
+            params = (user_id, after_date, after_time, after_id, limit + 1)
+            log_query(query, params)
+            cursor.execute(query, params)
+        
+            shown = 0
+            last = None
+            more = False
+            for apt in cursor:
+                if shown == limit:
+                    more = True
+                    break
+                if not shown:
+                    yield "📅 Your upcoming appointments:\n\n"
+                shown += 1
+                last = (apt['appointment_date'], apt['appointment_time'], apt['id'])
+                yield (f"🗓 ID: {apt['id']}\n"
+                       f"🗓️ Date: {apt['appointment_date']}\n"
+                       f"⏰ Time: {apt['appointment_time']}\n"
+                       f"👨‍⚕️ Doctor: Dr. {apt['doctor_name']}\n"
+                       f"📋 Type: {apt['appointment_type']}\n"
+                       f"📊 Status: {apt['status'].title()}\n"
+                       "─────────────────\n")
+            logger.debug("Found %s appointments", shown)
+        
+        if not shown:
+            yield "No more upcoming appointments." if after else "You don't have any upcoming appointments scheduled."
+        return last if more else None
+
+    def get_user_prescriptions(self, user_id, status='active', limit=None, after=None):
         """Get user prescriptions with detailed information"""
+        return ''.join(self.iter_user_prescriptions(user_id, status, limit, after))
+
+    def iter_user_prescriptions(self, user_id, status='active', limit=None, after=None):
+        """Yield the prescriptions reply a row at a time, newest first, paged like appointments"""
         try:
-            print(f"Fetching prescriptions for user_id: {user_id}")
-            conn = get_db()
+            logger.debug("Fetching prescriptions for user_id: %s", user_id)
+            page = self._prescriptions_page(user_id, status, limit or LISTING_PAGE_SIZE, after)
+            last_key = yield from self._cached_page(user_id, PRESCRIPTIONS, status, page, limit, after)
+            yield from self._page_footer(user_id, f'prescriptions:{status}', last_key)
+        except Exception as e:
+            logger.exception("Error fetching prescriptions")
+            yield "Sorry, I couldn't retrieve your prescriptions at this moment."
+
+    def _prescriptions_page(self, user_id, status, limit, after):
+        """Yield one page of prescriptions; returns the key to continue from, or None"""
+        # Newest first, so the keyset starts above every real row
+        after_created, after_id = after or ('\uffff', 2 ** 63 - 1)
+        with get_read_connection() as conn:
             cursor = conn.cursor()
-            
+        
             # First verify the table exists
             cursor.execute("""
                 SELECT name FROM sqlite_master 
                 WHERE type='table' AND name='prescriptions'
             """)
             if not cursor.fetchone():
-                print("Prescriptions table does not exist, initializing database...")
+                logger.debug("Prescriptions table does not exist, initializing database...")
                 from db_connection import initialize_database
                 initialize_database()
-                conn = get_db()
-                cursor = conn.cursor()
-            
+        
             if status == 'active':
                 query = """
                     SELECT * FROM prescriptions 
                     WHERE user_id = ? 
                     AND status = 'active'
                     AND (end_date IS NULL OR date(end_date) >= date('now'))
-                    ORDER BY created_at DESC
+                    AND (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
                 """
             else:
                 query = """
                     SELECT * FROM prescriptions 
                     WHERE user_id = ? 
-                    ORDER BY created_at DESC
+                    AND (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
                 """
-            
-            print(f"Executing query: {query} with user_id: {user_id}")
-            cursor.execute(query, (user_id,))
-            prescriptions = cursor.fetchall()
-            print(f"Found {len(prescriptions) if prescriptions else 0} prescriptions")
-
-            if not prescriptions:
-                return "You don't have any active prescriptions at the moment."
-
-            response = "💊 Your Prescriptions:\n\n"
-            for rx in prescriptions:
-                response += f"🏥 Medication: {rx['medication_name']}\n"
-                response += f"💊 Dosage: {rx['dosage']}\n"
-                response += f"⏰ Frequency: {rx['frequency']}\n"
-                
+        
+            params = (user_id, after_created, after_id, limit + 1)
+            log_query(query, params)
+            cursor.execute(query, params)
+
+            shown = 0
+            last = None
+            more = False
+            for rx in cursor:
+                if shown == limit:
+                    more = True
+                    break
+                if not shown:
+                    yield "💊 Your Prescriptions:\n\n"
+                shown += 1
+                last = (rx['created_at'], rx['id'])
+                lines = [f"🏥 Medication: {rx['medication_name']}\n",
+                         f"💊 Dosage: {rx['dosage']}\n",
+                         f"⏰ Frequency: {rx['frequency']}\n"]
                 if rx['start_date']:
-                    response += f"📅 Start Date: {rx['start_date']}\n"
+                    lines.append(f"📅 Start Date: {rx['start_date']}\n")
                 if rx['end_date']:
-                    response += f"📅 End Date: {rx['end_date']}\n"
-                
-                response += f"🔄 Refills Remaining: {rx['refills_remaining']}\n"
-                response += f"📊 Status: {rx['status'].title()}\n"
-                response += "─────────────────\n"
-
-            if status == 'active':
-                response += "\n💡 Need a refill? Just ask 'I need a refill for [medication name]'"
-            return response
-            
-        except Exception as e:
-            print(f"Error fetching prescriptions: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return "Sorry, I couldn't retrieve your prescriptions at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
-
-    def get_billing_info(self, user_id):
+                    lines.append(f"📅 End Date: {rx['end_date']}\n")
+                lines.append(f"🔄 Refills Remaining: {rx['refills_remaining']}\n")
+                lines.append(f"📊 Status: {rx['status'].title()}\n")
+                lines.append("─────────────────\n")
+                yield ''.join(lines)
+            logger.debug("Found %s prescriptions", shown)
+
+        if not shown:
+            yield "No more prescriptions." if after else "You don't have any active prescriptions at the moment."
+        elif status == 'active' and not more:
+            yield "\n💡 Need a refill? Just ask 'I need a refill for [medication name]'"
+        return last if more else None
+
+    def get_billing_info(self, user_id, limit=None, after=None):
+        return ''.join(self.iter_billing_info(user_id, limit, after))
+
+    def iter_billing_info(self, user_id, limit=None, after=None):
+        """Yield the outstanding-bills reply a row at a time, paged like appointments"""
         try:
-            print(f"Fetching billing info for user_id: {user_id}")
-            conn = get_db()
+            logger.debug("Fetching billing info for user_id: %s", user_id)
+            page = self._bills_page(user_id, limit or LISTING_PAGE_SIZE, after)
+            last_key = yield from self._cached_page(user_id, BILLS, None, page, limit, after)
+            yield from self._page_footer(user_id, 'bills', last_key)
+        except Exception as e:
+            logger.exception("Error fetching billing info")
+            yield "Sorry, I couldn't retrieve your billing information at this moment."
+
+    def _bills_page(self, user_id, limit, after):
+        """Yield one page of pending bills; returns the key to continue from, or None"""
+        after_due, after_id = after or ('', 0)
+        with get_read_connection() as conn:
             cursor = conn.cursor()
-            
+        
             query = """
-                SELECT amount, due_date, status, description 
+                SELECT id, amount, due_date, status, description 
                 FROM bills 
                 WHERE user_id = ? AND status = 'PENDING'
-                ORDER BY due_date
+                AND (due_date, id) > (?, ?)
+                ORDER BY due_date, id
+                LIMIT ?
             """
-            print(f"Executing query: {query} with user_id: {user_id}")
-            cursor.execute(query, (user_id,))
-            bills = cursor.fetchall()
-            print(f"Found {len(bills) if bills else 0} bills")
-
-            if not bills:
-                return "You don't have any outstanding bills."
-
-            response = "💰 Your billing information:\n\n"
-            total = 0
-            for bill in bills:
-                response += f"📝 Service: {bill['description']}\n"
-                response += f"💵 Amount: ${bill['amount']:.2f}\n"
-                response += f"📅 Due date: {bill['due_date']}\n"
-                response += f"📊 Status: {bill['status']}\n"
-                response += "─────────────────\n"
-                total += float(bill['amount'])
-            response += f"\n💳 Total outstanding: ${total:.2f}"
-            return response
-        except Exception as e:
-            print(f"Error fetching billing info: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return "Sorry, I couldn't retrieve your billing information at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
+            params = (user_id, after_due, after_id, limit + 1)
+            log_query(query, params)
+            cursor.execute(query, params)
+
+            shown = 0
+            last = None
+            more = False
+            for bill in cursor:
+                if shown == limit:
+                    more = True
+                    break
+                if not shown:
+                    yield "💰 Your billing information:\n\n"
+                shown += 1
+                last = (bill['due_date'], bill['id'])
+                yield (f"📝 Service: {bill['description']}\n"
+                       f"💵 Amount: ${bill['amount']:.2f}\n"
+                       f"📅 Due date: {bill['due_date']}\n"
+                       f"📊 Status: {bill['status']}\n"
+                       "─────────────────\n")
+            logger.debug("Found %s bills", shown)
+
+            if shown:
+                # The total covers every pending bill, not just this page
+                cursor.execute("""
+                    SELECT COALESCE(SUM(amount), 0) AS total
+                    FROM bills
+                    WHERE user_id = ? AND status = 'PENDING'
+                """, (user_id,))
+                total = float(cursor.fetchone()['total'])
+
+        if not shown:
+            yield "No more outstanding bills." if after else "You don't have any outstanding bills."
+            return None
+        yield f"\n💳 Total outstanding: ${total:.2f}"
+        return last if more else None
+
+    def _cached_page(self, user_id, section, variant, page, limit, after):
+        """Yield a listing page, serving and keeping first pages in the user cache.
+
+        ``page`` is one of the ``_*_page`` generators; its return value (the
+        key to continue from) is cached with the chunks and returned.
+        """
+        if after is not None or (limit or LISTING_PAGE_SIZE) != LISTING_PAGE_SIZE:
+            return (yield from page)
+        cached = self.user_cache.get(user_id, section, variant)
+        if cached is not None:
+            chunks, last_key = cached
+            page.close()
+            yield from chunks
+            return last_key
+        token = self.user_cache.token()
+        chunks = []
+        while True:
+            try:
+                chunk = next(page)
+            except StopIteration as stop:
+                last_key = stop.value
+                break
+            chunks.append(chunk)
+            yield chunk
+        self.user_cache.set(user_id, section, (tuple(chunks), last_key), variant, token)
+        return last_key
+
+    def _page_footer(self, user_id, listing, last_key):
+        """Remember where a listing page ended and tell the user how to continue"""
+        if last_key is None:
+            if self.listing_cursors.get(user_id, (None,))[0] == listing:
+                self.listing_cursors.pop(user_id)
+            return
+        self.listing_cursors.set(user_id, (listing, last_key))
+        noun = listing.split(':')[0]
+        yield f"\n➡️ Say 'show next {LISTING_PAGE_SIZE} {noun}' to see more."
+
+    def _iter_next_page(self, user_id, query_lower):
+        """Continue the last paged listing, or the one the message names"""
+        match = re.search(r'\b(\d{1,3})\b', query_lower)
+        limit = min(int(match.group(1)), LISTING_PAGE_LIMIT) if match else None
+        listing, after = self.listing_cursors.get(user_id, (None, None))
+
+        named = None
+        for noun, name in (('appointment', 'appointments'), ('prescription', 'prescriptions'), ('bill', 'bills')):
+            if noun in query_lower:
+                named = name
+        if named and (listing or '').split(':')[0] != named:
+            # A different listing than the one in progress starts from the top
+            listing, after = named, None
+        if not listing:
+            yield "There's nothing to continue. Try 'show my appointments', 'show my prescriptions' or 'show my bills'."
+            return
+
+        if listing == 'appointments':
+            yield from self.iter_user_appointments(user_id, limit, after)
+        elif listing == 'bills':
+            yield from self.iter_billing_info(user_id, limit, after)
+        else:
+            status = listing.partition(':')[2] or 'active'
+            yield from self.iter_user_prescriptions(user_id, status, limit, after)
 
     def get_health_records(self, user_id):
         try:
-            print(f"Fetching health records for user_id: {user_id}")
-            conn = get_db()
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT p.*, u.email, u.phone, u.address, u.emergency_contact
-                FROM patient_profiles p
-                JOIN users u ON p.user_id = u.id
-                WHERE p.user_id = ?
-            """
-            print(f"Executing query: {query} with user_id: {user_id}")
-            cursor.execute(query, (user_id,))
-            profile = cursor.fetchone()
-            print(f"Found profile: {bool(profile)}")
+            logger.debug("Fetching health records for user_id: %s", user_id)
+            profile = get_profile(user_id)
+            logger.debug("Found profile: %s", bool(profile and profile['profile_id']))
 
-            if not profile:
+            if not profile or profile['profile_id'] is None:
                 return "Profile information not found."
 
             response = "👤 Your Profile Information:\n\n"
@@ -231,151 +397,27 @@ class DialogflowHandler:
             response += f"🆘 Emergency Contact: {profile['emergency_contact'] or 'Not provided'}\n"
             return response
         except Exception as e:
-            print(f"Error fetching health records: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error fetching health records")
             return "Sorry, I couldn't retrieve your profile information at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def get_clinic_info(self, info_type):
         """Get clinic information based on type"""
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clinic_info LIMIT 1")
-        info = cursor.fetchone()
-        conn.close()
-
-        if not info:
-            return {'text': "Sorry, clinic information is not available at the moment.", 'data': None}
-
-        if info_type == 'opening_hours':
-            return {
-                'text': f"🕒 Our clinic hours are:\n{info['opening_hours']}\n\n. Need to schedule an appointment?",
-                'data': info
-            }
-        elif info_type == 'location':
-            return {
-                'text': f"📍 We are located at:\n{info['address']}\n\n🗺️ Map: {info['map_link']}\n\nWould you like directions?",
-                'data': info
-            }
-        elif info_type == 'contact':
-            return {
-                'text': f"📞 Phone: {info['phone']}\n📧 Email: {info['email']}\n⏰ Support Hours: {info['support_hours']}\n\nHow can we help you today?",
-                'data': info
-            }
-        elif info_type == 'all':
-            return {
-                'text': f"""📍 Clinic Information:
-🏥 {info['name']}
-📍 Address: {info['address']}
-📞 Phone: {info['phone']}
-📧 Email: {info['email']}
-🕒 Hours: {info['opening_hours']}
-⏰ Support: {info['support_hours']}
-🗺️ Map: {info['map_link']}
-
-Would you like to schedule an appointment?""",
-                'data': info
-            }
-        return {'text': None, 'data': None}
+        return self.reference_data.snapshot().clinic_info(info_type)
 
     def get_doctors_info(self, speciality=None):
         """Get information about available doctors"""
-        conn = None
         try:
-            conn = get_db()
-            cursor = conn.cursor()
-            
             # Normalize speciality name
             if speciality and 'general' in speciality.lower():
                 speciality = 'General Practice'
-            
-            if speciality:
-                cursor.execute("""
-                    SELECT * FROM doctors 
-                    WHERE status = 'active' AND speciality = ?
-                    ORDER BY name
-                """, (speciality,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM doctors 
-                    WHERE status = 'active'
-                    ORDER BY speciality, name
-                """)
-            
-            doctors = cursor.fetchall()
-            
-            if not doctors:
-                if speciality:
-                    return f"I'm having trouble understanding. Could you please try again?"
-                return "I'm having trouble understanding. Could you please try again?"
-            
-            response = "I'll help you schedule an appointment. Here are our available doctors:\n\n"
-            
-            for doctor in doctors:
-                response += f"👨‍⚕️ Dr. {doctor['name']} - {doctor['speciality']}\n"
-                if doctor['schedule']:
-                    try:
-                        import json
-                        schedule_dict = json.loads(doctor['schedule'])
-                        response += "Available slots for tomorrow:\n"
-                        for time in ["9:00 AM", "10:00 AM", "11:00 AM"]:
-                            response += f"- {time}\n"
-                    except:
-                        response += "Schedule available upon request\n"
-                response += "\n"
-            
-            response += "Please choose a doctor and time slot."
-            return response
-            
+            return self.reference_data.snapshot().doctors_text(speciality)
         except Exception as e:
-            print(f"Error getting doctors info: {str(e)}")
+            logger.error("Error getting doctors info: %s", e)
             return "I'm having trouble understanding. Could you please try again?"
-        finally:
-            if conn:
-                conn.close()
 
     def get_available_services(self, category=None):
         """Get available clinic services"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        if category:
-            cursor.execute("SELECT * FROM clinic_services WHERE category = ? AND status = 'active'", (category,))
-        else:
-            cursor.execute("SELECT * FROM clinic_services WHERE status = 'active' ORDER BY category")
-            
-        services = cursor.fetchall()
-        conn.close()
-
-        if not services:
-            return "I'm having trouble understanding. Could you please try again?"
-
-        response = "Here are our available services:\n\n"
-        current_category = None
-        
-        category_emojis = {
-            'General': '👨‍⚕️',
-            'Specialist': '🏥',
-            'Laboratory': '🔬',
-            'Emergency': '🚑',
-            'Preventive': '💉'
-        }
-        
-        for service in services:
-            if current_category != service['category']:
-                current_category = service['category']
-                emoji = category_emojis.get(current_category, '🏥')
-                response += f"\n{emoji} {current_category}:\n"
-            
-            response += f"- {service['name']}\n"
-            if service['description']:
-                response += f"  {service['description']}\n"
-        
-        return response
+        return self.reference_data.snapshot().services_text(category)
 
     def get_post_care_info(self, user_id, procedure_name=None):
         instructions = self.health_reminders.get_post_care_instructions(user_id, procedure_name)
@@ -394,46 +436,26 @@ Would you like to schedule an appointment?""",
         return response
 
     def get_health_advice(self, category=None):
-        advice = self.health_reminders.get_health_advice(category)
-        if not advice:
-            return "No health advice found."
-        
-        response = "🏥 Health Advice:\n\n"
-        for item in advice:
-            response += f"📌 {item['title']}\n"
-            response += f"📝 {item['content']}\n"
-            response += "─────────────────\n"
-        return response
+        return self.reference_data.snapshot().advice_text(category)
 
     def get_health_events(self):
-        events = self.health_reminders.get_upcoming_events()
-        if not events:
-            return "No upcoming health events found."
-        
-        response = "🎯 Upcoming Health Events:\n\n"
-        for event in events:
-            response += f"📌 {event['title']}\n"
-            response += f"📝 {event['description']}\n"
-            response += f"📅 Date: {event['event_date']}\n"
-            response += f"📍 Location: {event['location']}\n"
-            response += "──────────────\n"
-        return response
+        return self.reference_data.snapshot().events_text()
 
     def handle_appointment_scheduling(self, user_id, query, parameters):
         """Handle appointment scheduling with a more interactive flow"""
         try:
-            print(f"Processing appointment scheduling for user {user_id}")
-            print(f"Query: {query}")
-            print(f"Parameters: {parameters}")
+            logger.debug("Processing appointment scheduling for user %s", user_id)
+            logger.debug("Query: %s", query)
+            logger.debug("Parameters: %s", parameters)
             
             # Parse appointment details from query
             query_lower = query.lower()
             appointment_info = self._parse_appointment_query(query_lower)
             
             if appointment_info.get('is_complete'):
-                print(f"Scheduling appointment with info: {appointment_info}")
+                logger.debug("Scheduling appointment with info: %s", appointment_info)
                 # Schedule the appointment
-                appointment_id = self.appointment_scheduler.schedule_appointment(
+                booking = self.appointment_scheduler.book_appointment(
                     user_id,  # Use actual user_id here
                     appointment_info['doctor'],
                     appointment_info['date'],
@@ -441,7 +463,7 @@ Would you like to schedule an appointment?""",
                     appointment_info['time']
                 )
                 
-                if appointment_id:
+                if booking.status == BOOKED:
                     return f"""✅ Appointment scheduled successfully!
 📅 Date: {appointment_info['date']}
 ⏰ Time: {appointment_info['time']}
@@ -449,6 +471,10 @@ Would you like to schedule an appointment?""",
 📋 Type: {appointment_info['type']}
 
 Your appointment has been confirmed."""
+                elif booking.alternative:
+                    alt_date, alt_time = booking.alternative
+                    return (f"Sorry, {booking.message} The nearest free slot with Dr. {appointment_info['doctor']} "
+                            f"is {alt_date} at {alt_time}. Would you like to book it?")
                 else:
                     # Get available slots for the requested date
                     available_slots = self.appointment_scheduler.get_available_slots(appointment_info['date'])
@@ -479,9 +505,7 @@ Your appointment has been confirmed."""
             return "Please provide your appointment details in this format: 'I want a [type] with Dr. [name] on [date] at [time]'"
             
         except Exception as e:
-            print(f"Error in appointment scheduling: {str(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error in appointment scheduling")
             return "Sorry, there was an error processing your request. Please try again."
 
     def _parse_appointment_query(self, query):
@@ -521,7 +545,7 @@ Your appointment has been confirmed."""
                             info['time'] = time_obj.strftime('%H:%M')
                             break
                 except Exception as e:
-                    print(f"Error parsing time: {str(e)}")
+                    logger.error("Error parsing time: %s", e)
             
             # Extract appointment type
             if "general checkup" in query or "checkup" in query:
@@ -535,238 +559,219 @@ Your appointment has been confirmed."""
             
             # Check if we have all required info
             info['is_complete'] = all([info['date'], info['time'], info['doctor']])
-            print(f"Parsed appointment info: {info}")
+            logger.debug("Parsed appointment info: %s", info)
             return info
             
         except Exception as e:
-            print(f"Error parsing appointment query: {str(e)}")
+            logger.error("Error parsing appointment query: %s", e)
             return info
 
     def update_health_records(self, user_id, field, value):
         """Update specific field in user's health records"""
         try:
-            print(f"Updating {field} to {value} for user_id: {user_id}")
-            conn = get_db()
-            cursor = conn.cursor()
-            
-            # Map common terms to database fields
-            field_mapping = {
-                'phone': ('users', 'phone'),
-                'telephone': ('users', 'phone'),
-                'mobile': ('users', 'phone'),
-                'address': ('users', 'address'),
-                'location': ('users', 'address'),
-                'blood type': ('patient_profiles', 'blood_type'),
-                'bloodtype': ('patient_profiles', 'blood_type'),
-                'blood': ('patient_profiles', 'blood_type'),
-                'allergies': ('patient_profiles', 'allergies'),
-                'allergy': ('patient_profiles', 'allergies'),
-                'emergency contact': ('users', 'emergency_contact'),
-                'emergency': ('users', 'emergency_contact'),
-                'contact': ('users', 'emergency_contact')
-            }
-            
-            field_lower = field.lower().strip()
-            if field_lower not in field_mapping:
-                valid_fields = list(set([k.replace('_', ' ') for k in field_mapping.keys()]))
+            logger.debug("Updating %s to %s for user_id: %s", field, value, user_id)
+            profile_field = resolve_field(field)
+            if not profile_field:
+                valid_fields = sorted(FIELD_ALIASES)
                 return f"Sorry, I can't update {field}. Valid fields are: {', '.join(valid_fields)}"
             
-            table, db_field = field_mapping[field_lower]
-            
-            # Check if profile exists for patient_profiles updates
-            if table == 'patient_profiles':
-                cursor.execute("SELECT id FROM patient_profiles WHERE user_id = ?", (user_id,))
-                profile = cursor.fetchone()
-                if not profile:
-                    # Create profile if it doesn't exist
-                    cursor.execute("""
-                        INSERT INTO patient_profiles (user_id)
-                        VALUES (?)
-                    """, (user_id,))
-            
-            # Update the appropriate table
-            if table == 'users':
-                query = f"UPDATE users SET {db_field} = ? WHERE id = ?"
-            else:
-                query = f"UPDATE patient_profiles SET {db_field} = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?"
-            
-            print(f"Executing query: {query}")
-            cursor.execute(query, (value, user_id))
-            
-            if cursor.rowcount == 0:
+            if not apply_profile_update(user_id, profile_field, value):
                 return f"Sorry, I couldn't find your profile to update {field}"
-            
-            conn.commit()
             return f"✅ Your {field} has been updated to: {value}"
             
         except Exception as e:
-            print(f"Error updating health records: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Error updating health records")
             return f"Sorry, I couldn't update your {field} at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
+
+    def _handle_doctors_query(self, user_id, query_lower):
+        speciality = None
+        if "general" in query_lower:
+            speciality = "General Practice"
+        else:
+            for spec in ["cardiology", "pediatrics", "dermatology"]:
+                if spec in query_lower:
+                    speciality = spec.title()
+                    break
+        return self.get_doctors_info(speciality)
+
+    def _handle_prescription_query(self, user_id, query_lower):
+        # Check for specific medication name
+        medication_name = None
+        words = query_lower.split()
+        for i, word in enumerate(words):
+            if word in ["for", "of"]:
+                if i + 1 < len(words):
+                    medication_name = words[i + 1]
+                    break
+        
+        if "active" in query_lower:
+            return self.get_user_prescriptions(user_id, 'active')
+        elif "all" in query_lower:
+            return self.get_user_prescriptions(user_id, 'all')
+        elif medication_name:
+            return self.handle_prescription_request(user_id, medication_name)
+        else:
+            return self.get_user_prescriptions(user_id)
+
+    def _intent_cache_key(self, user_id, query, language_code):
+        context_state = self.session_contexts.get(user_id, ())
+        return (normalize_query(query), language_code, context_state)
+
+    def detect_intent_text(self, user_id, query, language_code='en'):
+        """Fulfillment text from Dialogflow, served from the cache when possible.
+
+        The key includes the session's active contexts, so the same words in
+        a different conversation state are a different entry. Responses that
+        set contexts, still need parameters, or come from UNCACHED_INTENTS
+        are never cached.
+        """
+        key = self._intent_cache_key(user_id, query, language_code)
+        cached = self.intent_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with span('dialogflow'):
+            result = self.backend.detect_intent(str(user_id), query, language_code)
+        return self._remember_result(user_id, key, result)
+
+    async def detect_intent_text_async(self, user_id, query, language_code='en'):
+        """detect_intent_text that awaits Dialogflow instead of blocking a thread"""
+        key = self._intent_cache_key(user_id, query, language_code)
+        cached = self.intent_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with span('dialogflow'):
+            result = await self.backend.detect_intent_async(str(user_id), query, language_code)
+        return self._remember_result(user_id, key, result)
+
+    def _remember_result(self, user_id, key, result):
+        if result.contexts:
+            self.session_contexts.set(user_id, result.contexts)
+        else:
+            self.session_contexts.pop(user_id)
+
+        cacheable = (
+            result.fulfillment_text
+            and not result.contexts
+            and result.all_required_params_present
+            and result.intent not in UNCACHED_INTENTS
+        )
+        if cacheable:
+            self.intent_cache.set(key, result.fulfillment_text)
+        return result.fulfillment_text
+
+    def _classify(self, query):
+        """(local intent, lower-cased query); intent is None when Dialogflow should answer"""
+        start = time.perf_counter()
+        query_lower = query.lower().strip()
+        
+        # Remove "You:" prefix if present
+        if query_lower.startswith("you:"):
+            query_lower = query_lower[4:].strip()
+        
+        match = self.intent_engine.classify(query_lower)
+        intent = match.intent if match.intent and match.confidence >= self.intent_engine.threshold else None
+        record_span('route', time.perf_counter() - start, intent or DIALOGFLOW)
+        if intent:
+            logger.debug("Handling intent %s locally (%s, confidence %.2f)", match.intent, match.source, match.confidence)
+        return intent, query_lower
+
+    def _local_handler(self, query):
+        """(handler, lower-cased query); handler is None when Dialogflow should answer.
+
+        Also attributes the current chat request to the intent.
+        """
+        intent, query_lower = self._classify(query)
+        handler = self.intent_handlers.get(intent)
+        set_intent(intent if handler else DIALOGFLOW)
+        return handler, query_lower
+
+    def listing_stream(self, user_id, query):
+        """Generator of reply chunks when ``query`` asks for a listing, else None.
+
+        Nothing is read until the generator is iterated, so callers can run
+        it wherever database work belongs.
+        """
+        if not user_id:
+            return None
+        intent, query_lower = self._classify(query)
+        handler = self.stream_handlers.get(intent)
+        return traced_chunks(intent, handler(user_id, query_lower)) if handler else None
 
     def handle_intent(self, user_id, query, language_code='en'):
         """Handle user intents"""
-        try:
-            if not user_id:
-                return "Please log in to continue."
+        with chat_request():
+            try:
+                if not user_id:
+                    return "Please log in to continue."
                 
-            print(f"Processing intent for user {user_id}")
-            print(f"Query: {query}")
-            
-            query_lower = query.lower().strip()
-            
-            # Handle account deactivation requests
-            deactivation_phrases = [
-                "deactivate my account",
-                "delete my account",
-                "close my account",
-                "remove my account",
-                "deactivate account",
-                "delete account"
-            ]
-            
-            if any(phrase in query_lower for phrase in deactivation_phrases):
-                return self.handle_account_deactivation_request(user_id)
-            
-            # Remove "You:" prefix if present
-            if query_lower.startswith("you:"):
-                query_lower = query_lower[4:].strip()
-            
-            # Doctor-related queries
-            if "doctor" in query_lower or "doctors" in query_lower:
-                speciality = None
-                if "general" in query_lower:
-                    speciality = "General Practice"
-                elif any(spec in query_lower for spec in ["cardiology", "pediatrics", "dermatology"]):
-                    for spec in ["cardiology", "pediatrics", "dermatology"]:
-                        if spec in query_lower:
-                            speciality = spec.title()
-                            break
-                return self.get_doctors_info(speciality)
-            
-            # Clinic information queries
-            if "clinic" in query_lower:
-                if "hour" in query_lower or "time" in query_lower or "open" in query_lower:
-                    return self.get_clinic_info('opening_hours')['text']
-                elif "location" in query_lower or "address" in query_lower or "where" in query_lower:
-                    return self.get_clinic_info('location')['text']
-                elif "contact" in query_lower or "phone" in query_lower or "email" in query_lower:
-                    return self.get_clinic_info('contact')['text']
-                else:
-                    return self.get_clinic_info('all')['text']
-            
-            # Direct commands handling - ORDERED BY SPECIFICITY
-            if "show" in query_lower:
-                # Appointments
-                if "appointment" in query_lower or "appointments" in query_lower:
-                    print("Handling show appointments command")
-                    return self.get_user_appointments(user_id)
-                    
-                # Prescriptions
-                if "prescription" in query_lower or "prescriptions" in query_lower:
-                    print("Handling show prescriptions command")
-                    return self.get_user_prescriptions(user_id)
-                    
-                # Billing/Bills
-                if "bill" in query_lower or "billing" in query_lower:
-                    print("Handling show billing command")
-                    return self.get_billing_info(user_id)
-                    
-                # Profile
-                if "profile" in query_lower:
-                    print("Handling show profile command")
-                    return self.get_health_records(user_id)
-            
-            # Help with profile update
-            if "how" in query_lower and "update" in query_lower and "profile" in query_lower:
-                return """You can update your profile information using these commands:
-• Update my phone to [your phone number]
-• Update my address to [your address]
-• Update my blood type to [your blood type]
-• Update my allergies to [your allergies]
-• Update my emergency contact to [contact info]
-
-For example: "Update my phone to +1234567890" or "My blood type is A+"
-"""
+                logger.debug("Processing intent for user %s", user_id)
+                logger.debug("Query: %s", query)
             
-            # Appointment scheduling
-            if any(word in query_lower for word in ["schedule", "book", "appointment", "checkup", "want"]):
-                print("Handling appointment scheduling")
-                return self.handle_appointment_scheduling(user_id, query_lower, {})
-            
-            # Prescription-related queries
-            if any(word in query_lower for word in ["prescription", "medicine", "medication", "refill"]):
-                # Check for specific medication name
-                medication_name = None
-                words = query_lower.split()
-                for i, word in enumerate(words):
-                    if word in ["for", "of"]:
-                        if i + 1 < len(words):
-                            medication_name = words[i + 1]
-                            break
+                handler, query_lower = self._local_handler(query)
+                if handler:
+                    with span('handler'):
+                        return handler(user_id, query_lower)
+            
+                # If no direct match, use Dialogflow
+                try:
+                    fulfillment_text = self.detect_intent_text(user_id, query, language_code)
                 
-                if "active" in query_lower:
-                    return self.get_user_prescriptions(user_id, 'active')
-                elif "all" in query_lower:
-                    return self.get_user_prescriptions(user_id, 'all')
-                elif medication_name:
-                    return self.handle_prescription_request(user_id, medication_name)
-                else:
-                    return self.get_user_prescriptions(user_id)
+                    if fulfillment_text:
+                        return fulfillment_text
+                
+                    return "I'm not sure how to help with that. Could you please rephrase?"
+                
+                except Exception as e:
+                    logger.error("Error in Dialogflow request: %s", e)
+                    return "I'm having trouble understanding. Could you please try again?"
+                
+            except Exception as e:
+                logger.error("Error in handle_intent: %s", e)
+                return "Sorry, I encountered an error. Please try again later."
+
+    async def handle_intent_async(self, user_id, query, language_code='en'):
+        """handle_intent for the event loop.
+
+        Local handlers touch SQLite, so they run on the bounded DB executor;
+        the Dialogflow call is awaited, so no thread waits on the network.
+        """
+        with chat_request():
+            try:
+                if not user_id:
+                    return "Please log in to continue."
+                
+                logger.debug("Processing intent for user %s", user_id)
+                logger.debug("Query: %s", query)
             
-            # If no direct match, use Dialogflow
-            session = self.session_client.session_path(self.project_id, str(user_id))
-            text_input = dialogflow.TextInput(text=query, language_code=language_code)
-            query_input = dialogflow.QueryInput(text=text_input)
+                handler, query_lower = self._local_handler(query)
+                if handler:
+                    with span('handler'):
+                        return await run_in_db_executor(handler, user_id, query_lower)
             
-            try:
-                response = self.session_client.detect_intent(
-                    request={"session": session, "query_input": query_input}
-                )
+                try:
+                    fulfillment_text = await self.detect_intent_text_async(user_id, query, language_code)
                 
-                if response.query_result.fulfillment_text:
-                    return response.query_result.fulfillment_text
+                    if fulfillment_text:
+                        return fulfillment_text
                 
-                return "I'm not sure how to help with that. Could you please rephrase?"
+                    return "I'm not sure how to help with that. Could you please rephrase?"
                 
-            except Exception as e:
-                print(f"Error in Dialogflow request: {str(e)}")
-                return "I'm having trouble understanding. Could you please try again?"
+                except Exception as e:
+                    logger.error("Error in Dialogflow request: %s", e)
+                    return "I'm having trouble understanding. Could you please try again?"
                 
-        except Exception as e:
-            print(f"Error in handle_intent: {str(e)}")
-            return "Sorry, I encountered an error. Please try again later."
+            except Exception as e:
+                logger.error("Error in handle_intent: %s", e)
+                return "Sorry, I encountered an error. Please try again later."
 
     def get_service_info(self, service_type):
         """Get detailed information about a specific service"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("""
-                SELECT * FROM clinic_services 
-                WHERE LOWER(name) LIKE ? OR LOWER(category) LIKE ?
-            """, (f"%{service_type.lower()}%", f"%{service_type.lower()}%"))
-            
-            service = cursor.fetchone()
-            if service:
-                response = f" {service['name']}\n\n"
-                response += f"Description: {service['description']}\n"
-                if service['duration']:
-                    response += f"Duration: {service['duration']} minutes\n"
-                if service['price']:
-                    response += f"Price: ${service['price']}\n"
-                response += "\nWould you like to schedule an appointment for this service?"
-                return response
-            return f"I couldn't find specific information about {service_type}. Here are our available services:\n\n" + self.get_available_services()
-        
-        finally:
-            conn.close()
+        detail = self.reference_data.snapshot().service_detail(service_type)
+        if detail:
+            return detail
+        return f"I couldn't find specific information about {service_type}. Here are our available services:\n\n" + self.get_available_services()
 
     def handle_appointment_confirmation(self, session_id):
         """Handle appointment confirmation"""
@@ -805,19 +810,19 @@ You will receive a confirmation email shortly. Would you like me to set a remind
             if not medication_name:
                 return self.get_user_prescriptions(user_id)
                 
-            conn = get_db()
-            cursor = conn.cursor()
+            with get_read_connection() as conn:
+                cursor = conn.cursor()
             
-            # Check if user has this prescription
-            cursor.execute("""
-                SELECT * FROM prescriptions 
-                WHERE user_id = ? 
-                AND medication_name LIKE ? 
-                AND status = 'active'
-                AND (end_date IS NULL OR date(end_date) >= date('now'))
-            """, (user_id, f"%{medication_name}%"))
+                # Check if user has this prescription
+                cursor.execute("""
+                    SELECT * FROM prescriptions 
+                    WHERE user_id = ? 
+                    AND medication_name LIKE ? 
+                    AND status = 'active'
+                    AND (end_date IS NULL OR date(end_date) >= date('now'))
+                """, (user_id, f"%{medication_name}%"))
             
-            prescription = cursor.fetchone()
+                prescription = cursor.fetchone()
             
             if not prescription:
                 return f"I couldn't find an active prescription for {medication_name}. Please verify the medication name or contact your doctor."
@@ -841,40 +846,40 @@ You will receive a confirmation email shortly. Would you like me to set a remind
             return response
             
         except Exception as e:
-            print(f"Error handling prescription request: {str(e)}")
+            logger.error("Error handling prescription request: %s", e)
             return "Sorry, I couldn't process your prescription request at this moment."
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def handle_account_deactivation_request(self, user_id):
         """Handle account deactivation requests through chat"""
         try:
-            conn = get_db()
-            cursor = conn.cursor()
+            with get_connection() as conn:
+                cursor = conn.cursor()
             
-            # Verify user exists and is active
-            cursor.execute("SELECT status FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
+                # Verify user exists and is active
+                cursor.execute("SELECT status FROM users WHERE id = ?", (user_id,))
+                user = cursor.fetchone()
             
-            if not user:
-                return "Unable to find your account."
+                if not user:
+                    return "Unable to find your account."
             
-            if user['status'] == 'deactivated':
-                return "Your account is already deactivated."
+                if user['status'] == 'deactivated':
+                    return "Your account is already deactivated."
             
-            # Update user status
-            cursor.execute("""
-                UPDATE users 
-                SET status = 'deactivated' 
-                WHERE id = ?
-            """, (user_id,))
+                # Update user status
+                cursor.execute("""
+                    UPDATE users 
+                    SET status = 'deactivated' 
+                    WHERE id = ?
+                """, (user_id,))
             
-            conn.commit()
+                conn.commit()
+            invalidate_user(user_id)
             
-            # Clear session
-            from flask import session
-            session.clear()
+            # Clear session; outside a Flask request (the ASGI chat path) the
+            # caller clears it when it sees the logout action
+            from flask import session, has_request_context
+            if has_request_context():
+                session.clear()
             
             return {
                 "message": "Your account has been deactivated. You will be logged out automatically. If you wish to reactivate your account in the future, please contact our support team.",
@@ -882,11 +887,8 @@ You will receive a confirmation email shortly. Would you like me to set a remind
             }
             
         except Exception as e:
-            print(f"Error in account deactivation request: {str(e)}")
+            logger.error("Error in account deactivation request: %s", e)
             return "I'm having trouble understanding. Could you please try again?"
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
     def handle_appointment_request(self, doctor_name, appointment_time):
         """Handle appointment scheduling request"""
@@ -900,7 +902,7 @@ You will receive a confirmation email shortly. Would you like me to set a remind
             response += "Would you like me to proceed with booking this appointment?"
             return response
         except Exception as e:
-            print(f"Error handling appointment request: {str(e)}")
+            logger.error("Error handling appointment request: %s", e)
             return "I'm having trouble understanding. Could you please try again?"
 
     def confirm_appointment(self, doctor_name, appointment_time):
@@ -914,5 +916,5 @@ You will receive a confirmation email shortly. Would you like me to set a remind
             response += "3. View appointment details"
             return response
         except Exception as e:
-            print(f"Error confirming appointment: {str(e)}")
+            logger.error("Error confirming appointment: %s", e)
             return "I'm having trouble understanding. Could you please try again?"
@@ -0,0 +1,169 @@
+"""Validated, precompiled doctor schedules.
+
+The ``doctors.schedule`` column holds JSON like ``{"monday": "09:00-17:00"}``.
+It is parsed once, strictly, into per-weekday minute ranges plus slot
+bitmaps, so booking and availability checks never touch JSON or time
+strings. The cache reloads when the ``doctors`` version stamp in
+``table_versions`` (bumped by triggers) changes; it is checked at most
+every DOCTOR_SCHEDULE_CHECK_INTERVAL seconds, or on every call when the
+caller passes its own connection.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from availability import WEEKDAYS, range_mask
+from db_connection import get_read_connection, get_table_version
+
+logger = logging.getLogger(__name__)
+
+_TIME = re.compile(r'^([01]\d|2[0-4]):([0-5]\d)$')
+
+
+class ScheduleError(ValueError):
+    """Raised when a schedule does not follow the expected format"""
+
+
+class DoctorSchedule(namedtuple('DoctorSchedule', ['doctor_id', 'name', 'speciality', 'ranges', 'masks'])):
+    """``ranges`` and ``masks`` are indexed by weekday, Monday = 0"""
+
+    __slots__ = ()
+
+    def covers(self, weekday, minute):
+        """True if the doctor is working at ``minute`` after midnight"""
+        return any(start <= minute < end for start, end in self.ranges[weekday])
+
+
+def _parse_minute(value):
+    match = _TIME.match(value)
+    if not match:
+        raise ScheduleError(f"'{value}' is not a HH:MM time")
+    minute = int(match.group(1)) * 60 + int(match.group(2))
+    if minute > 24 * 60:
+        raise ScheduleError(f"'{value}' is past midnight")
+    return minute
+
+
+def _parse_range(value):
+    if not isinstance(value, str) or value.count('-') != 1:
+        raise ScheduleError(f"{value!r} is not a 'HH:MM-HH:MM' range")
+    start, end = (_parse_minute(part.strip()) for part in value.split('-'))
+    if start >= end:
+        raise ScheduleError(f"'{value}' ends before it starts")
+    return start, end
+
+
+def _unique_keys(pairs):
+    result = {}
+    for key, value in pairs:
+        if key in result:
+            raise ScheduleError(f"'{key}' appears twice")
+        result[key] = value
+    return result
+
+
+def compile_schedule(raw):
+    """Schedule JSON -> (ranges, masks), each a 7-tuple indexed by weekday.
+
+    A day maps to one 'HH:MM-HH:MM' range or a list of them. Unknown or
+    repeated weekdays, malformed times and overlapping ranges are errors.
+    """
+    if not isinstance(raw, str):
+        raise ScheduleError("schedule is missing")
+    try:
+        days = json.loads(raw, object_pairs_hook=_unique_keys)
+    except json.JSONDecodeError as e:
+        raise ScheduleError(f"invalid JSON: {e}") from e
+    if not isinstance(days, dict):
+        raise ScheduleError("schedule must be a JSON object of weekday -> hours")
+
+    ranges = [()] * 7
+    for day, hours in days.items():
+        if day not in WEEKDAYS:
+            raise ScheduleError(f"unknown weekday '{day}'")
+        day_ranges = sorted(_parse_range(value) for value in (hours if isinstance(hours, list) else [hours]))
+        for (_, previous_end), (start, _) in zip(day_ranges, day_ranges[1:]):
+            if start < previous_end:
+                raise ScheduleError(f"overlapping hours on {day}")
+        ranges[WEEKDAYS.index(day)] = tuple(day_ranges)
+
+    masks = []
+    for day_ranges in ranges:
+        mask = 0
+        for start, end in day_ranges:
+            mask |= range_mask(start, end)
+        masks.append(mask)
+    return tuple(ranges), tuple(masks)
+
+
+class ScheduleCache:
+    """Compiled schedules of the active doctors, by name, in id order"""
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._schedules = None
+        self._version = None
+        self._checked_at = 0.0
+        self.errors = {}
+        self.loads = 0
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, speciality, schedule FROM doctors WHERE status = 'active' ORDER BY id")
+        schedules = {}
+        errors = {}
+        for row in cursor.fetchall():
+            try:
+                ranges, masks = compile_schedule(row['schedule'])
+            except ScheduleError as e:
+                errors[row['name']] = str(e)
+                logger.warning("Invalid schedule for Dr. %s, doctor is unavailable until fixed: %s", row['name'], e)
+                continue
+            schedules[row['name']] = DoctorSchedule(row['id'], row['name'], row['speciality'], ranges, masks)
+        return schedules, errors
+
+    def _refresh(self, conn):
+        version = get_table_version(conn, 'doctors')
+        # Without a version stamp (database not migrated yet) reload every time
+        if self._schedules is None or version is None or version != self._version:
+            self._schedules, self.errors = self._load(conn)
+            self._version = version
+            self.loads += 1
+        self._checked_at = time.monotonic()
+
+    def schedules(self, conn=None):
+        """{doctor name: DoctorSchedule}; pass ``conn`` to always check freshness on it"""
+        if conn is None and self._schedules is not None \
+                and time.monotonic() - self._checked_at < self.check_interval:
+            return self._schedules
+        with self._lock:
+            if conn is not None:
+                self._refresh(conn)
+            elif self._schedules is None or time.monotonic() - self._checked_at >= self.check_interval:
+                with get_read_connection() as read_conn:
+                    self._refresh(read_conn)
+            return self._schedules
+
+    def get(self, name, conn=None):
+        return self.schedules(conn).get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._schedules = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_schedule_cache():
+    """Process-wide ScheduleCache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ScheduleCache(float(os.environ.get('DOCTOR_SCHEDULE_CHECK_INTERVAL', 1.0)))
+    return _cache
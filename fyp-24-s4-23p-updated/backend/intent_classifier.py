@@ -0,0 +1,333 @@
+"""Local intent classification for chat messages.
+
+Messages are classified in process before anything is sent to Dialogflow:
+an ordered rule stage backed by a keyword trie handles the commands the
+chat has always understood, and a word and character n-gram TF-IDF stage trained
+from example phrases catches paraphrases. Both run offline.
+"""
+import math
+import re
+from collections import Counter, namedtuple
+
+IntentMatch = namedtuple('IntentMatch', ['intent', 'confidence', 'source'])
+
+# Function words carry no intent and would otherwise dominate short messages
+STOPWORDS = frozenset("""
+a an the and or to of in on at for with is are am was be do does did can could
+would will i me my you your we our it its this that there what when where who
+how which please hi hello hey thanks thank have has had any get
+""".split())
+OWNER_WORDS = frozenset(('my', 'your'))
+
+
+def stem(word):
+    """Crude suffix stripping so "change", "changed" and "changes" share a feature"""
+    if word.endswith('ss'):
+        return word
+    for suffix in ('ing', 'ed', 'es', 's', 'e'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+class KeywordTrie:
+    """Finds every keyword that occurs as a substring of a text in one pass"""
+
+    _END = object()
+
+    def __init__(self, keywords=()):
+        self._root = {}
+        for keyword in keywords:
+            self.add(keyword)
+
+    def add(self, keyword):
+        node = self._root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[self._END] = keyword
+
+    def find_all(self, text):
+        found = set()
+        root = self._root
+        end = self._END
+        for start in range(len(text)):
+            node = root.get(text[start])
+            position = start + 1
+            while node is not None:
+                keyword = node.get(end)
+                if keyword is not None:
+                    found.add(keyword)
+                if position == len(text):
+                    break
+                node = node.get(text[position])
+                position += 1
+        return found
+
+
+class IntentRule:
+    """Matches when every keyword group has a hit, or when the regex matches.
+
+    ``groups`` is a list of keyword alternatives, e.g. ``[('show',), ('bill',)]``
+    means "contains show and contains bill". Keywords are plain substrings,
+    the same semantics as the ``in query_lower`` checks they replace.
+    """
+
+    def __init__(self, intent, groups=(), pattern=None):
+        self.intent = intent
+        self.groups = [tuple(group) for group in groups]
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def keywords(self):
+        return {keyword for group in self.groups for keyword in group}
+
+    def matches(self, found, text):
+        if self.pattern is not None and self.pattern.search(text):
+            return True
+        if not self.groups:
+            return False
+        return all(any(keyword in found for keyword in group) for group in self.groups)
+
+
+class RuleClassifier:
+    """Ordered rules, first match wins with full confidence"""
+
+    source = 'rules'
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._trie = KeywordTrie(set().union(*(rule.keywords() for rule in self.rules)))
+
+    def classify(self, text):
+        found = self._trie.find_all(text)
+        for rule in self.rules:
+            if rule.matches(found, text):
+                return IntentMatch(rule.intent, 1.0, self.source)
+        return None
+
+
+class NgramClassifier:
+    """Word and character n-gram TF-IDF nearest-neighbour classifier.
+
+    A message is represented by its words plus the character trigrams of
+    each word, so "physician" and "physicians" still overlap while a whole
+    word match counts for more than a shared fragment. Term frequency is
+    sublinear. Confidence is the cosine similarity to the closest training
+    phrase, so it is in [0, 1] and a training phrase scores 1.0 for its
+    own intent. When the runner-up intent is within ``margin`` of the best
+    one the message is ambiguous and the confidence is only the gap, so it
+    goes to Dialogflow rather than to a confident wrong answer.
+    """
+
+    source = 'ngram'
+
+    def __init__(self, training_phrases, n=3, margin=0.1):
+        self.n = n
+        self.margin = margin
+        documents = [(intent, self._features(phrase))
+                     for intent, phrases in training_phrases.items()
+                     for phrase in phrases]
+
+        document_frequency = Counter()
+        for _, features in documents:
+            document_frequency.update(set(features))
+        total = len(documents)
+        self._idf = {feature: math.log((1 + total) / (1 + count)) + 1.0
+                     for feature, count in document_frequency.items()}
+
+        # Inverted index: feature -> [(phrase number, weight)] for sparse dot products
+        self._intents = []
+        self._index = {}
+        for intent, features in documents:
+            for feature, weight in self._normalize(self._weigh(features)).items():
+                self._index.setdefault(feature, []).append((len(self._intents), weight))
+            self._intents.append(intent)
+
+    def _features(self, text):
+        features = []
+        n = self.n
+        owner = None
+        for word in re.findall(r"[a-z0-9']+", text.lower()):
+            # "my" and "your" say whose data is meant: my address vs. your address
+            if word in OWNER_WORDS:
+                owner = word
+                features.append(word)
+                continue
+            if word in STOPWORDS:
+                continue
+            root = stem(word)
+            features.append(root)
+            if owner:
+                features.append(f"{owner} {root}")
+                owner = None
+            padded = f" {word} "
+            if len(padded) > n:
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def _weigh(self, features):
+        counts = Counter(features)
+        return {feature: (1 + math.log(count)) * self._idf.get(feature, 0.0)
+                for feature, count in counts.items()}
+
+    @staticmethod
+    def _normalize(vector):
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return {}
+        return {feature: weight / norm for feature, weight in vector.items()}
+
+    def classify(self, text):
+        vector = self._normalize(self._weigh(self._features(text)))
+        similarities = Counter()
+        index = self._index
+        for feature, weight in vector.items():
+            for phrase, phrase_weight in index.get(feature, ()):
+                similarities[phrase] += weight * phrase_weight
+        best = {}
+        for phrase, score in similarities.items():
+            intent = self._intents[phrase]
+            if score > best.get(intent, 0.0):
+                best[intent] = score
+        if not best:
+            return None
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        intent, score = ranked[0]
+        if len(ranked) > 1 and score - ranked[1][1] < self.margin:
+            score -= ranked[1][1]
+        return IntentMatch(intent, min(score, 1.0), self.source)
+
+
+class IntentEngine:
+    """Runs classifier stages in order and returns the first confident match.
+
+    Any object with a ``classify(text)`` method returning an IntentMatch or
+    None can be a stage. If no stage reaches the threshold, the best
+    low-confidence match is returned so callers can fall back on it.
+    """
+
+    def __init__(self, stages, threshold=0.5):
+        self.stages = list(stages)
+        self.threshold = threshold
+
+    def classify(self, text):
+        best = None
+        for stage in self.stages:
+            match = stage.classify(text)
+            if match is None:
+                continue
+            if match.confidence >= self.threshold:
+                return match
+            if best is None or match.confidence > best.confidence:
+                best = match
+        return best or IntentMatch(None, 0.0, None)
+
+
+DEACTIVATION_PHRASES = (
+    "deactivate my account",
+    "delete my account",
+    "close my account",
+    "remove my account",
+    "deactivate account",
+    "delete account"
+)
+
+# Order matters: it mirrors the precedence of the original handle_intent chain
+DEFAULT_RULES = [
+    IntentRule('account_deactivation', [DEACTIVATION_PHRASES]),
+    # "show next 10 appointments", "more", "show 5 more bills"
+    IntentRule('listing_next', pattern=r'^(?:show |list )?(?:me )?(?:the )?(?:\d{1,3} )?(?:next|more)(?: \d{1,3})?'
+                                       r'(?: (?:appointments?|prescriptions?|bills?))?[.!?]?$'),
+    IntentRule('doctors', [('doctor',)]),
+    IntentRule('clinic_hours', [('clinic',), ('hour', 'time', 'open')]),
+    IntentRule('clinic_location', [('clinic',), ('location', 'address', 'where')]),
+    IntentRule('clinic_contact', [('clinic',), ('contact', 'phone', 'email')]),
+    IntentRule('clinic_info', [('clinic',)]),
+    IntentRule('show_appointments', [('show',), ('appointment',)]),
+    IntentRule('show_prescriptions', [('show',), ('prescription',)]),
+    IntentRule('show_billing', [('show',), ('bill',)]),
+    IntentRule('show_profile', [('show',), ('profile',)]),
+    IntentRule('profile_help', [('how',), ('update',), ('profile',)]),
+    IntentRule('schedule_appointment', [('schedule', 'book', 'appointment', 'checkup', 'want')]),
+    IntentRule('prescriptions', [('prescription', 'medicine', 'medication', 'refill')]),
+]
+
+# Paraphrases of the intents above that the keyword rules miss
+TRAINING_PHRASES = {
+    'doctors': [
+        "which physicians work here",
+        "who are your physicians",
+        "list of specialists",
+        "is there a cardiologist available",
+        "do you have a pediatrician",
+        "who can I see",
+    ],
+    'clinic_hours': [
+        "what are your opening hours",
+        "when are you open",
+        "what time do you open",
+        "what time do you close",
+        "are you open on sunday",
+        "opening times",
+    ],
+    'clinic_location': [
+        "where are you located",
+        "what is your address",
+        "how do I find you",
+        "directions to the practice",
+        "where is the practice",
+        "your address",
+        "address please",
+    ],
+    'clinic_contact': [
+        "how can I contact you",
+        "what is your phone number",
+        "what is your email",
+        "how do I reach support",
+        "contact details",
+        "your phone number",
+        "number to call",
+    ],
+    'show_appointments': [
+        "my upcoming visits",
+        "when is my next visit",
+        "list my visits",
+        "what visits do I have",
+    ],
+    'show_billing': [
+        "how much do I owe",
+        "my outstanding balance",
+        "what are my bills",
+        "my invoices",
+        "payment due",
+    ],
+    'show_profile': [
+        "my profile",
+        "my personal details",
+        "what information do you have about me",
+        "view my details",
+    ],
+    # Without these, "my address changed" is closest to the clinic's address
+    'profile_help': [
+        "my address has changed",
+        "I moved house",
+        "my phone number is wrong",
+        "I have a new email address",
+        "change my emergency contact",
+        "my contact details are out of date",
+        "how do I change my details",
+    ],
+    'prescriptions': [
+        "my meds",
+        "my drugs",
+        "my pills",
+        "what pills am I taking",
+    ],
+}
+
+
+def build_default_engine(threshold=0.5, use_ngrams=True):
+    """Rule stage plus (optionally) the n-gram stage trained on TRAINING_PHRASES"""
+    stages = [RuleClassifier(DEFAULT_RULES)]
+    if use_ngrams:
+        stages.append(NgramClassifier(TRAINING_PHRASES))
+    return IntentEngine(stages, threshold=threshold)
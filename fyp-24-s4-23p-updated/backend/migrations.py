@@ -0,0 +1,386 @@
+"""Versioned schema migrations and the hot-query plan check.
+
+Run ``python migrations.py`` to apply pending migrations and
+``python migrations.py --check`` to fail if any registered hot query
+needs a full table scan.
+"""
+import json
+import logging
+import re
+import sys
+from db_connection import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    """Raised when a migration cannot be applied safely"""
+
+
+def _create_unique_slot_index(cursor):
+    # Refuse to build the index over existing double-bookings rather than
+    # silently cancelling someone's appointment
+    cursor.execute("""
+        SELECT doctor_name, appointment_date, appointment_time, COUNT(*) as count
+        FROM appointments
+        WHERE status != 'cancelled'
+        GROUP BY doctor_name, appointment_date, appointment_time
+        HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        slots = ', '.join(f"Dr. {d['doctor_name']} {d['appointment_date']} {d['appointment_time']}" for d in duplicates[:5])
+        raise MigrationError(f"{len(duplicates)} slots are double-booked ({slots}); resolve them before migrating")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_active_slot
+        ON appointments(doctor_name, appointment_date, appointment_time)
+        WHERE status != 'cancelled'
+    """)
+
+
+def _track_table_version(table):
+    """Steps that keep table_versions[table] bumped on every write to ``table``.
+
+    Caches compare the stamp instead of re-reading the table.
+    """
+    steps = [
+        """CREATE TABLE IF NOT EXISTS table_versions (
+               name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )""",
+        f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{table}', 0)",
+    ]
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        steps.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END""")
+    return steps
+
+
+def _add_column(table, column, definition):
+    """Step adding a column unless it is already there (older schema.sql copies)"""
+    def step(cursor):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row['name'] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# Older seeds closed the JSON object before the weekend entries:
+# '{"monday": ...}, "saturday": "09:00-17:00", "sunday": "09:00-17:00"'
+_MISPLACED_BRACE = re.compile(r'^\s*\{(.*)\}\s*,(.*)$', re.DOTALL)
+
+def _repair_doctor_schedules(cursor):
+    from doctor_schedules import ScheduleError, compile_schedule
+    cursor.execute("SELECT id, name, schedule FROM doctors")
+    for row in cursor.fetchall():
+        try:
+            compile_schedule(row['schedule'])
+            continue
+        except ScheduleError:
+            pass
+        match = _MISPLACED_BRACE.match(row['schedule'] or '')
+        if match:
+            repaired = '{' + match.group(1) + ',' + match.group(2) + '}'
+            try:
+                compile_schedule(repaired)
+            except ScheduleError:
+                pass
+            else:
+                cursor.execute("UPDATE doctors SET schedule = ? WHERE id = ?",
+                               (json.dumps(json.loads(repaired)), row['id']))
+                logger.info("Repaired schedule for Dr. %s", row['name'])
+                continue
+        logger.warning("Schedule for Dr. %s is invalid and needs fixing by hand", row['name'])
+
+
+# (version, name, steps). A step is an SQL string or a callable taking a cursor.
+# Never edit an applied migration, append a new one instead.
+MIGRATIONS = [
+    (1, 'hot path indexes', [
+        """CREATE INDEX IF NOT EXISTS idx_appointments_user_date_status
+           ON appointments(user_id, appointment_date, status)""",
+        _create_unique_slot_index,
+        """CREATE INDEX IF NOT EXISTS idx_appointments_date_active
+           ON appointments(appointment_date, doctor_name, appointment_time)
+           WHERE status != 'cancelled'""",
+        """CREATE INDEX IF NOT EXISTS idx_bills_user_status_due
+           ON bills(user_id, status, due_date)""",
+        """CREATE INDEX IF NOT EXISTS idx_bills_appointment
+           ON bills(appointment_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_prescriptions_user_status_end
+           ON prescriptions(user_id, status, end_date)""",
+        """CREATE INDEX IF NOT EXISTS idx_health_records_user_created
+           ON health_records(user_id, created_at)""",
+        """CREATE INDEX IF NOT EXISTS idx_patient_profiles_user
+           ON patient_profiles(user_id)""",
+    ]),
+    (2, 'doctors version stamp', _track_table_version('doctors')),
+    (3, 'repair malformed doctor schedules', [_repair_doctor_schedules]),
+    (4, 'appointment row versions', [
+        _add_column('appointments', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+        _add_column('appointments', 'updated_at', 'TIMESTAMP'),
+    ]),
+    # health_advice and health_events were only in database/schema.sql,
+    # but the chat handlers read them
+    (5, 'reference data tables and version stamps', [
+        """CREATE TABLE IF NOT EXISTS health_advice (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               category TEXT NOT NULL,
+               title TEXT NOT NULL,
+               content TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        """CREATE TABLE IF NOT EXISTS health_events (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               title TEXT NOT NULL,
+               description TEXT NOT NULL,
+               event_date DATE NOT NULL,
+               location TEXT,
+               max_participants INTEGER,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+    ] + _track_table_version('clinic_info')
+      + _track_table_version('clinic_services')
+      + _track_table_version('health_advice')
+      + _track_table_version('health_events')),
+    (6, 'server-side sessions and app settings', [
+        """CREATE TABLE IF NOT EXISTS sessions (
+               id TEXT PRIMARY KEY,
+               data TEXT NOT NULL,
+               expires_at INTEGER NOT NULL
+           ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS idx_sessions_expires
+           ON sessions(expires_at)""",
+        """CREATE TABLE IF NOT EXISTS app_settings (
+               name TEXT PRIMARY KEY,
+               value TEXT NOT NULL
+           )""",
+    ]),
+    # schedule_notification and notify_record_update wrote to a reminders
+    # table nothing created, and set_reminder to health_reminders columns
+    # that were only in database/schema.sql
+    (7, 'reminder delivery', [
+        """CREATE TABLE IF NOT EXISTS reminders (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER NOT NULL,
+               reminder_type TEXT NOT NULL,
+               reminder_message TEXT NOT NULL,
+               reminder_date TIMESTAMP NOT NULL,
+               is_recurring BOOLEAN DEFAULT 0,
+               recurrence_pattern TEXT,
+               status TEXT DEFAULT 'pending',
+               sent_at TIMESTAMP,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (user_id) REFERENCES users (id)
+           )""",
+        """CREATE INDEX IF NOT EXISTS idx_reminders_status_date
+           ON reminders(status, reminder_date)""",
+        _add_column('health_reminders', 'reminder_message', 'TEXT'),
+        _add_column('health_reminders', 'is_recurring', 'BOOLEAN DEFAULT 0'),
+        _add_column('health_reminders', 'recurrence_pattern', 'TEXT'),
+        _add_column('health_reminders', 'sent_at', 'TIMESTAMP'),
+        """CREATE INDEX IF NOT EXISTS idx_health_reminders_status_date
+           ON health_reminders(status, reminder_date)""",
+    ]),
+    (8, 'reminder dedupe keys and refill windows', [
+        _add_column('reminders', 'dedupe_key', 'TEXT'),
+        # NULLs never clash, so reminders without a key are unaffected
+        """CREATE UNIQUE INDEX IF NOT EXISTS uq_reminders_dedupe_key
+           ON reminders(dedupe_key)""",
+        """CREATE INDEX IF NOT EXISTS idx_prescriptions_status_end
+           ON prescriptions(status, end_date)""",
+    ]),
+]
+
+# Queries on the request path, mirrored from the handlers. Keep them in sync
+# when a handler's SQL changes so the plan check keeps meaning something.
+HOT_QUERIES = {
+    'user_appointments': ("""
+        SELECT id, appointment_date, appointment_time, doctor_name, appointment_type, status
+        FROM appointments
+        WHERE user_id = ?
+        AND appointment_date >= date('now', 'localtime')
+        AND status != 'cancelled'
+        AND (appointment_date, appointment_time, id) > (?, ?, ?)
+        ORDER BY appointment_date, appointment_time, id
+        LIMIT ?
+    """, (1, '', '', 0, 11)),
+    'slot_check': ("""
+        SELECT COUNT(*) as count
+        FROM appointments
+        WHERE doctor_name = ?
+        AND appointment_date = ?
+        AND appointment_time = ?
+        AND status != 'cancelled'
+    """, ('Smith', '2024-01-01', '09:00')),
+    'booked_slots_by_range': ("""
+        SELECT doctor_name, appointment_date, appointment_time
+        FROM appointments
+        WHERE appointment_date BETWEEN ? AND ?
+        AND status != 'cancelled'
+    """, ('2024-01-01', '2024-01-07')),
+    'pending_bills': ("""
+        SELECT id, amount, due_date, status, description
+        FROM bills
+        WHERE user_id = ? AND status = 'PENDING'
+        AND (due_date, id) > (?, ?)
+        ORDER BY due_date, id
+        LIMIT ?
+    """, (1, '', 0, 11)),
+    'pending_bills_total': ("""
+        SELECT COALESCE(SUM(amount), 0) AS total
+        FROM bills
+        WHERE user_id = ? AND status = 'PENDING'
+    """, (1,)),
+    'cancel_appointment_bills': ("""
+        UPDATE bills
+        SET status = 'CANCELLED'
+        WHERE appointment_id = ?
+    """, (1,)),
+    'active_prescriptions': ("""
+        SELECT * FROM prescriptions
+        WHERE user_id = ?
+        AND status = 'active'
+        AND (end_date IS NULL OR date(end_date) >= date('now'))
+        AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, (1, '\uffff', 2 ** 63 - 1, 11)),
+    'health_record_summary': ("""
+        SELECT * FROM health_records
+        WHERE user_id = ?
+        ORDER BY created_at DESC
+        LIMIT 10
+    """, (1,)),
+    'table_version': ("""
+        SELECT version FROM table_versions WHERE name = ?
+    """, ('doctors',)),
+    'reference_versions': ("""
+        SELECT name, version FROM table_versions WHERE name IN (?,?,?,?,?)
+    """, ('clinic_info', 'clinic_services', 'doctors', 'health_advice', 'health_events')),
+    'session_load': ("""
+        SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?
+    """, ('sid', 0)),
+    'session_expiry': ("""
+        DELETE FROM sessions WHERE expires_at <= ?
+    """, (0,)),
+    'reminders_new': ("""
+        SELECT t.id, t.user_id, u.email, t.reminder_date, t.status
+        FROM reminders t
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE t.id > ? ORDER BY t.id LIMIT ?
+    """, (0, 5000)),
+    'reminders_window': ("""
+        SELECT t.id, t.user_id, u.email, t.reminder_date, t.status
+        FROM reminders t
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE t.status = ? AND t.reminder_date > ? AND t.reminder_date <= ?
+        AND (t.reminder_date, t.id) > (?, ?)
+        ORDER BY t.reminder_date, t.id
+        LIMIT ?
+    """, ('pending', '2024-01-01 00:00:00', '2024-01-01 01:00:00', '', 0, 5000)),
+    'health_reminders_window': ("""
+        SELECT t.id, t.user_id, u.email, t.reminder_date, t.status
+        FROM health_reminders t
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE t.status = ? AND t.reminder_date > ? AND t.reminder_date <= ?
+        AND (t.reminder_date, t.id) > (?, ?)
+        ORDER BY t.reminder_date, t.id
+        LIMIT ?
+    """, ('active', '2024-01-01', '2024-01-02', '', 0, 5000)),
+    'refill_window': ("""
+        SELECT p.id, p.user_id, p.end_date
+        FROM prescriptions p
+        WHERE p.status = 'active' AND p.end_date >= ? AND p.end_date < ?
+        AND (p.end_date, p.id) > (?, ?)
+        ORDER BY p.end_date, p.id
+        LIMIT ?
+    """, ('2024-01-01', '2024-01-31', '', 0, 1000)),
+    'profile_with_user': ("""
+        SELECT p.*, u.email, u.phone, u.address, u.emergency_contact
+        FROM patient_profiles p
+        JOIN users u ON p.user_id = u.id
+        WHERE p.user_id = ?
+    """, (1,)),
+}
+
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+# One row per tracked table; after ANALYZE the planner rightly scans these
+BOUNDED_TABLES = frozenset(('table_versions',))
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def get_schema_version(conn):
+    """Highest applied migration version, 0 for a fresh database"""
+    cursor = conn.cursor()
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT MAX(version) as version FROM schema_migrations")
+    return cursor.fetchone()['version'] or 0
+
+
+def run_migrations():
+    """Apply pending migrations in order, one transaction each"""
+    with get_connection() as conn:
+        current = get_schema_version(conn)
+        applied = []
+        for version, name, steps in MIGRATIONS:
+            if version <= current:
+                continue
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info("Applied migration %s: %s", version, name)
+            applied.append(version)
+        return applied
+
+
+def check_query_plans(conn, queries=None):
+    """Return (query name, plan detail) for every hot query that does a full scan"""
+    problems = []
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row['detail']
+            scan = _FULL_SCAN.match(detail)
+            if scan and scan.group(1) not in BOUNDED_TABLES and not detail.startswith('SCAN CONSTANT ROW'):
+                problems.append((name, detail))
+    return problems
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    from db_connection import initialize_database
+    configure_logging()
+    initialize_database()
+    if '--check' in sys.argv:
+        with get_connection() as conn:
+            print(f"Schema version: {get_schema_version(conn)}")
+            problems = check_query_plans(conn)
+        for name, detail in problems:
+            print(f"FULL SCAN in {name}: {detail}")
+        if problems:
+            sys.exit(1)
+        print(f"All {len(HOT_QUERIES)} hot queries use an index")
@@ -1,9 +1,30 @@
-from db_connection import get_db
+from db_connection import get_connection, retry_on_busy
 
 def schedule_notification(user_id, reminder_type, reminder_message, reminder_date):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO reminders (user_id, reminder_type, reminder_message, reminder_date) VALUES (?, ?, ?, ?)",
-                   (user_id, reminder_type, reminder_message, reminder_date))
-    conn.commit()
-    conn.close()
+    """Queue a reminder for reminder_dispatcher; ``reminder_date`` is a local datetime or its text"""
+    if hasattr(reminder_date, 'strftime'):
+        # The dispatcher compares dates as text, so store one fixed format
+        reminder_date = reminder_date.strftime('%Y-%m-%d %H:%M:%S')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO reminders (user_id, reminder_type, reminder_message, reminder_date) VALUES (?, ?, ?, ?)",
+                       (user_id, reminder_type, reminder_message, reminder_date))
+        conn.commit()
+
+@retry_on_busy
+def schedule_notifications(rows):
+    """Queue many reminders in one transaction; returns how many were added.
+
+    ``rows`` are (user_id, reminder_type, reminder_message, reminder_date,
+    dedupe_key) with dates as text. A row whose dedupe_key is already in
+    the table is skipped, so a job can be re-run without duplicates.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT OR IGNORE INTO reminders (user_id, reminder_type, reminder_message, reminder_date, dedupe_key)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        added = cursor.rowcount
+        conn.commit()
+    return added
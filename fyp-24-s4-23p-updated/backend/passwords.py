@@ -0,0 +1,233 @@
+"""Password hashing with a tunable KDF, run on a bounded worker pool.
+
+New hashes use PASSWORD_SCHEME at PASSWORD_COST:
+
+* ``bcrypt`` (default): cost is the log2 work factor, ``$2b$12$...``
+* ``scrypt``: cost is log2 of N (r=8, p=1), ``$scrypt$ln=15,r=8,p=1$salt$hash``
+
+Any stored hash can be verified whatever the current setting. Values that
+are neither are legacy plaintext passwords; ``check`` accepts them and,
+like a hash with an outdated scheme or cost, returns a replacement hash
+so the caller can upgrade the row on the next successful login.
+
+Hashing and verifying take tens to hundreds of milliseconds of CPU, so
+they run on a small thread pool (PASSWORD_WORKERS) instead of on as many
+request threads as happen to be logging in: both KDFs release the GIL, and
+the pool keeps a burst of logins from taking every core. At most
+PASSWORD_MAX_PENDING calls may be queued or running; past that a caller
+waits up to PASSWORD_QUEUE_WAIT seconds for room and then gets
+PasswordBusyError instead of joining an ever-growing queue.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_SCHEME = os.environ.get('PASSWORD_SCHEME', 'bcrypt')
+DEFAULT_COSTS = {'bcrypt': 12, 'scrypt': 15}
+
+
+class PasswordBusyError(Exception):
+    """Raised when the hashing pool is saturated"""
+
+
+class BcryptHasher:
+    """bcrypt through the ``bcrypt`` package; cost is log2 of the rounds"""
+
+    name = 'bcrypt'
+    _FORMAT = re.compile(r'^\$2[aby]\$(\d\d)\$[./A-Za-z0-9]{53}$')
+
+    def __init__(self, cost):
+        import bcrypt
+
+        self._bcrypt = bcrypt
+        self.cost = cost
+
+    @classmethod
+    def identify(cls, stored):
+        match = cls._FORMAT.match(stored)
+        return int(match.group(1)) if match else None
+
+    def hash(self, password):
+        return self._bcrypt.hashpw(password.encode('utf-8'), self._bcrypt.gensalt(self.cost)).decode('ascii')
+
+    def verify(self, password, stored):
+        return self._bcrypt.checkpw(password.encode('utf-8'), stored.encode('ascii'))
+
+
+class ScryptHasher:
+    """scrypt from hashlib; cost is log2 of N, with r=8 and p=1"""
+
+    name = 'scrypt'
+    R = 8
+    P = 1
+    _FORMAT = re.compile(r'^\$scrypt\$ln=(\d+),r=(\d+),p=(\d+)\$([A-Za-z0-9+/]+)\$([A-Za-z0-9+/]+)$')
+
+    def __init__(self, cost):
+        self.cost = cost
+
+    @classmethod
+    def identify(cls, stored):
+        match = cls._FORMAT.match(stored)
+        if not match or (int(match.group(2)), int(match.group(3))) != (cls.R, cls.P):
+            return None
+        return int(match.group(1))
+
+    @staticmethod
+    def _b64encode(data):
+        return base64.b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _b64decode(text):
+        return base64.b64decode(text + '=' * (-len(text) % 4))
+
+    @classmethod
+    def _derive(cls, password, salt, cost, length=32):
+        n = 2 ** cost
+        # OpenSSL needs a little over 128 * r * N bytes
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=cls.R, p=cls.P,
+                              maxmem=2 * 128 * cls.R * (n + 2), dklen=length)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        key = self._derive(password, salt, self.cost)
+        return f"$scrypt$ln={self.cost},r={self.R},p={self.P}${self._b64encode(salt)}${self._b64encode(key)}"
+
+    def verify(self, password, stored):
+        match = self._FORMAT.match(stored)
+        expected = self._b64decode(match.group(5))
+        key = self._derive(password, self._b64decode(match.group(4)), int(match.group(1)), len(expected))
+        return hmac.compare_digest(key, expected)
+
+
+HASHERS = {'bcrypt': BcryptHasher, 'scrypt': ScryptHasher}
+
+
+class PasswordHasher:
+    """Hashes with one scheme and cost, verifies any of them, on its own bounded pool"""
+
+    def __init__(self, scheme=PASSWORD_SCHEME, cost=None, workers=None, max_pending=None, queue_wait=None):
+        if scheme not in HASHERS:
+            raise ValueError(f"Unknown password scheme '{scheme}', expected one of {sorted(HASHERS)}")
+        self.scheme = scheme
+        self.cost = int(cost or os.environ.get('PASSWORD_COST', DEFAULT_COSTS[scheme]))
+        self.workers = int(workers or os.environ.get('PASSWORD_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+        self.max_pending = int(max_pending or os.environ.get('PASSWORD_MAX_PENDING', self.workers * 16))
+        self.queue_wait = float(queue_wait if queue_wait is not None else os.environ.get('PASSWORD_QUEUE_WAIT', 2.0))
+        self._hashers = {}
+        self._hasher(scheme, self.cost)
+        self._dummy_hash = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+
+    def _hasher(self, scheme, cost):
+        hasher = self._hashers.get((scheme, cost))
+        if hasher is None:
+            hasher = self._hashers[(scheme, cost)] = HASHERS[scheme](cost)
+        return hasher
+
+    def _identify(self, stored):
+        """(scheme, cost) of a stored hash, or (None, None) for a plaintext password"""
+        for scheme, hasher_class in HASHERS.items():
+            cost = hasher_class.identify(stored)
+            if cost is not None:
+                return scheme, cost
+        return None, None
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_wait):
+            logger.warning("Password hashing pool is full (%s pending)", self.max_pending)
+            raise PasswordBusyError("Too many password checks in progress")
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, func, *args):
+        return self._submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(self._hasher(self.scheme, self.cost).hash, password)
+
+    def hash_many(self, passwords):
+        """Hashes of ``passwords``, in order, for bulk provisioning.
+
+        At most ``workers`` of them are queued at a time, so logins arriving
+        meanwhile wait behind a handful of hashes rather than the whole batch.
+        """
+        hasher = self._hasher(self.scheme, self.cost)
+        in_flight = threading.Semaphore(self.workers)
+        futures = []
+        for password in passwords:
+            in_flight.acquire()
+            try:
+                future = self._submit(hasher.hash, password)
+            except BaseException:
+                in_flight.release()
+                raise
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def check(self, password, stored):
+        """(matches, replacement hash or None) for ``password`` against ``stored``.
+
+        ``stored`` of None (no such user) is checked against a dummy hash,
+        so an unknown username takes as long as a wrong password.
+        """
+        return self._run(self._check, password, stored)
+
+    def _check(self, password, stored):
+        current = self._hasher(self.scheme, self.cost)
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = current.hash(secrets.token_hex(16))
+            current.verify(password, self._dummy_hash)
+            return False, None
+
+        scheme, cost = self._identify(stored)
+        if scheme is None:
+            matches = hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        else:
+            matches = self._hasher(scheme, cost).verify(password, stored)
+        if not matches or (scheme, cost) == (self.scheme, self.cost):
+            return matches, None
+        return True, current.hash(password)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_hasher = None
+_hasher_pid = None
+_hasher_lock = threading.Lock()
+
+def get_password_hasher():
+    """Process-wide PasswordHasher, configured from the environment"""
+    global _hasher, _hasher_pid
+    if _hasher is None or _hasher_pid != os.getpid():
+        with _hasher_lock:
+            if _hasher is None or _hasher_pid != os.getpid():
+                _hasher = PasswordHasher()
+                _hasher_pid = os.getpid()
+    return _hasher
+
+def hash_password(password):
+    return get_password_hasher().hash(password)
+
+def hash_passwords(passwords):
+    return get_password_hasher().hash_many(passwords)
+
+def check_password(password, stored):
+    """(matches, replacement hash or None); see PasswordHasher.check"""
+    return get_password_hasher().check(password, stored)
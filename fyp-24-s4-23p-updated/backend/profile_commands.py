@@ -0,0 +1,112 @@
+"""Profile commands typed into the chat, and the profile fields they update.
+
+Every message reaches ``match_profile_command`` before any other routing,
+and almost none are profile commands. All command patterns are combined
+into one regex at import time, behind a literal substring prefilter that
+rejects ordinary messages without running a regex at all. A match maps straight to a
+ProfileCommand carrying the ProfileField to update, so nothing is looked
+up per message.
+
+PROFILE_FIELDS and FIELD_ALIASES are also what
+``DialogflowHandler.update_health_records`` uses to resolve the field a
+user names, and ``apply_profile_update`` is the single write path.
+"""
+import re
+from collections import namedtuple
+from db_connection import get_connection
+from user_cache import PROFILE, invalidate_user
+
+ProfileField = namedtuple('ProfileField', ['name', 'table', 'column', 'label'])
+
+PROFILE_FIELDS = {
+    'phone': ProfileField('phone', 'users', 'phone', 'phone'),
+    'address': ProfileField('address', 'users', 'address', 'address'),
+    'blood_type': ProfileField('blood_type', 'patient_profiles', 'blood_type', 'blood type'),
+    'allergies': ProfileField('allergies', 'patient_profiles', 'allergies', 'allergies'),
+    'emergency_contact': ProfileField('emergency_contact', 'users', 'emergency_contact', 'emergency contact'),
+}
+
+# What users call each field
+FIELD_ALIASES = {
+    'phone': PROFILE_FIELDS['phone'],
+    'telephone': PROFILE_FIELDS['phone'],
+    'mobile': PROFILE_FIELDS['phone'],
+    'address': PROFILE_FIELDS['address'],
+    'location': PROFILE_FIELDS['address'],
+    'blood type': PROFILE_FIELDS['blood_type'],
+    'bloodtype': PROFILE_FIELDS['blood_type'],
+    'blood': PROFILE_FIELDS['blood_type'],
+    'allergies': PROFILE_FIELDS['allergies'],
+    'allergy': PROFILE_FIELDS['allergies'],
+    'emergency contact': PROFILE_FIELDS['emergency_contact'],
+    'emergency': PROFILE_FIELDS['emergency_contact'],
+    'contact': PROFILE_FIELDS['emergency_contact'],
+}
+
+UPDATE = 'update'
+SHOW = 'show'
+
+# ``field`` is a ProfileField for UPDATE, None for SHOW
+ProfileCommand = namedtuple('ProfileCommand', ['op', 'field', 'value'])
+
+SHOW_PROFILE_COMMAND = ProfileCommand(SHOW, None, None)
+
+# Literals every command contains; the leading U/M may be either case.
+# Checking them is a plain substring scan, far cheaper than any regex.
+_MARKERS = ('pdate my ', 'y blood type is ')
+
+# All commands in one pattern, sharing the "update my" prefix. The group
+# named after a field captures its new value; when a message holds
+# several commands the leftmost one wins.
+_COMMANDS = re.compile(r"""
+    [Uu]pdate\ my\ (?:
+        (?:phone|telephone|mobile)(?:\ number)?\ to\ (?P<phone>\d+)
+      | address\ to\ (?P<address>.+)
+      | allergies\ to\ (?P<allergies>.+)
+      | emergency\ contact\ to\ (?P<emergency_contact>.+)
+    )
+  | [Mm]y\ blood\ type\ is\ (?P<blood_type>A\+|A-|B\+|B-|O\+|O-|AB\+|AB-)
+""", re.VERBOSE)
+
+
+def match_profile_command(message):
+    """ProfileCommand for a profile update or 'show my profile information', else None"""
+    if _MARKERS[0] in message or _MARKERS[1] in message:
+        match = _COMMANDS.search(message)
+        if match:
+            return ProfileCommand(UPDATE, PROFILE_FIELDS[match.lastgroup], match.group(match.lastgroup).strip())
+    if message.lower().strip() == 'show my profile information':
+        return SHOW_PROFILE_COMMAND
+    return None
+
+
+def resolve_field(name):
+    """ProfileField for a field name or alias such as 'mobile' or 'blood type', else None"""
+    key = name.lower().strip()
+    return FIELD_ALIASES.get(key) or PROFILE_FIELDS.get(key)
+
+
+def apply_profile_update(user_id, field, value):
+    """Write ``value`` to ``field`` (a ProfileField); False if there was no row to update.
+
+    Creates the patient profile when a profile field is set before one exists.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if field.table == 'users':
+            cursor.execute(f"UPDATE users SET {field.column} = ? WHERE id = ?", (value, user_id))
+        else:
+            cursor.execute("SELECT id FROM patient_profiles WHERE user_id = ?", (user_id,))
+            if not cursor.fetchone():
+                cursor.execute("INSERT INTO patient_profiles (user_id) VALUES (?)", (user_id,))
+            cursor.execute(f"""
+                UPDATE patient_profiles
+                SET {field.column} = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = ?
+            """, (value, user_id))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False
+        conn.commit()
+    invalidate_user(user_id, PROFILE)
+    return True
@@ -0,0 +1,147 @@
+"""Login rate limiting in fixed memory.
+
+Every credential check (/login, /change-password) first takes a token from
+two buckets: one for the client IP and one for the username. A bucket
+holds up to ``burst`` tokens and refills continuously; an empty bucket
+means the attempt is refused with a Retry-After before any database or
+KDF work. Rates are "attempts/seconds" strings:
+
+    LOGIN_IP_RATE=30/60     LOGIN_USER_RATE=5/60     LOGIN_RATE_LIMIT=0 turns it off
+
+Buckets live in a TokenBucketTable: flat arrays of LOGIN_LIMIT_SLOTS sets
+of four entries, so memory is fixed and a check is a hash, at most four
+comparisons and some arithmetic. When a set is full the least recently
+used bucket is replaced; a replaced key starts over with a full bucket,
+which is the price of the bound.
+
+There is deliberately no cache of unknown usernames: it would be per
+process, so a name registered on one worker would keep failing on the
+others, and answering such names without the dummy hash would tell an
+attacker which usernames exist. The buckets already bound the guessing.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('LOGIN_RATE_LIMIT', '1').lower() not in ('0', 'false', 'no')
+
+
+def parse_rate(spec):
+    """'5/60' -> (5.0 tokens of burst, 5/60 tokens per second)"""
+    attempts, _, seconds = spec.partition('/')
+    attempts, seconds = float(attempts), float(seconds or 1)
+    if attempts <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate '{spec}', expected attempts/seconds")
+    return attempts, attempts / seconds
+
+
+class TokenBucketTable:
+    """Token buckets keyed by string, in ``slots`` sets of WAYS entries"""
+
+    WAYS = 4
+
+    def __init__(self, burst, per_second, slots=4096):
+        self.burst = float(burst)
+        self.per_second = float(per_second)
+        self.slots = slots
+        size = slots * self.WAYS
+        self._keys = [None] * size
+        self._tokens = array('d', [0.0]) * size
+        self._stamps = array('d', [0.0]) * size
+
+    def index(self, key, now):
+        """Slot holding ``key``'s bucket, refilled to ``now``; claims one if absent"""
+        base = hash(key) % self.slots * self.WAYS
+        victim = base
+        for index in range(base, base + self.WAYS):
+            if self._keys[index] == key:
+                elapsed = now - self._stamps[index]
+                if elapsed > 0:
+                    self._tokens[index] = min(self.burst, self._tokens[index] + elapsed * self.per_second)
+                    self._stamps[index] = now
+                return index
+            if self._stamps[index] < self._stamps[victim]:
+                victim = index
+        self._keys[victim] = key
+        self._tokens[victim] = self.burst
+        self._stamps[victim] = now
+        return victim
+
+    def wait(self, index):
+        """Seconds until the bucket at ``index`` has a whole token"""
+        missing = 1.0 - self._tokens[index]
+        return missing / self.per_second if missing > 0 else 0.0
+
+    def take(self, index):
+        self._tokens[index] -= 1.0
+
+    def refill(self, index):
+        self._tokens[index] = self.burst
+
+
+class LoginRateLimiter:
+    """Per-IP and per-username token buckets in front of credential checks"""
+
+    def __init__(self, ip_rate='30/60', user_rate='5/60', slots=4096, enabled=True):
+        self.enabled = enabled
+        self._ips = TokenBucketTable(*parse_rate(ip_rate), slots=slots)
+        self._users = TokenBucketTable(*parse_rate(user_rate), slots=slots)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _user_key(username):
+        return (username or '').strip().lower()
+
+    def acquire(self, username, ip, now=None):
+        """Take one attempt for ``username`` from ``ip``; returns 0, or seconds to wait if refused.
+
+        Either both buckets pay or neither does, so a refused attempt does
+        not drain the other bucket.
+        """
+        if not self.enabled:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ip_index = self._ips.index(ip or '', now)
+            user_index = self._users.index(self._user_key(username), now)
+            wait = max(self._ips.wait(ip_index), self._users.wait(user_index))
+            if wait:
+                return wait
+            self._ips.take(ip_index)
+            self._users.take(user_index)
+            return 0
+
+    def reset_user(self, username, now=None):
+        """Refill a username's bucket after it proved its password"""
+        if not self.enabled:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._users.refill(self._users.index(self._user_key(username), now))
+
+
+def retry_after_header(seconds):
+    return {'Retry-After': str(max(1, math.ceil(seconds)))}
+
+
+_limiter = None
+_lock = threading.Lock()
+
+def get_login_limiter():
+    """Process-wide LoginRateLimiter, configured from the environment"""
+    global _limiter
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = LoginRateLimiter(
+                    ip_rate=os.environ.get('LOGIN_IP_RATE', '30/60'),
+                    user_rate=os.environ.get('LOGIN_USER_RATE', '5/60'),
+                    slots=int(os.environ.get('LOGIN_LIMIT_SLOTS', 4096)),
+                    enabled=ENABLED
+                )
+    return _limiter
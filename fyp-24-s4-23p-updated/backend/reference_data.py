@@ -0,0 +1,264 @@
+"""Immutable snapshot of the clinic's reference data, with pre-rendered replies.
+
+Clinic info, services, doctors, health advice and health events change a
+few times a year but were read on every FAQ-type message. They are loaded
+once into a ReferenceSnapshot whose chat replies are rendered up front, per
+variant (clinic info type, service category, speciality, advice
+category), so answering is a dict lookup. A new snapshot is built when any
+of the tables' version stamps in ``table_versions`` changes; stamps are
+checked at most every REFERENCE_DATA_CHECK_INTERVAL seconds, and the
+snapshot in use is never modified.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from types import MappingProxyType
+from db_connection import get_read_connection
+
+logger = logging.getLogger(__name__)
+
+TABLES = ('clinic_info', 'clinic_services', 'doctors', 'health_advice', 'health_events')
+
+NOT_UNDERSTOOD = "I'm having trouble understanding. Could you please try again?"
+
+SERVICE_CATEGORY_EMOJIS = {
+    'General': '👨‍⚕️',
+    'Specialist': '🏥',
+    'Laboratory': '🔬',
+    'Emergency': '🚑',
+    'Preventive': '💉'
+}
+
+
+def _rows(cursor, query):
+    """Rows as dicts; a table the database does not have yet reads as empty"""
+    try:
+        cursor.execute(query)
+    except sqlite3.OperationalError as e:
+        logger.warning("Reference data not loaded: %s", e)
+        return ()
+    return tuple(dict(row) for row in cursor.fetchall())
+
+
+def render_clinic_info(info):
+    """{info type: reply} for get_clinic_info"""
+    return {
+        'opening_hours': f"🕒 Our clinic hours are:\n{info['opening_hours']}\n\n. Need to schedule an appointment?",
+        'location': f"📍 We are located at:\n{info['address']}\n\n🗺️ Map: {info['map_link']}\n\nWould you like directions?",
+        'contact': f"📞 Phone: {info['phone']}\n📧 Email: {info['email']}\n⏰ Support Hours: {info['support_hours']}\n\nHow can we help you today?",
+        'all': f"""📍 Clinic Information:
+🏥 {info['name']}
+📍 Address: {info['address']}
+📞 Phone: {info['phone']}
+📧 Email: {info['email']}
+🕒 Hours: {info['opening_hours']}
+⏰ Support: {info['support_hours']}
+🗺️ Map: {info['map_link']}
+
+Would you like to schedule an appointment?"""
+    }
+
+
+def render_services(services):
+    if not services:
+        return NOT_UNDERSTOOD
+    response = "Here are our available services:\n\n"
+    current_category = None
+    for service in services:
+        if current_category != service['category']:
+            current_category = service['category']
+            emoji = SERVICE_CATEGORY_EMOJIS.get(current_category, '🏥')
+            response += f"\n{emoji} {current_category}:\n"
+        response += f"- {service['name']}\n"
+        if service['description']:
+            response += f"  {service['description']}\n"
+    return response
+
+
+def render_service_detail(service):
+    response = f" {service['name']}\n\n"
+    response += f"Description: {service['description']}\n"
+    if service['duration']:
+        response += f"Duration: {service['duration']} minutes\n"
+    if service['price']:
+        response += f"Price: ${service['price']}\n"
+    response += "\nWould you like to schedule an appointment for this service?"
+    return response
+
+
+def render_doctors(doctors):
+    if not doctors:
+        return NOT_UNDERSTOOD
+    response = "I'll help you schedule an appointment. Here are our available doctors:\n\n"
+    for doctor in doctors:
+        response += f"👨‍⚕️ Dr. {doctor['name']} - {doctor['speciality']}\n"
+        if doctor['schedule']:
+            try:
+                json.loads(doctor['schedule'])
+                response += "Available slots for tomorrow:\n"
+                for slot in ["9:00 AM", "10:00 AM", "11:00 AM"]:
+                    response += f"- {slot}\n"
+            except ValueError:
+                response += "Schedule available upon request\n"
+        response += "\n"
+    response += "Please choose a doctor and time slot."
+    return response
+
+
+def render_advice(advice):
+    if not advice:
+        return "No health advice found."
+    response = "🏥 Health Advice:\n\n"
+    for item in advice:
+        response += f"📌 {item['title']}\n"
+        response += f"📝 {item['content']}\n"
+        response += "─────────────────\n"
+    return response
+
+
+def render_event(event):
+    return (f"📌 {event['title']}\n"
+            f"📝 {event['description']}\n"
+            f"📅 Date: {event['event_date']}\n"
+            f"📍 Location: {event['location']}\n"
+            "──────────────\n")
+
+
+def _variants(rows, key, render):
+    """{None: reply for all rows, value of ``key``: reply for those rows}, read-only"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[key], []).append(row)
+    texts = {value: render(group) for value, group in groups.items()}
+    texts[None] = render(rows)
+    return MappingProxyType(texts)
+
+
+class ReferenceSnapshot:
+    """One consistent, read-only view of the reference tables and their replies"""
+
+    def __init__(self, clinic, services, doctors, advice, events, versions=None):
+        self.versions = versions
+        self.clinic = MappingProxyType(clinic) if clinic else None
+        self.clinic_texts = MappingProxyType(render_clinic_info(clinic) if clinic else {})
+
+        active = sorted((s for s in services if s['status'] == 'active'), key=lambda s: (s['category'], s['id']))
+        self.service_texts = _variants(active, 'category', render_services)
+        self.service_details = tuple((s['name'].lower(), (s['category'] or '').lower(), render_service_detail(s))
+                                     for s in services)
+
+        active = sorted((d for d in doctors if d['status'] == 'active'), key=lambda d: (d['speciality'], d['name']))
+        self.doctor_texts = _variants(active, 'speciality', render_doctors)
+        self.advice_texts = _variants(advice, 'category', render_advice)
+
+        # (date, rendered event) by date; which ones are upcoming depends on today
+        self.events = tuple((str(e['event_date']), render_event(e))
+                            for e in sorted(events, key=lambda e: (str(e['event_date']), e['id'])))
+
+    @classmethod
+    def load(cls, conn, versions=None):
+        cursor = conn.cursor()
+        clinic = _rows(cursor, "SELECT * FROM clinic_info ORDER BY id LIMIT 1")
+        return cls(
+            clinic[0] if clinic else None,
+            _rows(cursor, "SELECT * FROM clinic_services ORDER BY id"),
+            _rows(cursor, "SELECT * FROM doctors ORDER BY id"),
+            _rows(cursor, "SELECT * FROM health_advice ORDER BY id"),
+            _rows(cursor, "SELECT * FROM health_events ORDER BY id"),
+            versions
+        )
+
+    def clinic_info(self, info_type):
+        """{'text', 'data'} as DialogflowHandler.get_clinic_info returns it"""
+        if self.clinic is None:
+            return {'text': "Sorry, clinic information is not available at the moment.", 'data': None}
+        text = self.clinic_texts.get(info_type)
+        return {'text': text, 'data': self.clinic if text else None}
+
+    def services_text(self, category=None):
+        return self.service_texts.get(category or None, NOT_UNDERSTOOD)
+
+    def service_detail(self, service_type):
+        """Reply for the first service whose name or category contains ``service_type``, else None"""
+        wanted = service_type.lower()
+        for name, category, text in self.service_details:
+            if wanted in name or wanted in category:
+                return text
+        return None
+
+    def doctors_text(self, speciality=None):
+        return self.doctor_texts.get(speciality or None, NOT_UNDERSTOOD)
+
+    def advice_text(self, category=None):
+        return self.advice_texts.get(category or None, "No health advice found.")
+
+    def events_text(self, today=None):
+        # date('now') in SQLite is UTC
+        today = today or datetime.now(timezone.utc).date().isoformat()
+        upcoming = [text for event_date, text in self.events if event_date >= today]
+        if not upcoming:
+            return "No upcoming health events found."
+        return "🎯 Upcoming Health Events:\n\n" + ''.join(upcoming)
+
+
+def _table_versions(conn):
+    """(version, ...) for TABLES, None if any of them is not stamped"""
+    try:
+        rows = conn.execute(
+            f"SELECT name, version FROM table_versions WHERE name IN ({','.join('?' * len(TABLES))})", TABLES
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    versions = {row['name']: row['version'] for row in rows}
+    if len(versions) != len(TABLES):
+        return None
+    return tuple(versions[table] for table in TABLES)
+
+
+class ReferenceData:
+    """Holds the current ReferenceSnapshot and swaps in a new one when the data changes"""
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or time.monotonic() - self._checked_at >= self.check_interval:
+                with get_read_connection() as conn:
+                    # Stamps are read before the data, so a write in between
+                    # only causes one extra reload on the next check
+                    versions = _table_versions(conn)
+                    # Unstamped (not migrated yet) databases reload on every check
+                    if self._snapshot is None or versions is None or versions != self._snapshot.versions:
+                        self._snapshot = ReferenceSnapshot.load(conn, versions)
+                        self.loads += 1
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+_reference_data = None
+_reference_lock = threading.Lock()
+
+def get_reference_data():
+    """Process-wide ReferenceData"""
+    global _reference_data
+    if _reference_data is None:
+        with _reference_lock:
+            if _reference_data is None:
+                _reference_data = ReferenceData(float(os.environ.get('REFERENCE_DATA_CHECK_INTERVAL', 5.0)))
+    return _reference_data
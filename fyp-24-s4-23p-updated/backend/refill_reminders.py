@@ -0,0 +1,135 @@
+"""Refill reminders for every active prescription that is running out.
+
+Meant to run daily. Each active prescription whose end_date falls within
+the next ``--lookahead`` days gets one reminder, due ``--days-before``
+days before the end date at REFILL_REMINDER_TIME, or straight away if
+that moment has passed. With refills left it points the patient at a
+refill request; without, at renewing the prescription.
+
+Reminder dates and messages are computed in SQL over the
+(status, end_date) index, ``--chunk-size`` prescriptions at a time, and
+each chunk is written with one ``executemany`` in one transaction. Every
+reminder carries the dedupe key ``refill:<prescription id>:<end date>``
+and is inserted with INSERT OR IGNORE against its unique index, so a
+re-run, or a second host running the job, adds nothing twice, while a
+prescription renewed with a new end date gets a new reminder.
+
+Usage: python refill_reminders.py [--days-before N] [--lookahead N] [--chunk-size N]
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from db_connection import get_read_connection
+from notification_scheduler import schedule_notifications
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get('REFILL_CHUNK_SIZE', 1000))
+DEFAULT_DAYS_BEFORE = 3
+DEFAULT_LOOKAHEAD = 30
+REMINDER_TIME = os.environ.get('REFILL_REMINDER_TIME', '09:00')
+
+_SELECT = """
+    SELECT p.id, p.user_id, p.end_date,
+           MAX(datetime(date(p.end_date), ?, ?), ?) AS reminder_date,
+           CASE WHEN p.refills_remaining > 0 THEN 'prescription_refill' ELSE 'prescription_renewal' END
+               AS reminder_type,
+           CASE WHEN p.refills_remaining > 0
+                THEN 'Your ' || p.medication_name || ' prescription runs out on ' || date(p.end_date)
+                     || '. You have ' || p.refills_remaining || ' refill(s) left; ask for one in the chat.'
+                ELSE 'Your ' || p.medication_name || ' prescription runs out on ' || date(p.end_date)
+                     || ' and has no refills left. Please book an appointment to renew it.'
+           END AS message,
+           'refill:' || p.id || ':' || date(p.end_date) AS dedupe_key
+    FROM prescriptions p
+"""
+
+
+class RefillReport:
+    """Prescriptions scanned and reminders added by one run"""
+
+    def __init__(self):
+        self.scanned = 0
+        self.added = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        return (f"{self.scanned} prescriptions due for a refill: {self.added} reminders added, "
+                f"{self.scanned - self.added} already queued, in {self.seconds:.2f}s")
+
+
+def _date_parameters(days_before, now):
+    hours, minutes = REMINDER_TIME.split(':')
+    return (f"-{int(days_before)} days", f"+{int(hours) * 60 + int(minutes)} minutes",
+            now.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def _rows(found):
+    return [(row['user_id'], row['reminder_type'], row['message'], row['reminder_date'], row['dedupe_key'])
+            for row in found]
+
+
+def generate_refill_reminders(days_before=DEFAULT_DAYS_BEFORE, lookahead=DEFAULT_LOOKAHEAD,
+                              chunk_size=DEFAULT_CHUNK_SIZE, now=None):
+    """Queue refill reminders for every active prescription ending in the next ``lookahead`` days"""
+    start = time.perf_counter()
+    now = now or datetime.now()
+    report = RefillReport()
+    window = (now.date().isoformat(), (now.date() + timedelta(days=lookahead + 1)).isoformat())
+    position = ('', 0)
+    while True:
+        with get_read_connection() as conn:
+            found = conn.execute(f"""
+                {_SELECT}
+                WHERE p.status = 'active' AND p.end_date >= ? AND p.end_date < ?
+                AND (p.end_date, p.id) > (?, ?)
+                ORDER BY p.end_date, p.id
+                LIMIT ?
+            """, _date_parameters(days_before, now) + window + position + (chunk_size,)).fetchall()
+        if found:
+            report.scanned += len(found)
+            report.added += schedule_notifications(_rows(found))
+            position = (found[-1]['end_date'], found[-1]['id'])
+        if len(found) < chunk_size:
+            break
+    report.seconds = time.perf_counter() - start
+    logger.info(report.summary())
+    return report
+
+
+def schedule_prescription_reminder(user_id, prescription_id, days_before=DEFAULT_DAYS_BEFORE, now=None):
+    """Queue the refill reminder for one of ``user_id``'s prescriptions.
+
+    False unless the prescription is the user's, active and not yet past
+    its end date.
+    """
+    now = now or datetime.now()
+    with get_read_connection() as conn:
+        found = conn.execute(f"""
+            {_SELECT}
+            WHERE p.id = ? AND p.user_id = ? AND p.status = 'active' AND p.end_date >= ?
+        """, _date_parameters(days_before, now) + (prescription_id, user_id, now.date().isoformat())).fetchall()
+    if not found:
+        return False
+    schedule_notifications(_rows(found))
+    return True
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Queue refill reminders for prescriptions running out")
+    parser.add_argument('--days-before', type=int, default=DEFAULT_DAYS_BEFORE,
+                        help="days before the end date to remind")
+    parser.add_argument('--lookahead', type=int, default=DEFAULT_LOOKAHEAD,
+                        help="prescriptions ending within this many days")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="prescriptions per transaction")
+    parser.add_argument('--today', type=date.fromisoformat, help="run as of this date, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    from db_connection import initialize_database
+    initialize_database()
+    now = datetime.combine(args.today, datetime.now().time()) if args.today else None
+    print(generate_refill_reminders(args.days_before, args.lookahead, args.chunk_size, now).summary())
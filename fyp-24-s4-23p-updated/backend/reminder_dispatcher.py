@@ -0,0 +1,471 @@
+"""Delivers due rows from ``reminders`` and ``health_reminders``.
+
+The dispatcher keeps the reminders due within REMINDER_HORIZON seconds in
+a heap ordered by due time, sleeps until the earliest one (or the next
+poll), and fires everything due in batches of up to REMINDER_BATCH_SIZE
+through a sink. It never rescans a table. Each poll reads:
+
+* rows inserted since the last poll, by id above a high-water mark (only
+  those due inside the loaded window are kept; later ones wait for it);
+* rows whose due time has just entered the window, as one range over the
+  (status, reminder_date) index, whose upper bound is the second mark.
+
+So a poll costs the rows that are new or coming due, not the table size.
+On start the window opens REMINDER_MAX_LATENESS seconds in the past (a
+day earlier for date-only tables, so a reminder dated yesterday is still
+read): reminders missed while the dispatcher was down are sent, and any
+whose due time is older than that is left alone.
+
+A batch is claimed in one transaction: each row is marked sent (or, if
+recurring, moved to its next occurrence) with a compare-and-set on its
+status and date, so several dispatchers can share a database and a row
+edited since it was loaded is skipped. If the sink then fails, the claims
+are reverted and the batch is retried after REMINDER_RETRY_DELAY; a crash
+between claim and send loses that batch rather than repeating it.
+
+Sinks, chosen with REMINDER_SINK:
+
+* ``file`` (default): JSON lines appended to REMINDER_OUTBOX, the local
+  stand-in for email
+* ``smtp``: one email per reminder through SMTP_HOST:SMTP_PORT, one
+  connection per batch
+
+Recurrence patterns: hourly, daily, weekly, monthly, yearly, or
+"every N minutes|hours|days|weeks|months|years". Occurrences missed while
+the dispatcher was down are skipped, not sent one after another.
+
+Usage: python reminder_dispatcher.py [--once] [--sink file|smtp]
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import smtplib
+import threading
+import time
+from calendar import monthrange
+from collections import namedtuple
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from db_connection import get_connection, get_read_connection, retry_on_busy
+
+logger = logging.getLogger(__name__)
+
+HORIZON = float(os.environ.get('REMINDER_HORIZON', 3600))
+POLL_INTERVAL = float(os.environ.get('REMINDER_POLL_INTERVAL', 5))
+BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+RETRY_DELAY = float(os.environ.get('REMINDER_RETRY_DELAY', 60))
+MAX_LATENESS = float(os.environ.get('REMINDER_MAX_LATENESS', 24 * 60 * 60))
+# Rows read per query while catching up, so a backlog is loaded in slices
+FETCH_SIZE = 5000
+DEFAULT_REMINDER_TIME = '09:00'
+
+Reminder = namedtuple('Reminder', [
+    'source', 'id', 'user_id', 'email', 'reminder_type', 'message',
+    'due', 'stored_date', 'recurrence'
+])
+
+
+_EVERY = re.compile(r'^every\s+(\d+)\s+(minute|hour|day|week|month|year)s?$')
+_NAMED = {'hourly': (1, 'hour'), 'daily': (1, 'day'), 'weekly': (1, 'week'),
+          'monthly': (1, 'month'), 'yearly': (1, 'year'), 'annually': (1, 'year')}
+_FIXED_UNITS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1),
+                'day': timedelta(days=1), 'week': timedelta(weeks=1)}
+
+def parse_recurrence(pattern):
+    """'weekly' or 'every 2 weeks' -> (2, 'week'); None if not a pattern we know"""
+    text = ' '.join(str(pattern or '').lower().split())
+    if text in _NAMED:
+        return _NAMED[text]
+    match = _EVERY.match(text) or _EVERY.match(f"every 1 {text}")
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1)), match.group(2)
+    return None
+
+def _add_months(moment, months):
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, monthrange(year, month)[1]))
+
+def next_occurrence(due, recurrence, after):
+    """First occurrence of ``recurrence`` (from parse_recurrence) after ``after``, counted from ``due``"""
+    count, unit = recurrence
+    if unit in _FIXED_UNITS:
+        step = _FIXED_UNITS[unit] * count
+        return due + step * ((after - due) // step + 1)
+    months = count * (12 if unit == 'year' else 1)
+    # Count from the original date each time, so the 31st stays the 31st where it can
+    n = 1
+    while _add_months(due, n * months) <= after:
+        n += 1
+    return _add_months(due, n * months)
+
+
+class ReminderTable:
+    """How one reminder table is read, claimed and rescheduled"""
+
+    def __init__(self, name, table, pending_status, message_sql, time_sql, date_format):
+        self.name = name
+        self.table = table
+        self.pending_status = pending_status
+        self.date_format = date_format
+        self.select = f"""
+            SELECT t.id, t.user_id, u.email, t.reminder_type, {message_sql} AS message,
+                   t.reminder_date, {time_sql} AS reminder_time, t.is_recurring, t.recurrence_pattern,
+                   t.status
+            FROM {table} t
+            LEFT JOIN users u ON u.id = t.user_id
+        """
+
+    def bound(self, moment):
+        """Value of reminder_date that a window ending at ``moment`` runs up to"""
+        return moment.strftime(self.date_format)
+
+    def bound_before(self, moment):
+        """Exclusive lower bound on reminder_date that still reads every row due at or after ``moment``"""
+        if '%H' not in self.date_format:
+            # A date's reminders are due during that day, so start from the day before
+            moment -= timedelta(days=1)
+        return moment.strftime(self.date_format)
+
+    def new_rows(self, conn, after_id, limit):
+        return conn.execute(f"{self.select} WHERE t.id > ? ORDER BY t.id LIMIT ?", (after_id, limit)).fetchall()
+
+    def window_rows(self, conn, start, end, after_id, limit):
+        """Pending rows with start < reminder_date <= end, in (reminder_date, id) order from ``after_id``"""
+        return conn.execute(f"""
+            {self.select}
+            WHERE t.status = ? AND t.reminder_date > ? AND t.reminder_date <= ?
+            AND (t.reminder_date, t.id) > (?, ?)
+            ORDER BY t.reminder_date, t.id
+            LIMIT ?
+        """, (self.pending_status, start, end, after_id[0], after_id[1], limit)).fetchall()
+
+    def max_id(self, conn):
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) AS id FROM {self.table}").fetchone()['id']
+
+    def reminder(self, row):
+        """Reminder for a row, or None if it is not pending or its date does not parse"""
+        if row['status'] != self.pending_status:
+            return None
+        try:
+            due = datetime.fromisoformat(str(row['reminder_date']).strip())
+            if row['reminder_time'] and len(str(row['reminder_date']).strip()) == 10:
+                hours, minutes = str(row['reminder_time']).split(':')[:2]
+                due = due.replace(hour=int(hours), minute=int(minutes))
+        except ValueError:
+            logger.warning("Skipping %s %s: unreadable date %r", self.table, row['id'], row['reminder_date'])
+            return None
+        recurrence = None
+        if row['is_recurring']:
+            recurrence = parse_recurrence(row['recurrence_pattern'])
+            if recurrence is None:
+                logger.warning("%s %s: unknown recurrence %r, sending once",
+                               self.table, row['id'], row['recurrence_pattern'])
+        return Reminder(self.name, row['id'], row['user_id'], row['email'], row['reminder_type'],
+                        row['message'], due, row['reminder_date'], recurrence)
+
+    def claim(self, cursor, reminder, next_due, now):
+        """Mark sent, or move to ``next_due``; False if the row changed since it was loaded"""
+        if next_due is None:
+            cursor.execute(f"""
+                UPDATE {self.table} SET status = 'sent', sent_at = ?
+                WHERE id = ? AND status = ? AND reminder_date = ?
+            """, (now, reminder.id, self.pending_status, reminder.stored_date))
+        else:
+            cursor.execute(f"""
+                UPDATE {self.table} SET reminder_date = ?, sent_at = ?
+                WHERE id = ? AND status = ? AND reminder_date = ?
+            """, (next_due.strftime(self.date_format), now, reminder.id, self.pending_status, reminder.stored_date))
+        return cursor.rowcount == 1
+
+    def release(self, cursor, reminder, next_due):
+        """Undo a claim after the sink failed"""
+        if next_due is None:
+            cursor.execute(f"""
+                UPDATE {self.table} SET status = ?, sent_at = NULL
+                WHERE id = ? AND status = 'sent' AND reminder_date = ?
+            """, (self.pending_status, reminder.id, reminder.stored_date))
+        else:
+            cursor.execute(f"""
+                UPDATE {self.table} SET reminder_date = ?
+                WHERE id = ? AND status = ? AND reminder_date = ?
+            """, (reminder.stored_date, reminder.id, self.pending_status, next_due.strftime(self.date_format)))
+
+
+REMINDERS = ReminderTable('reminders', 'reminders', 'pending', 't.reminder_message', 'NULL',
+                          '%Y-%m-%d %H:%M:%S')
+# Dates only, with an optional reminder_time; a day enters the window whole
+HEALTH_REMINDERS = ReminderTable('health_reminders', 'health_reminders', 'active',
+                                 'COALESCE(t.reminder_message, t.description, t.reminder_type)',
+                                 f"COALESCE(t.reminder_time, '{DEFAULT_REMINDER_TIME}')", '%Y-%m-%d')
+TABLES = (REMINDERS, HEALTH_REMINDERS)
+
+
+class FileSink:
+    """Appends each reminder as a JSON line to ``path``"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, reminders):
+        lines = [json.dumps({
+            'source': r.source, 'id': r.id, 'user_id': r.user_id, 'email': r.email,
+            'type': r.reminder_type, 'message': r.message, 'due': r.due.isoformat(sep=' '),
+            'sent_at': datetime.now().isoformat(sep=' ', timespec='seconds')
+        }) + '\n' for r in reminders]
+        with open(self.path, 'a', encoding='utf-8') as handle:
+            handle.writelines(lines)
+
+
+class SmtpSink:
+    """One email per reminder, over one SMTP connection per batch"""
+
+    def __init__(self, host, port=25, sender='reminders@localhost', username=None, password=None):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+
+    def send(self, reminders):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.username:
+                smtp.starttls()
+                smtp.login(self.username, self.password)
+            for r in reminders:
+                if not r.email:
+                    logger.warning("No email address for user %s, %s %s not sent", r.user_id, r.source, r.id)
+                    continue
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = r.email
+                message['Subject'] = f"Reminder: {r.reminder_type.replace('_', ' ')}"
+                message.set_content(r.message)
+                smtp.send_message(message)
+
+
+def create_sink(name=None):
+    """Sink named by ``name`` or REMINDER_SINK"""
+    name = name or os.environ.get('REMINDER_SINK', 'file')
+    if name == 'file':
+        return FileSink(os.environ.get('REMINDER_OUTBOX',
+                                       os.path.join(os.path.dirname(__file__), 'reminder_outbox.jsonl')))
+    if name == 'smtp':
+        return SmtpSink(os.environ.get('SMTP_HOST', 'localhost'), int(os.environ.get('SMTP_PORT', 25)),
+                        os.environ.get('SMTP_SENDER', 'reminders@localhost'),
+                        os.environ.get('SMTP_USERNAME'), os.environ.get('SMTP_PASSWORD'))
+    raise ValueError(f"Unknown reminder sink '{name}', expected file or smtp")
+
+
+class ReminderDispatcher:
+    """Heap of reminders due within the horizon, fed by high-water-mark polls"""
+
+    def __init__(self, sink, tables=TABLES, horizon=HORIZON, poll_interval=POLL_INTERVAL,
+                 batch_size=BATCH_SIZE, retry_delay=RETRY_DELAY, max_lateness=MAX_LATENESS):
+        self.sink = sink
+        self.tables = {table.name: table for table in tables}
+        self.horizon = timedelta(seconds=horizon)
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.retry_delay = timedelta(seconds=retry_delay)
+        self.max_lateness = timedelta(seconds=max_lateness)
+        self.sent = 0
+        self._heap = []
+        self._queued = set()
+        self._seq = itertools.count()
+        self._last_ids = {}
+        self._loaded_until = {}
+        self._next_poll = 0.0
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, reminder, due=None):
+        key = (reminder.source, reminder.id)
+        if key not in self._queued:
+            self._queued.add(key)
+            heapq.heappush(self._heap, (due or reminder.due, next(self._seq), reminder))
+
+    def start(self, now=None):
+        """Load everything due from MAX_LATENESS ago up to the horizon"""
+        now = now or datetime.now()
+        with get_read_connection() as conn:
+            for table in self.tables.values():
+                # Read the id mark first: rows inserted during the scan are
+                # then seen by both reads, and _push drops the second copy
+                self._last_ids[table.name] = table.max_id(conn)
+                self._loaded_until[table.name] = table.bound_before(now - self.max_lateness)
+        self.poll(now)
+
+    def poll(self, now=None):
+        """Pick up new rows by id, then move each window up to now + horizon; returns rows queued"""
+        now = now or datetime.now()
+        before = len(self._heap)
+        not_before = now - self.max_lateness
+        with get_read_connection() as conn:
+            for table in self.tables.values():
+                self._poll_new(conn, table, not_before)
+                self._advance_window(conn, table, table.bound(now + self.horizon), not_before)
+        self._next_poll = time.monotonic() + self.poll_interval
+        return len(self._heap) - before
+
+    def _queue(self, reminder, not_before):
+        """Push a reminder unless it is more than max_lateness late"""
+        if reminder is None:
+            return
+        if reminder.due < not_before:
+            logger.debug("Skipping %s %s: due %s, too late to send", reminder.source, reminder.id, reminder.due)
+            return
+        self._push(reminder)
+
+    def _poll_new(self, conn, table, not_before):
+        loaded_until = self._loaded_until[table.name]
+        while True:
+            rows = table.new_rows(conn, self._last_ids[table.name], FETCH_SIZE)
+            for row in rows:
+                # Rows due beyond the window are read again when it gets there
+                if str(row['reminder_date']) <= loaded_until:
+                    self._queue(table.reminder(row), not_before)
+            if rows:
+                self._last_ids[table.name] = rows[-1]['id']
+            if len(rows) < FETCH_SIZE:
+                return
+
+    def _advance_window(self, conn, table, end, not_before):
+        start = self._loaded_until[table.name]
+        if end <= start:
+            return
+        position = ('', 0)
+        while True:
+            rows = table.window_rows(conn, start, end, position, FETCH_SIZE)
+            for row in rows:
+                self._queue(table.reminder(row), not_before)
+            if len(rows) < FETCH_SIZE:
+                break
+            position = (rows[-1]['reminder_date'], rows[-1]['id'])
+        self._loaded_until[table.name] = end
+
+    def dispatch_due(self, now=None):
+        """Send one batch of due reminders; returns how many were sent"""
+        now = now or datetime.now()
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            _, _, reminder = heapq.heappop(self._heap)
+            self._queued.discard((reminder.source, reminder.id))
+            batch.append(reminder)
+        if not batch:
+            return 0
+
+        claimed = self._claim(batch, now)
+        if not claimed:
+            return 0
+        try:
+            self.sink.send([reminder for reminder, _ in claimed])
+        except Exception as e:
+            logger.error("Reminder sink failed for %s reminders, retrying in %ss: %s",
+                         len(claimed), self.retry_delay.total_seconds(), e)
+            self._release(claimed)
+            for reminder, _ in claimed:
+                self._push(reminder, now + self.retry_delay)
+            return 0
+
+        for reminder, next_due in claimed:
+            if next_due is not None:
+                # Already past the window means no poll will read it again
+                if next_due.strftime(self.tables[reminder.source].date_format) <= self._loaded_until[reminder.source]:
+                    self._push(reminder._replace(
+                        due=next_due, stored_date=next_due.strftime(self.tables[reminder.source].date_format)
+                    ))
+        self.sent += len(claimed)
+        logger.info("Sent %s reminders", len(claimed))
+        return len(claimed)
+
+    @retry_on_busy
+    def _claim(self, batch, now):
+        """[(reminder, next occurrence or None)] for the rows this dispatcher now owns"""
+        stamp = now.strftime('%Y-%m-%d %H:%M:%S')
+        claimed = []
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for reminder in batch:
+                    next_due = next_occurrence(reminder.due, reminder.recurrence, now) if reminder.recurrence else None
+                    if self.tables[reminder.source].claim(cursor, reminder, next_due, stamp):
+                        claimed.append((reminder, next_due))
+                conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+        if len(claimed) < len(batch):
+            logger.debug("%s reminders were changed or sent elsewhere", len(batch) - len(claimed))
+        return claimed
+
+    @retry_on_busy
+    def _release(self, claimed):
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for reminder, next_due in claimed:
+                    self.tables[reminder.source].release(cursor, reminder, next_due)
+                conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+
+    def run_once(self, now=None):
+        """Poll if due, then send every batch that is due; returns how many were sent"""
+        if time.monotonic() >= self._next_poll:
+            self.poll(now)
+        sent = 0
+        while True:
+            count = self.dispatch_due(now)
+            if not count and not (self._heap and self._heap[0][0] <= (now or datetime.now())):
+                return sent
+            sent += count
+
+    def run_forever(self):
+        """Dispatch until stop(), sleeping until the next due reminder or poll"""
+        self.start()
+        logger.info("Reminder dispatcher started with %s reminders queued", len(self._heap))
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error dispatching reminders: %s", e)
+                self._stop.wait(self.poll_interval)
+                continue
+            wait = self._next_poll - time.monotonic()
+            if self._heap:
+                wait = min(wait, (self._heap[0][0] - datetime.now()).total_seconds())
+            self._stop.wait(max(0.0, wait))
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Deliver due reminders")
+    parser.add_argument('--once', action='store_true', help="send what is due now and exit")
+    parser.add_argument('--sink', choices=['file', 'smtp'])
+    args = parser.parse_args()
+
+    from db_connection import initialize_database
+    initialize_database()
+    dispatcher = ReminderDispatcher(create_sink(args.sink))
+    if args.once:
+        dispatcher.start()
+        print(f"Sent {dispatcher.run_once()} reminders")
+    else:
+        try:
+            dispatcher.run_forever()
+        except KeyboardInterrupt:
+            dispatcher.stop()
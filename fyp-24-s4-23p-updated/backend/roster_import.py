@@ -0,0 +1,144 @@
+"""Bulk patient registration from a clinic roster (CSV or JSONL).
+
+Each row needs username, password and email; phone, address,
+emergency_contact, first_name and last_name are optional. Rows are read
+and registered ``--chunk-size`` at a time. A chunk's passwords are hashed
+on the password pool first, then its users and profiles are written in
+one BEGIN IMMEDIATE transaction through ``auth.insert_patient``. Duplicate
+usernames or emails, against the database or earlier rows, are caught by
+the UNIQUE constraints and rejected row by row without aborting the chunk,
+so there are no lookups before inserting.
+
+Usage: python roster_import.py roster.csv [--format jsonl] [--chunk-size N]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+from itertools import islice
+from appointment_import import ImportReport, read_csv, read_jsonl
+from auth import duplicate_reason, insert_patient
+from db_connection import get_connection, retry_on_busy
+from passwords import PasswordBusyError, hash_passwords
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get('ROSTER_CHUNK_SIZE', 500))
+OPTIONAL_FIELDS = ('phone', 'address', 'emergency_contact', 'first_name', 'last_name')
+
+
+def _normalize(row):
+    """Row dict -> (username, password, email, phone, address, emergency_contact, first_name, last_name)"""
+    username = str(row.get('username') or '').strip()
+    password = str(row.get('password') or '')
+    email = str(row.get('email') or '').strip()
+    if not username:
+        raise ValueError("username is required")
+    if not password:
+        raise ValueError("password is required")
+    if '@' not in email:
+        raise ValueError("email is missing or invalid")
+    optional = tuple(str(row.get(field) or '').strip() or None for field in OPTIONAL_FIELDS)
+    return (username, password, email) + optional
+
+
+@retry_on_busy
+def _insert_chunk(chunk):
+    """Write one chunk in one transaction; returns ([usernames], [(row number, reason)])"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            registered = []
+            rejected = []
+            for row_number, values in chunk:
+                try:
+                    insert_patient(cursor, *values)
+                except sqlite3.IntegrityError as e:
+                    rejected.append((row_number, duplicate_reason(e)))
+                else:
+                    registered.append(values[0])
+            conn.commit()
+            return registered, rejected
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+
+def register_users(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Register many patients; returns an ImportReport.
+
+    ``rows`` is an iterable of dicts or of (row number, dict) pairs, like
+    ``appointment_import.schedule_batch`` takes, and is consumed a chunk at
+    a time, so a roster of any size is never held in memory.
+    """
+    start = time.perf_counter()
+    report = ImportReport()
+    items = iter(rows)
+    index = 0
+    while True:
+        batch = list(islice(items, chunk_size))
+        if not batch:
+            break
+        valid = []
+        for item in batch:
+            index += 1
+            row_number, row = item if isinstance(item, tuple) else (index, item)
+            report.total += 1
+            if row.get('_error'):
+                report.reject(row_number, row['_error'])
+                continue
+            try:
+                valid.append((row_number, _normalize(row)))
+            except ValueError as e:
+                report.reject(row_number, str(e))
+        if not valid:
+            continue
+
+        try:
+            hashes = hash_passwords([values[1] for _, values in valid])
+            chunk = [(row_number, (values[0], password_hash) + values[2:])
+                     for (row_number, values), password_hash in zip(valid, hashes)]
+            registered, rejected = _insert_chunk(chunk)
+        except (PasswordBusyError, sqlite3.Error) as e:
+            logger.error("Error registering rows %s-%s: %s", valid[0][0], valid[-1][0], e)
+            for row_number, _ in valid:
+                report.reject(row_number, f"chunk failed: {e}")
+            continue
+        report.imported += len(registered)
+        for row_number, reason in rejected:
+            report.reject(row_number, reason)
+
+    report.rejected.sort()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def import_roster(path, file_format=None, **options):
+    """Register the patients in a .csv or .jsonl roster with register_users"""
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    reader = read_jsonl if file_format == 'jsonl' else read_csv
+    return register_users(reader(path), **options)
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Register patients from a CSV or JSONL roster")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--show', type=int, default=20, help="rejected rows to list")
+    args = parser.parse_args()
+
+    from db_connection import initialize_database
+    initialize_database()
+    report = import_roster(args.path, args.format, chunk_size=args.chunk_size)
+    print(report.summary())
+    for row_number, reason in report.rejected[:args.show]:
+        print(f"  row {row_number}: {reason}")
+    if len(report.rejected) > args.show:
+        print(f"  ... and {len(report.rejected) - args.show} more")
+    sys.exit(1 if report.rejected else 0)
@@ -0,0 +1,198 @@
+"""Server-side sessions in SQLite, shared by every worker using the database.
+
+The cookie carries only a signed session id; the session dict lives in the
+``sessions`` table as compact tagged JSON (Flask's own session format)
+with an ``expires_at`` timestamp. Loading a session is one primary-key
+lookup on a read connection. Saving writes only when the session changed,
+or when its sliding expiry has used up more than SESSION_REFRESH_FRACTION
+of SESSION_TTL, so ordinary requests cost no write at all. Expired rows
+are never returned and are deleted in bulk, one indexed range delete at
+most every SESSION_CLEANUP_INTERVAL seconds per process.
+
+The signing key must be the same in every worker and across restarts:
+``load_secret_key`` uses SECRET_KEY from the environment, or else a random
+key generated once and kept in the ``app_settings`` table.
+
+Logging in calls ``regenerate_session``, which gives the session a fresh
+id and deletes the old row, so an id known before login (planted by an
+attacker, say) never becomes an authenticated session.
+
+SESSION_BACKEND=cookie keeps Flask's signed-cookie sessions instead.
+"""
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+from db_connection import get_connection, get_read_connection
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 24 * 60 * 60))
+SESSION_REFRESH_FRACTION = float(os.environ.get('SESSION_REFRESH_FRACTION', 0.1))
+SESSION_CLEANUP_INTERVAL = int(os.environ.get('SESSION_CLEANUP_INTERVAL', 300))
+
+
+class ServerSession(SecureCookieSession):
+    """Session dict plus its id and stored expiry; ``sid`` is None until first saved"""
+
+    def __init__(self, initial=None, sid=None, expires_at=0):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        # Id given up by regenerate(); its row is deleted on save
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Empty the session and have it saved under a new id"""
+        self.clear()
+        if self.sid:
+            self.replaced_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSession
+    salt = 'server-session'
+
+    def __init__(self, ttl=SESSION_TTL, refresh_fraction=SESSION_REFRESH_FRACTION,
+                 cleanup_interval=SESSION_CLEANUP_INTERVAL):
+        self.ttl = ttl
+        self.refresh_fraction = refresh_fraction
+        self.cleanup_interval = cleanup_interval
+        self._cleaned_at = 0.0
+        self._cleanup_lock = threading.Lock()
+        self._signers = {}
+
+    def _signer(self, app):
+        signer = self._signers.get(app.secret_key)
+        if signer is None:
+            signer = self._signers[app.secret_key] = Signer(app.secret_key, salt=self.salt)
+        return signer
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self.session_class()
+        try:
+            sid = self._signer(app).unsign(cookie).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            # Forged or from an old key: start over without touching the database
+            return self.session_class()
+        with get_read_connection() as conn:
+            row = conn.execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+                               (sid, int(time.time()))).fetchone()
+        if row is None:
+            return self.session_class()
+        return self.session_class(self.serializer.loads(row['data']), sid, row['expires_at'])
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            stale = session.sid or session.replaced_sid
+            if session.modified and stale:
+                with get_connection() as conn:
+                    conn.execute("DELETE FROM sessions WHERE id = ?", (stale,))
+                    conn.commit()
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+            return
+
+        now = int(time.time())
+        new = session.sid is None
+        refresh = session.expires_at - now < self.ttl * (1 - self.refresh_fraction)
+        if not (new or session.modified or refresh):
+            return
+
+        if new:
+            session.sid = secrets.token_urlsafe(24)
+        session.expires_at = now + self.ttl
+        with get_connection() as conn:
+            if session.replaced_sid:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session.replaced_sid,))
+                session.replaced_sid = None
+            if new or session.modified:
+                conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                             (session.sid, self.serializer.dumps(dict(session)), session.expires_at))
+            else:
+                conn.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (session.expires_at, session.sid))
+            self._expire_due(conn, now)
+            conn.commit()
+
+        if new or session.permanent:
+            response.set_cookie(
+                name, self._signer(app).sign(session.sid).decode('ascii'),
+                expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app)
+            )
+
+    def _expire_due(self, conn, now):
+        """Bulk-delete expired sessions if this process has not done so lately"""
+        if now - self._cleaned_at < self.cleanup_interval or not self._cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            self._cleaned_at = now
+            deleted = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+            if deleted:
+                logger.debug("Expired %s sessions", deleted)
+        finally:
+            self._cleanup_lock.release()
+
+
+def regenerate_session(session):
+    """Clear ``session`` and move it to a new id; call before storing who logged in"""
+    if isinstance(session, ServerSession):
+        session.regenerate()
+    else:
+        # Signed-cookie sessions have no id to fix; a cleared dict is re-signed
+        session.clear()
+
+
+def expire_sessions(now=None):
+    """Delete every expired session now; returns how many were deleted"""
+    with get_connection() as conn:
+        deleted = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (int(now or time.time()),)).rowcount
+        conn.commit()
+    return deleted
+
+
+def load_secret_key():
+    """SECRET_KEY from the environment, else the key stored in app_settings (created on first use)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    with get_connection() as conn:
+        # Concurrent first starts race on the insert; all of them read the winner
+        conn.execute("INSERT OR IGNORE INTO app_settings (name, value) VALUES ('secret_key', ?)",
+                     (secrets.token_hex(32),))
+        conn.commit()
+        return conn.execute("SELECT value FROM app_settings WHERE name = 'secret_key'").fetchone()['value']
+
+
+def configure_sessions(app):
+    """Give ``app`` a stable secret key and the session backend named by SESSION_BACKEND"""
+    backend = os.environ.get('SESSION_BACKEND', 'sqlite')
+    if backend not in ('sqlite', 'cookie'):
+        raise ValueError(f"Unknown session backend '{backend}', expected sqlite or cookie")
+    try:
+        app.secret_key = load_secret_key()
+    except sqlite3.Error as e:
+        # The database is not usable yet; sessions will not survive a restart
+        logger.error("Could not load the secret key, using a temporary one: %s", e)
+        app.secret_key = os.urandom(24)
+        return
+    if backend == 'sqlite':
+        app.session_interface = SqliteSessionInterface()
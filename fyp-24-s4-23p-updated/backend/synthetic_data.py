@@ -0,0 +1,313 @@
+"""Synthetic clinic data at production sizes, for profiling the query paths.
+
+At scale 1.0 this creates 10,000 patients (profiles included), one doctor
+per 500 patients, about six appointments per patient over the last year
+and the next quarter, a bill for each appointment that took place or is
+coming up, prescriptions and health records. Everything grows linearly
+with ``--scale``, so scale 100 is a million patients.
+
+Appointments are generated slot first: for every doctor and day, a share
+of the slots inside the doctor's working hours is drawn without
+replacement and only then given to patients (weighted, so a few patients
+are frequent visitors). No booking falls outside a schedule and no slot is
+booked twice; the unique slot index would reject the chunk if one were.
+
+Rows are written with ``executemany`` in one transaction per
+``--chunk-size`` rows, with explicit ids so related rows need no lookups.
+Output is deterministic for a given seed, scale and ``--today``, except
+the password hash: ``--password`` is hashed once with the configured KDF
+and that hash is shared by every patient, so logins take the normal
+verify path and no plaintext is stored.
+
+Usage: python synthetic_data.py [--scale F] [--seed N] [--chunk-size N] [--days-back N] [--days-ahead N]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from datetime import date, timedelta
+from availability import WEEKDAYS, iter_slots, slot_time
+from db_connection import get_connection
+from doctor_schedules import compile_schedule
+from passwords import hash_password
+
+DEFAULT_CHUNK_SIZE = int(os.environ.get('SYNTHETIC_CHUNK_SIZE', 50000))
+
+USERS_PER_SCALE = 10000
+PATIENTS_PER_DOCTOR = 500
+APPOINTMENTS_PER_PATIENT = 6.0
+PRESCRIPTIONS_PER_PATIENT = 1.5
+RECORDS_PER_PATIENT = 3.0
+
+# (value, weight) pairs
+BLOOD_TYPES = [('O+', 38), ('A+', 34), ('B+', 9), ('O-', 7), ('A-', 6), ('AB+', 3), ('B-', 2), ('AB-', 1)]
+ALLERGIES = [(None, 80), ('penicillin', 8), ('peanuts', 4), ('latex', 3), ('shellfish', 3), ('sulfa drugs', 2)]
+SPECIALITIES = [('General Practice', 50), ('Pediatrics', 15), ('Cardiology', 10), ('Dermatology', 10),
+                ('Orthopedics', 8), ('Neurology', 7)]
+APPOINTMENT_TYPES = [('General Checkup', 50, 80), ('Follow-up', 25, 60), ('Specialist Consultation', 20, 150),
+                     ('Vaccination', 5, 40)]
+MEDICATIONS = [('Amoxicillin', '500mg', 'three times daily'), ('Metformin', '850mg', 'twice daily'),
+               ('Lisinopril', '10mg', 'once daily'), ('Atorvastatin', '20mg', 'once daily at night'),
+               ('Omeprazole', '20mg', 'once daily before breakfast'), ('Salbutamol', '100mcg', 'as needed'),
+               ('Levothyroxine', '50mcg', 'once daily'), ('Amlodipine', '5mg', 'once daily')]
+RECORD_TYPES = [('Checkup', 45), ('Lab Result', 30), ('Vaccination', 15), ('Diagnosis', 10)]
+
+# Working-hour templates: weekday -> range; days not listed are off
+SCHEDULE_TEMPLATES = [
+    {day: "09:00-17:00" for day in WEEKDAYS[:5]},
+    {**{day: "08:00-16:00" for day in WEEKDAYS[:5]}, 'saturday': "09:00-13:00"},
+    {day: ["09:00-12:00", "13:00-18:00"] for day in WEEKDAYS[:5]},
+    {day: "10:00-18:00" for day in ('monday', 'wednesday', 'friday', 'saturday')},
+]
+
+
+class GenerationReport:
+    """Rows written per table and throughput"""
+
+    def __init__(self):
+        self.counts = {}
+        self.seconds = 0.0
+
+    def add(self, table, rows):
+        self.counts[table] = self.counts.get(table, 0) + rows
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def summary(self):
+        tables = ', '.join(f"{table} {count}" for table, count in self.counts.items())
+        rate = self.total / self.seconds if self.seconds else 0.0
+        return f"{self.total} rows in {self.seconds:.2f}s ({rate:.0f} rows/s): {tables}"
+
+
+def _weighted(pairs):
+    values = [pair[0] for pair in pairs]
+    cumulative = []
+    total = 0
+    for pair in pairs:
+        total += pair[1]
+        cumulative.append(total)
+    return values, cumulative
+
+def _poisson(rng, mean):
+    # Knuth's method; the means used here are small
+    limit = math.exp(-mean)
+    count, product = 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def _write(conn, tables, rows, chunk_size, report):
+    """executemany ``rows`` in one transaction per chunk.
+
+    ``tables`` is [(table, INSERT statement)]; each row is a tuple with one
+    parameter tuple (or None) per table, so related rows commit together.
+    """
+    chunks = [[] for _ in tables]
+    pending = 0
+    for row in rows:
+        for chunk, values in zip(chunks, row):
+            if values is not None:
+                chunk.append(values)
+        pending += 1
+        if pending >= chunk_size:
+            _flush(conn, tables, chunks, report)
+            pending = 0
+    _flush(conn, tables, chunks, report)
+
+def _flush(conn, tables, chunks, report):
+    for (table, sql), chunk in zip(tables, chunks):
+        if chunk:
+            conn.executemany(sql, chunk)
+            report.add(table, len(chunk))
+            chunk.clear()
+    conn.commit()
+
+
+def _next_id(conn, table):
+    return conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+class SyntheticClinic:
+    """Generates the rows for one run; every table draws from its own seeded stream"""
+
+    def __init__(self, scale=1.0, seed=0, days_back=365, days_ahead=90, password_hash='', today=None):
+        self.users = max(1, int(USERS_PER_SCALE * scale))
+        self.doctors = max(1, math.ceil(self.users / PATIENTS_PER_DOCTOR))
+        self.seed = seed
+        self.days_back = days_back
+        self.days_ahead = days_ahead
+        self.password_hash = password_hash
+        self.today = today or date.today()
+
+    def _rng(self, table):
+        return random.Random(f"{self.seed}:{table}")
+
+    def user_rows(self, first_id):
+        rng = self._rng('users')
+        for n in range(self.users):
+            user_id = first_id + n
+            yield (user_id, f"patient{user_id:08d}", self.password_hash, f"patient{user_id:08d}@example.com",
+                   f"+65 {rng.randrange(80000000, 99999999)}", f"{rng.randint(1, 999)} Clinic Road #{rng.randint(1, 30):02d}",
+                   None if rng.random() < 0.3 else f"Contact {rng.randrange(80000000, 99999999)}")
+
+    def profile_rows(self, first_user_id):
+        rng = self._rng('profiles')
+        blood, blood_weights = _weighted(BLOOD_TYPES)
+        allergies, allergy_weights = _weighted(ALLERGIES)
+        for n in range(self.users):
+            age = int(rng.triangular(18, 90, 45))
+            born = self.today - timedelta(days=age * 365 + rng.randrange(365))
+            yield (first_user_id + n, 'Patient', str(first_user_id + n), born.isoformat(),
+                   'F' if rng.random() < 0.51 else 'M',
+                   rng.choices(blood, cum_weights=blood_weights)[0],
+                   rng.choices(allergies, cum_weights=allergy_weights)[0])
+
+    def doctor_rows(self, first_id):
+        rng = self._rng('doctors')
+        specialities, weights = _weighted(SPECIALITIES)
+        for n in range(self.doctors):
+            yield (first_id + n, f"Synthetic{first_id + n:05d}", rng.choices(specialities, cum_weights=weights)[0],
+                   json.dumps(rng.choice(SCHEDULE_TEMPLATES)))
+
+    def appointment_rows(self, doctors, first_id, first_user_id):
+        """(appointment row, bill row or None) pairs.
+
+        ``doctors`` is [(name, schedule JSON)]. Each doctor/day gets a share
+        of its working slots sized so that the whole run averages
+        APPOINTMENTS_PER_PATIENT per patient.
+        """
+        rng = self._rng('appointments')
+        types, type_weights = _weighted(APPOINTMENT_TYPES)
+        prices = {name: price for name, _, price in APPOINTMENT_TYPES}
+        masks = [(name, compile_schedule(schedule)[1]) for name, schedule in doctors]
+        days = [self.today + timedelta(days=offset) for offset in range(-self.days_back, self.days_ahead + 1)]
+        capacity = sum(bin(day_masks[day.weekday()]).count('1') for _, day_masks in masks for day in days)
+        utilization = min(0.9, self.users * APPOINTMENTS_PER_PATIENT / capacity) if capacity else 0.0
+
+        # A few patients book far more often than most
+        activity = [rng.lognormvariate(0, 0.75) for _ in range(self.users)]
+        cumulative = []
+        total = 0.0
+        for weight in activity:
+            total += weight
+            cumulative.append(total)
+        patients = range(first_user_id, first_user_id + self.users)
+
+        appointment_id = first_id
+        for day in days:
+            past = day < self.today
+            day_text = day.isoformat()
+            for name, day_masks in masks:
+                slots = list(iter_slots(day_masks[day.weekday()]))
+                booked = rng.sample(slots, int(len(slots) * utilization + rng.random()))
+                owners = rng.choices(patients, cum_weights=cumulative, k=len(booked))
+                for slot, user_id in zip(sorted(booked), owners):
+                    roll = rng.random()
+                    if past:
+                        status = 'completed' if roll < 0.88 else 'cancelled'
+                    else:
+                        status = 'scheduled' if roll < 0.7 else 'confirmed' if roll < 0.95 else 'cancelled'
+                    kind = rng.choices(types, cum_weights=type_weights)[0]
+                    bill = None
+                    if status != 'cancelled':
+                        due = day + timedelta(days=30)
+                        paid = past and (due < self.today or rng.random() < 0.5) and rng.random() < 0.95
+                        bill = (user_id, appointment_id, prices[kind], f"{kind} with Dr. {name}",
+                                'PAID' if paid else 'PENDING', due.isoformat())
+                    yield (appointment_id, user_id, name, day_text, slot_time(slot), kind, status), bill
+                    appointment_id += 1
+
+    def prescription_rows(self, first_user_id):
+        rng = self._rng('prescriptions')
+        for n in range(self.users):
+            for _ in range(_poisson(rng, PRESCRIPTIONS_PER_PATIENT)):
+                medication, dosage, frequency = rng.choice(MEDICATIONS)
+                start = self.today - timedelta(days=rng.randrange(self.days_back + 1))
+                end = start + timedelta(days=rng.choice((14, 30, 60, 90, 180)))
+                yield (first_user_id + n, medication, dosage, frequency, start.isoformat(), end.isoformat(),
+                       rng.choice((0, 0, 1, 2, 3)), 'active' if end >= self.today else 'completed')
+
+    def record_rows(self, first_user_id):
+        rng = self._rng('records')
+        record_types, weights = _weighted(RECORD_TYPES)
+        for n in range(self.users):
+            for _ in range(_poisson(rng, RECORDS_PER_PATIENT)):
+                record_type = rng.choices(record_types, cum_weights=weights)[0]
+                recorded = self.today - timedelta(days=rng.randrange(self.days_back * 3 + 1))
+                yield (first_user_id + n, record_type, recorded.isoformat(), f"{record_type} record",
+                       None if rng.random() < 0.6 else "No concerns noted")
+
+
+def generate(scale=1.0, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, days_back=365, days_ahead=90,
+             password='password', today=None):
+    """Add a synthetic clinic to the current database; returns a GenerationReport.
+
+    Rows are added next to whatever is already there: ids continue after the
+    current maximum and existing doctors keep their bookings.
+    """
+    clinic = SyntheticClinic(scale, seed, days_back, days_ahead, hash_password(password), today)
+    report = GenerationReport()
+    start = time.perf_counter()
+    with get_connection() as conn:
+        first_user = _next_id(conn, 'users')
+        _write(conn, [('users', """
+            INSERT INTO users (id, username, password, email, phone, address, emergency_contact)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """), ('patient_profiles', """
+            INSERT INTO patient_profiles (user_id, first_name, last_name, date_of_birth, gender, blood_type, allergies)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """)], zip(clinic.user_rows(first_user), clinic.profile_rows(first_user)), chunk_size, report)
+
+        doctors = list(clinic.doctor_rows(_next_id(conn, 'doctors')))
+        _write(conn, [('doctors', "INSERT INTO doctors (id, name, speciality, schedule) VALUES (?, ?, ?, ?)")],
+               ((doctor,) for doctor in doctors), chunk_size, report)
+
+        _write(conn, [('appointments', """
+            INSERT INTO appointments (id, user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """), ('bills', """
+            INSERT INTO bills (user_id, appointment_id, amount, description, status, due_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """)], clinic.appointment_rows([(name, schedule) for _, name, _, schedule in doctors],
+                                       _next_id(conn, 'appointments'), first_user), chunk_size, report)
+
+        _write(conn, [('prescriptions', """
+            INSERT INTO prescriptions (user_id, medication_name, dosage, frequency, start_date, end_date,
+                                       refills_remaining, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """)], ((row,) for row in clinic.prescription_rows(first_user)), chunk_size, report)
+        _write(conn, [('health_records', """
+            INSERT INTO health_records (user_id, record_type, record_date, description, doctor_notes)
+            VALUES (?, ?, ?, ?, ?)
+        """)], ((row,) for row in clinic.record_rows(first_user)), chunk_size, report)
+        conn.execute("ANALYZE")
+        conn.commit()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+if __name__ == '__main__':
+    from app_logging import configure_logging
+    from db_connection import DB_PATH, initialize_database
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Fill the database with a synthetic clinic")
+    parser.add_argument('--scale', type=float, default=1.0, help=f"{USERS_PER_SCALE} patients per 1.0")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument('--days-back', type=int, default=365, help="history of appointments, in days")
+    parser.add_argument('--days-ahead', type=int, default=90, help="future appointments, in days")
+    parser.add_argument('--password', default='password', help="password of every synthetic patient")
+    parser.add_argument('--today', type=date.fromisoformat, help="reference date, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    initialize_database()
+    print(f"Generating scale {args.scale} into {DB_PATH}")
+    report = generate(args.scale, args.seed, args.chunk_size, args.days_back, args.days_ahead,
+                      args.password, args.today)
+    print(report.summary())
@@ -0,0 +1,327 @@
+"""Spans and latency histograms for the chat path, kept in process.
+
+Durations go into HDR-style histograms: log-linear buckets, SUB_BUCKETS
+per power of two from 1µs to about a minute, so any quantile is within
+1/SUB_BUCKETS of the true value and recording is an index computation
+and an increment. Two families are kept:
+
+    chat_request_seconds{intent}      whole handle_intent calls
+    chat_span_seconds{span, intent}   route, handler, dialogflow, db
+
+``intent`` is the local intent that answered, "dialogflow" when Dialogflow
+did, and "other" outside a chat request (login, registration, ...). Every
+query through a pooled connection is a "db" span via TracingCursor.
+
+``render_prometheus()`` is what ``/metrics`` serves; ``summary()`` and
+``format_summary()`` read the same data offline with no collector. With
+the ``tracing`` logger at DEBUG each chat request also logs its own span
+totals, tagged with the request id.
+
+Set METRICS_ENABLED=0 to turn recording off.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+SUB_BUCKETS = 8
+OCTAVES = 26          # 2**26 µs is about 67s; slower values land in the last bucket
+_BUCKETS = 1 + OCTAVES * SUB_BUCKETS + 1
+
+OTHER = 'other'
+DIALOGFLOW = 'dialogflow'
+
+_DONE = object()
+
+_intent = ContextVar('trace_intent', default=OTHER)
+_trace = ContextVar('trace_spans', default=None)
+
+
+def _bucket(seconds):
+    micros = seconds * 1e6
+    if micros < 1:
+        return 0
+    mantissa, exponent = math.frexp(micros)
+    octave = exponent - 1
+    if octave >= OCTAVES:
+        return _BUCKETS - 1
+    return 1 + octave * SUB_BUCKETS + int((mantissa * 2 - 1) * SUB_BUCKETS)
+
+def _upper_bound(index):
+    """Largest value (seconds) that lands in bucket ``index``"""
+    if index == 0:
+        return 1e-6
+    if index == _BUCKETS - 1:
+        return math.inf
+    octave, sub = divmod(index - 1, SUB_BUCKETS)
+    return 2 ** octave * (1 + (sub + 1) / SUB_BUCKETS) / 1e6
+
+
+class _Series:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram:
+    """Latency histogram with one series per label-value tuple"""
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        index = _bucket(seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = _Series()
+            series.counts[index] += 1
+            series.count += 1
+            series.sum += seconds
+            if seconds > series.max:
+                series.max = seconds
+
+    def series(self):
+        """[(labels, copy of the series)], sorted by labels"""
+        with self._lock:
+            items = []
+            for labels, series in self._series.items():
+                copy = _Series()
+                copy.counts = list(series.counts)
+                copy.count, copy.sum, copy.max = series.count, series.sum, series.max
+                items.append((labels, copy))
+        return sorted(items)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def quantile(series, q):
+        """Value at quantile ``q`` of a series, to within its bucket"""
+        if not series.count:
+            return 0.0
+        rank = max(1, math.ceil(q * series.count))
+        seen = 0
+        for index, count in enumerate(series.counts):
+            seen += count
+            if seen >= rank:
+                return min(_upper_bound(index), series.max)
+        return series.max
+
+
+REQUESTS = Histogram('chat_request_seconds', "Time to answer a chat message, by intent", ('intent',))
+SPANS = Histogram('chat_span_seconds', "Time spent in one step of a chat reply", ('span', 'intent'))
+HISTOGRAMS = (REQUESTS, SPANS)
+
+
+def set_intent(intent):
+    """Attribute the rest of this request's spans to ``intent``"""
+    _intent.set(intent or OTHER)
+
+def current_intent():
+    return _intent.get()
+
+def record_span(name, seconds, intent=None):
+    """Record a finished span, for ``intent`` or else the current request's"""
+    if not ENABLED:
+        return
+    SPANS.observe(seconds, name, intent or _intent.get())
+    trace = _trace.get()
+    if trace is not None:
+        total, count = trace.get(name, (0.0, 0))
+        trace[name] = (total + seconds, count + 1)
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+@contextmanager
+def chat_request():
+    """Time one chat message; spans inside it are attributed to its intent.
+
+    The intent and the trace are contextvars, so they follow the request
+    onto the DB executor and never leak into the next request on a thread.
+    """
+    intent_token = _intent.set(OTHER)
+    trace_token = _trace.set({})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        intent, trace = _intent.get(), _trace.get()
+        _trace.reset(trace_token)
+        _intent.reset(intent_token)
+        _finish_request(intent, elapsed, trace)
+
+def traced_chunks(intent, chunks):
+    """Yield from ``chunks`` as one chat request for ``intent``.
+
+    Only the time spent producing chunks counts, not the time the consumer
+    takes to send them, and the intent is only set while a chunk is being
+    produced, so nothing leaks into the consumer between chunks.
+    """
+    iterator = iter(chunks)
+    trace = {}
+    elapsed = 0.0
+    try:
+        while True:
+            intent_token = _intent.set(intent)
+            trace_token = _trace.set(trace)
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator, _DONE)
+            finally:
+                elapsed += time.perf_counter() - start
+                _trace.reset(trace_token)
+                _intent.reset(intent_token)
+            if chunk is _DONE:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            close()
+        record_span('handler', elapsed, intent)
+        trace['handler'] = (elapsed, 1)
+        _finish_request(intent, elapsed, trace)
+
+def _finish_request(intent, elapsed, trace):
+    if not ENABLED:
+        return
+    REQUESTS.observe(elapsed, intent)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("chat trace", extra={
+            'intent': intent,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'spans': {name: {'ms': round(total * 1000, 3), 'count': count}
+                      for name, (total, count) in trace.items()}
+        })
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that records every statement as a "db" span"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_span('db', time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_span('db', time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            record_span('db', time.perf_counter() - start)
+
+
+class TracingConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind conn.execute(), trace queries"""
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+
+def connection_factory():
+    """Factory for sqlite3.connect: TracingConnection unless metrics are off"""
+    return TracingConnection if ENABLED else sqlite3.Connection
+
+
+def _format_value(value):
+    return '+Inf' if value == math.inf else repr(float(value))
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def render_prometheus():
+    """All histograms in the Prometheus text exposition format (0.0.4).
+
+    Buckets are reported at each power of two microseconds, which are
+    bucket edges of the histogram, so the cumulative counts are exact.
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.append(f"# HELP {histogram.name} {histogram.help_text}")
+        lines.append(f"# TYPE {histogram.name} histogram")
+        for labels, series in histogram.series():
+            cumulative = series.counts[0]
+            for octave in range(OCTAVES + 1):
+                le = 2 ** octave / 1e6
+                label_text = _format_labels(histogram.labelnames, labels, [('le', _format_value(le))])
+                lines.append(f"{histogram.name}_bucket{label_text} {cumulative}")
+                if octave < OCTAVES:
+                    first = 1 + octave * SUB_BUCKETS
+                    cumulative += sum(series.counts[first:first + SUB_BUCKETS])
+            label_text = _format_labels(histogram.labelnames, labels, [('le', '+Inf')])
+            lines.append(f"{histogram.name}_bucket{label_text} {series.count}")
+            label_text = _format_labels(histogram.labelnames, labels)
+            lines.append(f"{histogram.name}_sum{label_text} {_format_value(series.sum)}")
+            lines.append(f"{histogram.name}_count{label_text} {series.count}")
+    return '\n'.join(lines) + '\n'
+
+def summary(quantiles=(0.5, 0.9, 0.99)):
+    """{histogram name: [{labels..., count, mean, p50, p90, p99, max}]}, in seconds"""
+    result = {}
+    for histogram in HISTOGRAMS:
+        rows = []
+        for labels, series in histogram.series():
+            row = dict(zip(histogram.labelnames, labels))
+            row['count'] = series.count
+            row['mean'] = series.sum / series.count if series.count else 0.0
+            for q in quantiles:
+                row[f"p{q * 100:g}"] = Histogram.quantile(series, q)
+            row['max'] = series.max
+            rows.append(row)
+        result[histogram.name] = rows
+    return result
+
+def format_summary(quantiles=(0.5, 0.9, 0.99)):
+    """summary() as a plain-text table, times in milliseconds"""
+    rows_by_name = summary(quantiles)
+    stat_keys = ['mean'] + [f"p{q * 100:g}" for q in quantiles] + ['max']
+    out = []
+    for histogram in HISTOGRAMS:
+        out.append(f"{histogram.name} (ms)")
+        for row in rows_by_name[histogram.name]:
+            labels = ' '.join(f"{name}={row[name]}" for name in histogram.labelnames)
+            stats = ' '.join(f"{key}={row[key] * 1000:.3f}" for key in stat_keys)
+            out.append(f"  {labels:44} n={row['count']:<7} {stats}")
+    return '\n'.join(out)
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
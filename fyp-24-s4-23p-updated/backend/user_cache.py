@@ -0,0 +1,192 @@
+"""Per-user read cache for profile data and the chat listings.
+
+Entries are grouped by user and the cache holds at most USER_CACHE_USERS
+users, least recently used first out. Everything that writes a user's
+data calls ``invalidate_user`` after committing, so repeated views are
+served without SQL. Invalidation only reaches the current process; with
+several workers USER_CACHE_TTL bounds how stale another worker can be.
+
+A load that races a write cannot put stale data back: ``load`` takes a
+token before reading and ``set`` drops the value if the user was
+invalidated after that token was taken. Invalidating a user who is not
+cached only records the time in a small bounded map, so bulk writers
+that invalidate thousands of users do not grow the cache.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from db_connection import get_read_connection
+
+PROFILE = 'profile'
+APPOINTMENTS = 'appointments'
+BILLS = 'bills'
+PRESCRIPTIONS = 'prescriptions'
+
+_MISSING = object()
+
+
+class _UserEntry:
+    __slots__ = ('values', 'invalidated_at')
+
+    def __init__(self):
+        # {(section, variant): (expires_at, value)}
+        self.values = {}
+        self.invalidated_at = 0
+
+
+class UserCache:
+    """LRU by user of ``(section, variant) -> value``, each value with a TTL"""
+
+    def __init__(self, max_users=2048, ttl=120.0, max_pending=256):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = 0
+        # Latest invalidation of any user evicted or dropped from _pending since; see set()
+        self._evicted_at = 0
+        # {user_id: clock} for users invalidated while not cached, oldest first
+        self._pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self):
+        """Take before reading the database; hand to set()"""
+        with self._lock:
+            return self._clock
+
+    def get(self, user_id, section, variant=None, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            value = entry.values.get((section, variant), _MISSING) if entry else _MISSING
+            if value is _MISSING or value[0] <= now:
+                if value is not _MISSING:
+                    del entry.values[(section, variant)]
+                self.misses += 1
+                return default
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return value[1]
+
+    def set(self, user_id, section, value, variant=None, token=None):
+        if self.max_users <= 0:
+            return
+        with self._lock:
+            entry = self._users.get(user_id)
+            if token is not None:
+                if entry:
+                    invalidated_at = entry.invalidated_at
+                else:
+                    invalidated_at = max(self._pending.get(user_id, 0), self._evicted_at)
+                if invalidated_at > token:
+                    return
+            if entry is None:
+                entry = self._users[user_id] = _UserEntry()
+                # Keeps rejecting loads of other sections that started before the last write
+                entry.invalidated_at = max(self._pending.pop(user_id, 0), self._evicted_at)
+            entry.values[(section, variant)] = (time.monotonic() + self.ttl, value)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                _, evicted = self._users.popitem(last=False)
+                self._evicted_at = max(self._evicted_at, evicted.invalidated_at)
+                self.evictions += 1
+
+    def load(self, user_id, section, loader, variant=None):
+        """Read-through: the cached value, else ``loader()``, which is then cached"""
+        value = self.get(user_id, section, variant, _MISSING)
+        if value is _MISSING:
+            token = self.token()
+            value = loader()
+            self.set(user_id, section, value, variant, token)
+        return value
+
+    def invalidate(self, user_id, *sections):
+        """Drop the given sections (every section if none) for one user"""
+        with self._lock:
+            self._clock += 1
+            self.invalidations += 1
+            entry = self._users.get(user_id)
+            if entry is None:
+                # Remember the write so an in-flight load for this user is dropped
+                self._pending[user_id] = self._clock
+                self._pending.move_to_end(user_id)
+                while len(self._pending) > self.max_pending:
+                    _, invalidated_at = self._pending.popitem(last=False)
+                    self._evicted_at = max(self._evicted_at, invalidated_at)
+                return
+            entry.invalidated_at = self._clock
+            if sections:
+                for key in [key for key in entry.values if key[0] in sections]:
+                    del entry.values[key]
+            else:
+                entry.values.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._evicted_at = self._clock
+            self._users.clear()
+            self._pending.clear()
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self._users),
+                'max_users': self.max_users,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_user_cache():
+    """Process-wide UserCache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache(
+                    max_users=int(os.environ.get('USER_CACHE_USERS', 2048)),
+                    ttl=float(os.environ.get('USER_CACHE_TTL', 120))
+                )
+    return _cache
+
+def invalidate_user(user_id, *sections):
+    """Call after committing a change to a user's data"""
+    if user_id is not None:
+        get_user_cache().invalidate(user_id, *sections)
+
+
+def _load_profile(user_id):
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.id AS user_id, u.username, u.email, u.phone, u.address, u.emergency_contact,
+                   p.id AS profile_id, p.first_name, p.last_name, p.blood_type, p.allergies
+            FROM users u
+            LEFT JOIN patient_profiles p ON u.id = p.user_id
+            WHERE u.id = ?
+        """, (user_id,))
+        row = cursor.fetchone()
+    return dict(row) if row else None
+
+def get_profile(user_id):
+    """The user's account and patient profile fields as a dict, or None.
+
+    ``profile_id`` is None when the user has no patient profile yet.
+    """
+    return get_user_cache().load(user_id, PROFILE, lambda: _load_profile(user_id))
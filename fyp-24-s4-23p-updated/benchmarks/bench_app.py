@@ -0,0 +1,340 @@
+"""End-to-end benchmark of the Flask app: login, every chat intent family and password changes.
+
+Seeds a throwaway database with synthetic patients, then drives the app
+through the Flask test client (no network, one thread) and through a real
+threaded WSGI server over HTTP (``--concurrency`` client threads).
+Dialogflow is the in-process stub, so nothing leaves the machine.
+
+For each scenario it reports throughput, p50/p95/p99 latency and the
+share of request time spent in SQLite, taken from the "db" spans in
+tracing. ``--save-baseline`` writes the results as JSON; ``--baseline``
+compares against such a file and exits 1 when a scenario's p95 or
+throughput is worse by more than ``--tolerance``.
+
+Usage: python benchmarks/bench_app.py [--users N] [--requests N] [--mode client|server|both]
+                                      [--concurrency N] [--baseline FILE] [--save-baseline FILE]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_app.db'))
+os.environ.setdefault('DIALOGFLOW_BACKEND', 'stub')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# werkzeug sets its own logger to INFO and would log every request
+os.environ.setdefault('LOG_LEVELS', 'werkzeug=WARNING')
+# The KDF cost is sized by bench_passwords.py; keep it cheap so this measures the app
+os.environ.setdefault('PASSWORD_COST', '4')
+# Every client logs in from 127.0.0.1, which the login rate limit would throttle
+os.environ.setdefault('LOGIN_RATE_LIMIT', '0')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from werkzeug.serving import make_server
+
+import tracing
+from app import app
+from db_connection import get_connection
+from passwords import hash_password
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_app.json')
+
+DOCTORS = ['Smith', 'Johnson', 'Williams', 'Davis']
+SEED_PASSWORD = 'bench-password'
+MEDICATIONS = ['amoxicillin', 'metformin', 'lisinopril', 'atorvastatin', 'omeprazole', 'salbutamol']
+
+# One scenario per intent family handled in DialogflowHandler.handle_intent,
+# plus the profile commands chat_service answers before it
+CHAT_FAMILIES = {
+    'listings': ['show my appointments', 'show my prescriptions', 'show my bills', 'show next 5 appointments'],
+    'profile': ['show my profile', 'how do i update my profile', 'show my profile information'],
+    'profile_update': ['update my phone to {phone}', 'update my address to {n} Harbour Road'],
+    'clinic': ['what are the clinic opening hours', 'where is the clinic located',
+               'what is the clinic phone number', 'tell me about the clinic'],
+    'doctors': ['which doctors are available', 'is there a doctor for cardiology'],
+    'scheduling': ['i want a checkup with dr {doctor} tomorrow at {hour} pm'],
+    'prescriptions': ['i need a refill for {medication}', 'show all my prescription history'],
+    'dialogflow': ['hi', 'thanks', 'what is the weather like', 'tell me a joke'],
+}
+
+
+def seed(users, rng):
+    """Create ``users`` patients with appointments, bills and prescriptions; returns [(username, password)]
+
+    Every patient starts with the same password, hashed once, so logins
+    measure the normal verify path rather than a one-off legacy upgrade.
+    """
+    today = date.today()
+    accounts = [(f"patient{i:06d}", SEED_PASSWORD) for i in range(users)]
+    password_hash = hash_password(SEED_PASSWORD)
+    with get_connection() as conn:
+        conn.executemany("INSERT INTO users (username, password, email, phone) VALUES (?, ?, ?, ?)",
+                         [(name, password_hash, f"{name}@example.com", f"555{i:07d}")
+                          for i, (name, _) in enumerate(accounts)])
+        ids = [row['id'] for row in conn.execute(
+            "SELECT id FROM users WHERE username LIKE 'patient%' ORDER BY id")]
+        conn.executemany("INSERT INTO patient_profiles (user_id, first_name, last_name, blood_type) VALUES (?, ?, ?, ?)",
+                         [(user_id, 'Patient', str(user_id), rng.choice(['A+', 'B+', 'O+', 'AB-']))
+                          for user_id in ids])
+        appointments, bills, prescriptions = [], [], []
+        for n, user_id in enumerate(ids):
+            # Distinct slot per appointment: each user owns whole half-hours on its own days
+            for k in range(rng.randint(2, 8)):
+                day = today + timedelta(days=2 + (n * 8 + k) // 16)
+                slot = (n * 8 + k) % 16
+                appointments.append((user_id, DOCTORS[k % len(DOCTORS)], day.isoformat(),
+                                     f"{9 + slot // 2:02d}:{(slot % 2) * 30:02d}", 'General Checkup'))
+            for _ in range(rng.randint(1, 6)):
+                bills.append((user_id, rng.choice([50, 80, 120, 200]), 'Consultation',
+                              (today + timedelta(days=rng.randint(1, 60))).isoformat()))
+            for medication in rng.sample(MEDICATIONS, rng.randint(1, 3)):
+                prescriptions.append((user_id, medication, '10mg', 'daily', today.isoformat(),
+                                      (today + timedelta(days=rng.randint(10, 90))).isoformat(), rng.randint(0, 3)))
+        conn.executemany("""
+            INSERT INTO appointments (user_id, doctor_name, appointment_date, appointment_time, appointment_type)
+            VALUES (?, ?, ?, ?, ?)
+        """, appointments)
+        conn.executemany("INSERT INTO bills (user_id, amount, description, status, due_date) VALUES (?, ?, ?, 'PENDING', ?)",
+                         bills)
+        conn.executemany("""
+            INSERT INTO prescriptions (user_id, medication_name, dosage, frequency, start_date, end_date, refills_remaining)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, prescriptions)
+        conn.commit()
+    return accounts
+
+
+def chat_message(family, rng):
+    template = rng.choice(CHAT_FAMILIES[family])
+    return template.format(phone=rng.randrange(10 ** 9, 10 ** 10), n=rng.randint(1, 300),
+                           doctor=rng.choice(DOCTORS).lower(), hour=rng.randint(1, 4),
+                           medication=rng.choice(MEDICATIONS))
+
+
+class ClientSession:
+    """A browser session through the Flask test client"""
+
+    def __init__(self, base=None):
+        self.client = app.test_client()
+
+    def post_form(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+    def post_json(self, path, data):
+        response = self.client.post(path, json=data)
+        response.get_data()
+        return response.status_code
+
+
+class HttpSession:
+    """A browser session over HTTP against the WSGI server, with its own cookie"""
+
+    def __init__(self, base):
+        self.host, self.port = base
+        self.cookie = None
+
+    def _request(self, path, body, content_type):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {'Content-Type': content_type}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            conn.request('POST', path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            set_cookie = response.getheader('Set-Cookie')
+            if set_cookie:
+                self.cookie = set_cookie.split(';', 1)[0]
+            return response.status
+        finally:
+            conn.close()
+
+    def post_form(self, path, data):
+        return self._request(path, urlencode(data), 'application/x-www-form-urlencoded')
+
+    def post_json(self, path, data):
+        return self._request(path, json.dumps(data), 'application/json')
+
+
+class Account:
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.session = None
+
+
+def login(session, account):
+    return session.post_form('/login', {'username': account.username, 'password': account.password})
+
+
+def change_password(account, rng):
+    new_password = account.password + '!' if len(account.password) < 16 else account.password.rstrip('!')
+    status = account.session.post_json('/change-password', {'currentPassword': account.password,
+                                                            'newPassword': new_password})
+    if status == 200:
+        account.password = new_password
+    return status
+
+
+def scenarios():
+    """[(name, request(account, session_class, base, rng) -> HTTP status)]"""
+    def login_request(account, session_class, base, rng):
+        return login(session_class(base), account)
+
+    def chat_request(family):
+        return lambda account, session_class, base, rng: account.session.post_json(
+            '/chat', {'message': chat_message(family, rng)})
+
+    def password_request(account, session_class, base, rng):
+        return change_password(account, rng)
+
+    return ([('login', login_request)]
+            + [(f"chat:{family}", chat_request(family)) for family in CHAT_FAMILIES]
+            + [('change_password', password_request)])
+
+
+def db_seconds():
+    return sum(series.sum for labels, series in tracing.SPANS.series() if labels[0] == 'db')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_scenario(request, accounts, requests, concurrency, session_class, base, seed):
+    """Run ``requests`` calls over ``concurrency`` threads; returns the scenario's stats"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        mine = accounts[index::concurrency]
+        for n in range(index, requests, concurrency):
+            account = mine[(n // concurrency) % len(mine)]
+            start = time.perf_counter()
+            status = request(account, session_class, base, rng)
+            latencies[index].append(time.perf_counter() - start)
+            if status >= 400:
+                errors[index] += 1
+
+    tracing.reset()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    samples = sorted(value for values in latencies for value in values)
+    busy = sum(samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(errors),
+        'throughput': len(samples) / wall if wall else 0.0,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'db_share': db_seconds() / busy if busy else 0.0,
+    }
+
+
+def run_mode(mode, accounts, args):
+    if mode == 'client':
+        session_class, base, concurrency, server = ClientSession, None, 1, None
+    else:
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        session_class, base, concurrency = HttpSession, ('127.0.0.1', server.server_port), args.concurrency
+
+    try:
+        for account in accounts:
+            account.session = session_class(base)
+            if login(account.session, account) != 302:
+                raise SystemExit(f"Could not log in as {account.username}")
+        results = {}
+        for n, (name, request) in enumerate(scenarios()):
+            # Warm caches and code paths the way a running server would have
+            run_scenario(request, accounts, min(args.requests, len(accounts)), concurrency, session_class, base, n + 101)
+            results[name] = run_scenario(request, accounts, args.requests, concurrency, session_class, base, n + 1)
+        return results
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+def print_results(results):
+    print(f"{'mode':7}{'scenario':22}{'req':>6}{'err':>5}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db %':>7}")
+    for mode, scenarios_results in results.items():
+        for name, stats in scenarios_results.items():
+            print(f"{mode:7}{name:22}{stats['requests']:6}{stats['errors']:5}{stats['throughput']:10.1f}"
+                  f"{stats['p50_ms']:9.2f}{stats['p95_ms']:9.2f}{stats['p99_ms']:9.2f}{stats['db_share'] * 100:7.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing each scenario that regressed against ``baseline``"""
+    regressions = []
+    for mode, scenarios_results in results.items():
+        for name, stats in scenarios_results.items():
+            base = baseline.get('results', {}).get(mode, {}).get(name)
+            if not base:
+                continue
+            if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{mode} {name}: p95 {stats['p95_ms']:.2f}ms vs baseline {base['p95_ms']:.2f}ms")
+            if stats['throughput'] < base['throughput'] / (1 + tolerance):
+                regressions.append(f"{mode} {name}: {stats['throughput']:.1f} req/s vs baseline {base['throughput']:.1f} req/s")
+            if stats['errors'] > base['errors']:
+                regressions.append(f"{mode} {name}: {stats['errors']} errors vs baseline {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=400, help="measured requests per scenario")
+    parser.add_argument('--mode', choices=['client', 'server', 'both'], default='both')
+    parser.add_argument('--concurrency', type=int, default=4, help="client threads against the WSGI server")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE, help="compare with a baseline JSON file")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, help="write results as a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed slowdown before failing, 0.5 = 50%%")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    accounts = [Account(name, password) for name, password in seed(args.users, rng)]
+    print(f"Seeded {args.users} users in {time.perf_counter() - start:.2f}s ({os.environ['DATABASE_PATH']})")
+
+    modes = ['client', 'server'] if args.mode == 'both' else [args.mode]
+    results = {mode: run_mode(mode, accounts, args) for mode in modes}
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': {'users': args.users, 'requests': args.requests, 'concurrency': args.concurrency,
+                                  'python': sys.version.split()[0]},
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
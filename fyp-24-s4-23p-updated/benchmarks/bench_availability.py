@@ -0,0 +1,111 @@
+"""Slot availability: legacy per-slot scan vs the bitmap engine.
+
+Builds a throwaway database with synthetic doctors and bookings, then times
+one-day lookups and a multi-day range.
+
+Usage: python benchmarks/bench_availability.py [--doctors N] [--bookings N] [--days N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_availability.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from db_connection import get_connection, get_read_connection, initialize_database
+from appointment_scheduler import AppointmentScheduler
+
+SCHEDULE = json.dumps({day: "08:00-18:00" for day in
+                       ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')})
+
+
+def seed(doctors, bookings, days):
+    initialize_database()
+    rng = random.Random(42)
+    names = [f"Doctor{i:03d}" for i in range(doctors)]
+    start = datetime.now().date()
+    with get_connection() as conn:
+        conn.execute("UPDATE doctors SET status = 'inactive'")
+        conn.executemany("INSERT INTO doctors (name, speciality, schedule) VALUES (?, 'General Practice', ?)",
+                         [(name, SCHEDULE) for name in names])
+        rows = set()
+        while len(rows) < bookings:
+            rows.add((rng.choice(names), (start + timedelta(days=rng.randrange(days))).isoformat(),
+                      f"{rng.randrange(8, 18):02d}:{rng.choice(('00', '30'))}"))
+        conn.executemany("""
+            INSERT INTO appointments (user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
+            VALUES (1, ?, ?, ?, 'General Checkup', 'scheduled')
+        """, list(rows))
+        conn.commit()
+    return start
+
+
+def legacy_available_slots(date):
+    """The original implementation, kept here as the baseline"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM doctors WHERE status = 'active'")
+        doctors = cursor.fetchall()
+        cursor.execute("""
+            SELECT appointment_time, doctor_name
+            FROM appointments
+            WHERE appointment_date = ? AND status != 'cancelled'
+        """, (date,))
+        booked_slots = cursor.fetchall()
+        available_slots = []
+        for doctor in doctors:
+            schedule = json.loads(doctor['schedule'])
+            day_of_week = datetime.strptime(date, '%Y-%m-%d').strftime('%A').lower()
+            if day_of_week in schedule:
+                work_hours = schedule[day_of_week].split('-')
+                current_slot = datetime.strptime(work_hours[0], '%H:%M')
+                end_time = datetime.strptime(work_hours[1], '%H:%M')
+                while current_slot < end_time:
+                    slot_time = current_slot.strftime('%H:%M')
+                    if not any(b['appointment_time'] == slot_time and b['doctor_name'] == doctor['name'] for b in booked_slots):
+                        available_slots.append({'time': slot_time, 'doctor': doctor['name']})
+                    current_slot += timedelta(minutes=30)
+    return available_slots
+
+
+def timed(func, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--bookings', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=14)
+    args = parser.parse_args()
+
+    start = seed(args.doctors, args.bookings, args.days)
+    day = start.isoformat()
+
+    legacy_time, legacy = timed(legacy_available_slots, day)
+    engine_time, engine = timed(AppointmentScheduler.get_available_slots, day)
+    assert legacy == engine, "engine and legacy disagree"
+
+    legacy_range = sum(timed(legacy_available_slots, (start + timedelta(days=i)).isoformat(), repeat=1)[0]
+                       for i in range(args.days))
+    range_time, slots = timed(AppointmentScheduler.get_next_available_slots, args.days)
+
+    print(f"{args.doctors} doctors, {args.bookings} bookings over {args.days} days")
+    print(f"One day, legacy scan:   {legacy_time * 1000:8.2f} ms ({len(legacy)} free slots)")
+    print(f"One day, bitmap engine: {engine_time * 1000:8.2f} ms")
+    print(f"{args.days} days, legacy x{args.days}:  {legacy_range * 1000:8.2f} ms")
+    print(f"{args.days} days, bitmap engine: {range_time * 1000:8.2f} ms ({len(slots)} free slots)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Concurrent booking stress test: no slot may ever be booked twice.
+
+Several processes, each with several threads, race to book a small pool of
+slots through AppointmentScheduler.book_appointment. Afterwards the
+database is checked for double-booked slots and for appointments and bills
+that do not match up. ``--unsafe`` runs the old check-then-insert without
+the unique index for comparison.
+
+Usage: python benchmarks/bench_booking.py [--processes N] [--threads N] [--attempts N] [--slots N] [--unsafe]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_booking.db'))
+# Every process has its own writer; give the busy retry room under contention
+os.environ.setdefault('DB_BUSY_RETRIES', '20')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from db_connection import get_connection, initialize_database
+from appointment_scheduler import AppointmentScheduler, BOOKED
+
+DOCTORS = ['Smith', 'Johnson', 'Williams', 'Davis']
+
+
+def next_monday():
+    today = datetime.now().date()
+    return (today + timedelta(days=7 - today.weekday())).isoformat()
+
+
+def slot_pool(count):
+    day = next_monday()
+    times = [f"{10 + i // 2:02d}:{(i % 2) * 30:02d}" for i in range(12)]
+    slots = [(doctor, day, t) for t in times for doctor in DOCTORS]
+    return slots[:count]
+
+
+def unsafe_book(user_id, doctor_name, appointment_date, appointment_type, appointment_time):
+    """The original check-then-insert, for comparison"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) as count FROM appointments
+            WHERE doctor_name = ? AND appointment_date = ? AND appointment_time = ? AND status != 'cancelled'
+        """, (doctor_name, appointment_date, appointment_time))
+        if cursor.fetchone()['count'] > 0:
+            return 'slot_taken'
+        time.sleep(0.001)  # the gap other writers slip through
+        cursor.execute("""
+            INSERT INTO appointments (user_id, doctor_name, appointment_date, appointment_time, appointment_type, status)
+            VALUES (?, ?, ?, ?, ?, 'scheduled')
+        """, (user_id, doctor_name, appointment_date, appointment_time, appointment_type))
+        cursor.execute("""
+            INSERT INTO bills (user_id, appointment_id, amount, description, status, due_date)
+            VALUES (?, ?, 150.0, 'General Checkup Appointment', 'PENDING', date(?, '+30 days'))
+        """, (user_id, cursor.lastrowid, appointment_date))
+        conn.commit()
+        return BOOKED
+
+
+def worker(args):
+    seed, threads, attempts, slots, unsafe = args
+    outcomes = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def run(thread_seed):
+        rng = random.Random(thread_seed)
+        for _ in range(attempts):
+            doctor, day, slot = rng.choice(slots)
+            start = time.perf_counter()
+            if unsafe:
+                status = unsafe_book(thread_seed, doctor, day, 'General Checkup', slot)
+            else:
+                status = AppointmentScheduler.book_appointment(thread_seed, doctor, day, 'General Checkup', slot).status
+            elapsed = time.perf_counter() - start
+            with lock:
+                outcomes[status] += 1
+                latencies.append(elapsed)
+
+    pool = [threading.Thread(target=run, args=(seed * 1000 + i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return outcomes, latencies
+
+
+def verify():
+    with get_connection() as conn:
+        doubles = conn.execute("""
+            SELECT doctor_name, appointment_date, appointment_time, COUNT(*) as count
+            FROM appointments WHERE status != 'cancelled'
+            GROUP BY doctor_name, appointment_date, appointment_time
+            HAVING COUNT(*) > 1
+        """).fetchall()
+        appointments = conn.execute("SELECT COUNT(*) as count FROM appointments").fetchone()['count']
+        unbilled = conn.execute("""
+            SELECT COUNT(*) as count FROM appointments a
+            WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.appointment_id = a.id)
+        """).fetchone()['count']
+        orphan_bills = conn.execute("""
+            SELECT COUNT(*) as count FROM bills b
+            WHERE b.appointment_id IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.id = b.appointment_id)
+        """).fetchone()['count']
+    return doubles, appointments, unbilled, orphan_bills
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=50, help="booking attempts per thread")
+    parser.add_argument('--slots', type=int, default=40, help="size of the contended slot pool")
+    parser.add_argument('--unsafe', action='store_true', help="check-then-insert without the unique index")
+    args = parser.parse_args()
+
+    initialize_database()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM bills")
+        conn.execute("DELETE FROM appointments")
+        if args.unsafe:
+            conn.execute("DROP INDEX IF EXISTS uq_appointments_active_slot")
+        conn.commit()
+
+    slots = slot_pool(args.slots)
+    jobs = [(p + 1, args.threads, args.attempts, slots, args.unsafe) for p in range(args.processes)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(worker, jobs)
+    elapsed = time.perf_counter() - start
+
+    outcomes = Counter()
+    latencies = []
+    for counts, times in results:
+        outcomes.update(counts)
+        latencies.extend(times)
+    latencies.sort()
+    doubles, appointments, unbilled, orphan_bills = verify()
+
+    total = sum(outcomes.values())
+    print(f"{args.processes} processes x {args.threads} threads x {args.attempts} attempts "
+          f"on {len(slots)} slots{' (unsafe)' if args.unsafe else ''}")
+    print(f"Attempts: {total} in {elapsed:.2f}s ({total / elapsed:.0f}/s), outcomes {dict(outcomes)}")
+    print(f"Latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"Appointments: {appointments}, booked reported: {outcomes[BOOKED]}, "
+          f"unbilled: {unbilled}, orphan bills: {orphan_bills}")
+    print(f"Double-booked slots: {len(doubles)}")
+    if doubles or unbilled or orphan_bills or appointments != outcomes[BOOKED]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
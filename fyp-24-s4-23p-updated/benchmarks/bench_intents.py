@@ -0,0 +1,175 @@
+"""Per-message cost and held-out accuracy of local intent classification.
+
+HELD_OUT are paraphrases that are not training phrases, each with the
+intent it should reach; OUT_OF_SCOPE should all fall through to
+Dialogflow, and every training phrase should reach its own intent. A
+held-out message is correct, falls through (fine,
+Dialogflow answers it) or is misrouted to another local intent (a wrong
+answer). The run exits with status 1 when accuracy drops below
+``--min-accuracy``, anything is misrouted or a false positive, or a
+training phrase is unreachable.
+
+Usage: python benchmarks/bench_intents.py [--iterations N] [--min-accuracy F]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from intent_classifier import TRAINING_PHRASES, build_default_engine
+
+MESSAGES = [
+    "show my appointments",
+    "show my bills",
+    "show my prescriptions",
+    "which doctors are available for cardiology",
+    "what are the clinic opening hours",
+    "where is the clinic located",
+    "i want a checkup with dr smith tomorrow at 2 pm",
+    "i need a refill for amoxicillin",
+    "how do i update my profile",
+    "when are you open on sunday",
+    "how much do i owe",
+    "my upcoming visits",
+    "hi",
+    "thanks, that is all",
+    "what is the weather like",
+]
+
+HELD_OUT = [
+    ("any physicians free on monday", 'doctors'),
+    ("do you have a dermatologist", 'doctors'),
+    ("which specialists work at the practice", 'doctors'),
+    ("can i see a gp", 'doctors'),
+    ("what time do you shut", 'clinic_hours'),
+    ("are you open saturday", 'clinic_hours'),
+    ("when do you close today", 'clinic_hours'),
+    ("opening hours on weekends", 'clinic_hours'),
+    ("where exactly is the building", 'clinic_location'),
+    ("what's the address", 'clinic_location'),
+    ("how do i find the practice", 'clinic_location'),
+    ("where is your office", 'clinic_location'),
+    ("what's your phone number", 'clinic_contact'),
+    ("how do i get in touch", 'clinic_contact'),
+    ("can i email you", 'clinic_contact'),
+    ("your contact number", 'clinic_contact'),
+    ("what visits are coming up", 'show_appointments'),
+    ("do i have any visits this week", 'show_appointments'),
+    ("my next visit", 'show_appointments'),
+    ("what do i owe", 'show_billing'),
+    ("my balance", 'show_billing'),
+    ("any unpaid invoices", 'show_billing'),
+    ("how much is due", 'show_billing'),
+    ("view my profile", 'show_profile'),
+    ("what details do you have on me", 'show_profile'),
+    ("my personal information", 'show_profile'),
+    ("what meds am i on", 'prescriptions'),
+    ("which pills do i take", 'prescriptions'),
+    ("my drug list", 'prescriptions'),
+    ("my address changed", 'profile_help'),
+    ("i moved to a new address", 'profile_help'),
+    ("my phone number changed", 'profile_help'),
+    ("my email address is different now", 'profile_help'),
+]
+
+OUT_OF_SCOPE = [
+    "what is the weather like",
+    "tell me a joke",
+    "i feel dizzy",
+    "thanks, that is all",
+    "good morning",
+    "who won the game",
+    "what is covid",
+    "can you help me",
+    "i have a headache",
+    "what is your name",
+    "is it going to rain",
+    "i lost my keys",
+    "how are you today",
+    "what is two plus two",
+]
+
+
+def bench(engine, messages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            engine.classify(message)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(messages))
+
+
+def accepted(engine, message):
+    """Intent the engine handles ``message`` with locally, or None for Dialogflow"""
+    match = engine.classify(message)
+    return match.intent if match.confidence >= engine.threshold else None
+
+
+def evaluate(engine):
+    """(correct, fell through, [misrouted], [false positives]) over HELD_OUT and OUT_OF_SCOPE"""
+    training = {phrase.lower() for phrases in TRAINING_PHRASES.values() for phrase in phrases}
+    leaked = [message for message, _ in HELD_OUT if message in training]
+    assert not leaked, f"held-out messages are training phrases: {leaked}"
+
+    correct = fell_through = 0
+    misrouted = []
+    for message, expected in HELD_OUT:
+        intent = accepted(engine, message)
+        if intent == expected:
+            correct += 1
+        elif intent is None:
+            fell_through += 1
+        else:
+            misrouted.append((message, expected, intent))
+    false_positives = [(message, accepted(engine, message)) for message in OUT_OF_SCOPE
+                       if accepted(engine, message)]
+    return correct, fell_through, misrouted, false_positives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--min-accuracy', type=float, default=0.65, help="held-out share that must be handled locally")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = build_default_engine()
+    build_time = time.perf_counter() - start
+    rules_only = build_default_engine(use_ngrams=False)
+
+    print(f"Engine build: {build_time * 1000:.2f} ms")
+    print(f"{'message':50} {'intent':22} {'source':6} {'conf':>5} {'us/msg':>8}")
+    for message in MESSAGES:
+        match = engine.classify(message)
+        cost = bench(engine, [message], args.iterations)
+        print(f"{message:50} {str(match.intent):22} {str(match.source):6} {match.confidence:5.2f} {cost * 1e6:8.1f}")
+
+    local = sum(1 for m in MESSAGES if engine.classify(m).confidence >= engine.threshold)
+    print()
+    print(f"Rules only:      {bench(rules_only, MESSAGES, args.iterations) * 1e6:8.1f} us/msg")
+    print(f"Rules + n-grams: {bench(engine, MESSAGES, args.iterations) * 1e6:8.1f} us/msg")
+    print(f"Handled locally: {local}/{len(MESSAGES)} (threshold {engine.threshold})")
+
+    correct, fell_through, misrouted, false_positives = evaluate(engine)
+    accuracy = correct / len(HELD_OUT)
+    print()
+    print(f"Held-out: {correct}/{len(HELD_OUT)} correct ({accuracy:.0%}), {fell_through} to Dialogflow, "
+          f"{len(misrouted)} misrouted")
+    for message, expected, intent in misrouted:
+        print(f"  misrouted: {message!r} -> {intent}, expected {expected}")
+    print(f"Out of scope: {len(false_positives)}/{len(OUT_OF_SCOPE)} false positives")
+    for message, intent in false_positives:
+        print(f"  false positive: {message!r} -> {intent}")
+    unreachable = [(phrase, intent) for intent, phrases in TRAINING_PHRASES.items() for phrase in phrases
+                   if accepted(engine, phrase.lower()) != intent]
+    print(f"Training phrases not reaching their intent: {len(unreachable)}")
+    for phrase, intent in unreachable:
+        print(f"  unreachable: {phrase!r} ({intent})")
+    if accuracy < args.min_accuracy or misrouted or false_positives or unreachable:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Password KDF cost against a login-throughput target.
+
+For each cost it times single verifications, then drives the hashing pool
+from ``--clients`` threads for ``--seconds`` and reports verifications per
+second and p95 latency, which is what a login burst sees (the database
+part of a login is well under a millisecond). The recommended cost is the
+highest one that still meets ``--target`` logins per second with a p95
+under ``--max-p95-ms``.
+
+Usage: python benchmarks/bench_passwords.py [--scheme bcrypt|scrypt] [--costs 10,11,12,13]
+                                            [--target N] [--max-p95-ms N] [--workers N] [--clients N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from passwords import DEFAULT_COSTS, PASSWORD_SCHEME, PasswordHasher
+
+DEFAULT_COST_RANGES = {'bcrypt': '10,11,12,13', 'scrypt': '13,14,15,16'}
+PASSWORD = 'correct horse battery staple'
+
+
+def single(hasher, stored, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hasher.check(PASSWORD, stored)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def load(hasher, stored, clients, seconds):
+    """Verifications per second and p95 latency with ``clients`` threads logging in back to back"""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        mine = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            hasher.check(PASSWORD, stored)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scheme', choices=sorted(DEFAULT_COSTS), default=PASSWORD_SCHEME)
+    parser.add_argument('--costs', help="comma-separated costs to try")
+    parser.add_argument('--target', type=float, default=20, help="logins per second the pool must sustain")
+    parser.add_argument('--max-p95-ms', type=float, default=1000, help="p95 login latency allowed under load")
+    parser.add_argument('--workers', type=int, help="pool size, PASSWORD_WORKERS by default")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent logins")
+    parser.add_argument('--seconds', type=float, default=3.0, help="load duration per cost")
+    args = parser.parse_args()
+
+    costs = [int(cost) for cost in (args.costs or DEFAULT_COST_RANGES[args.scheme]).split(',')]
+    chosen = None
+    print(f"scheme {args.scheme}, target {args.target:g} logins/s, p95 under {args.max_p95_ms:g} ms")
+    print(f"{'cost':>4} {'single ms':>10} {'logins/s':>9} {'p95 ms':>8}  workers")
+    for cost in costs:
+        hasher = PasswordHasher(args.scheme, cost, args.workers, max_pending=args.clients, queue_wait=60)
+        try:
+            stored = hasher.hash(PASSWORD)
+            single_time = single(hasher, stored, repeat=5)
+            rate, p95 = load(hasher, stored, args.clients, args.seconds)
+        finally:
+            hasher.shutdown()
+        ok = rate >= args.target and p95 * 1000 <= args.max_p95_ms
+        if ok:
+            chosen = cost
+        print(f"{cost:>4} {single_time * 1000:>10.1f} {rate:>9.1f} {p95 * 1000:>8.1f}  {hasher.workers}"
+              f"{'' if ok else '  (misses target)'}")
+
+    if chosen is None:
+        print("No cost meets the target; add workers or lower the target")
+        sys.exit(1)
+    print(f"Recommended: PASSWORD_SCHEME={args.scheme} PASSWORD_COST={chosen}")
+
+
+if __name__ == '__main__':
+    main()
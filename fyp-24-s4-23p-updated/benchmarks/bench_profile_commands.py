@@ -0,0 +1,101 @@
+"""Per-message cost of matching chat profile commands.
+
+Compares the original /chat loop (patterns rebuilt and searched one by one
+per message), the same loop over precompiled patterns, and the combined
+matcher in profile_commands. Most chat traffic is not a profile command,
+so the non-command case is reported separately.
+
+Usage: python benchmarks/bench_profile_commands.py [--iterations N]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_profile_commands.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from profile_commands import match_profile_command
+
+COMMANDS = [
+    "Update my phone number to 5551234567",
+    "update my address to 12 Harbour Road, Singapore",
+    "My blood type is AB+",
+    "update my allergies to penicillin and peanuts",
+    "update my emergency contact to Jane 5550000",
+]
+OTHER = [
+    "show my appointments",
+    "what are the clinic opening hours",
+    "i want a checkup with dr smith tomorrow at 2 pm",
+    "i need a refill for amoxicillin",
+    "how do i update my profile",
+    "show my profile information",
+    "hi",
+    "thanks, that is all",
+]
+
+LEGACY_PATTERNS = [
+    ('phone', r'[Uu]pdate my (?:phone|telephone|mobile)(?: number)? to (\d+)'),
+    ('address', r'[Uu]pdate my address to (.+)'),
+    ('blood_type', r'[Mm]y blood type is (A\+|A-|B\+|B-|O\+|O-|AB\+|AB-)'),
+    ('allergies', r'[Uu]pdate my allergies to (.+)'),
+    ('emergency_contact', r'[Uu]pdate my emergency contact to (.+)'),
+]
+COMPILED_PATTERNS = [(field, re.compile(pattern)) for field, pattern in LEGACY_PATTERNS]
+
+
+def legacy_match(message):
+    """The original view: dict built and patterns searched (via re's cache) per message"""
+    update_commands = dict(LEGACY_PATTERNS)
+    for field, pattern in update_commands.items():
+        import re
+        match = re.search(pattern, message)
+        if match:
+            return field, match.group(1).strip()
+    return None
+
+
+def compiled_loop_match(message):
+    for field, pattern in COMPILED_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return field, match.group(1).strip()
+    return None
+
+
+def combined_match(message):
+    command = match_profile_command(message)
+    return (command.field.name, command.value) if command and command.field else None
+
+
+def bench(func, messages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in messages:
+            func(message)
+    return (time.perf_counter() - start) / (iterations * len(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    for message in COMMANDS + OTHER:
+        assert legacy_match(message) == compiled_loop_match(message) == combined_match(message), message
+
+    print(f"{args.iterations} iterations, ns per message")
+    print(f"{'':24}{'commands':>10}{'other':>10}")
+    for name, func in (('legacy per-message loop', legacy_match),
+                       ('precompiled loop', compiled_loop_match),
+                       ('combined + prefilter', combined_match)):
+        commands = bench(func, COMMANDS, args.iterations)
+        other = bench(func, OTHER, args.iterations)
+        print(f"{name:24}{commands * 1e9:10.0f}{other * 1e9:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
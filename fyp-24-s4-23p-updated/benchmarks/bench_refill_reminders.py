@@ -0,0 +1,83 @@
+"""Refill reminders per second: one schedule_notification per prescription against the bulk job.
+
+Seeds ``--prescriptions`` prescriptions with end dates spread over the
+year around today into a throwaway database, then queues a reminder for
+every active one ending within the lookahead, first the original way (a
+connection and commit per reminder) and then with
+refill_reminders.generate_refill_reminders. The bulk job is run a second
+time to show that a re-run adds nothing.
+
+Usage: python benchmarks/bench_refill_reminders.py [--prescriptions N] [--chunk-size N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_refill_reminders.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from db_connection import get_connection, get_read_connection, initialize_database
+from notification_scheduler import schedule_notification
+from refill_reminders import DEFAULT_DAYS_BEFORE, DEFAULT_LOOKAHEAD, generate_refill_reminders
+
+
+def seed(count, today):
+    rng = random.Random(0)
+    with get_connection() as conn:
+        conn.execute("INSERT INTO users (username, password, email) VALUES ('bench', '', 'bench@example.com')")
+        user_id = conn.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()[0]
+        conn.executemany("""
+            INSERT INTO prescriptions (user_id, medication_name, dosage, frequency, end_date, refills_remaining, status)
+            VALUES (?, 'Metformin', '500mg', 'twice daily', ?, ?, ?)
+        """, [(user_id, (today + timedelta(days=rng.randrange(-180, 180))).date().isoformat(),
+               rng.randrange(3), rng.choice(('active', 'active', 'completed'))) for _ in range(count)])
+        conn.commit()
+
+
+def one_by_one(now):
+    """The original path: a query, then a connection and commit per reminder"""
+    with get_read_connection() as conn:
+        found = conn.execute("""
+            SELECT user_id, medication_name, end_date FROM prescriptions
+            WHERE status = 'active' AND end_date >= ? AND end_date < ?
+        """, (now.date().isoformat(), (now + timedelta(days=DEFAULT_LOOKAHEAD + 1)).date().isoformat())).fetchall()
+    for row in found:
+        end_date = datetime.fromisoformat(row['end_date'])
+        schedule_notification(row['user_id'], 'prescription_refill',
+                              f"Your {row['medication_name']} prescription runs out on {row['end_date']}",
+                              max(end_date - timedelta(days=DEFAULT_DAYS_BEFORE), now))
+    return len(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prescriptions', type=int, default=20000, help="prescriptions to seed")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="prescriptions per bulk transaction")
+    args = parser.parse_args()
+
+    initialize_database()
+    now = datetime.now().replace(microsecond=0)
+    seed(args.prescriptions, now)
+
+    start = time.perf_counter()
+    count = one_by_one(now)
+    elapsed = time.perf_counter() - start
+    print(f"{count} reminders due from {args.prescriptions} prescriptions")
+    print(f"{'schedule_notification':24} {elapsed:8.2f} s {count / elapsed:10.0f} reminders/s")
+    with get_connection() as conn:
+        conn.execute("DELETE FROM reminders")
+        conn.commit()
+
+    for name in ('generate (first run)', 'generate (re-run)'):
+        report = generate_refill_reminders(chunk_size=args.chunk_size, now=now)
+        print(f"{name:24} {report.seconds:8.2f} s {report.scanned / report.seconds:10.0f} reminders/s"
+              f"   {report.added} added")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Registrations per second: legacy two-transaction path, register_user and the bulk roster import.
+
+Each method registers ``--users`` fresh patients into the same throwaway
+database, timed end to end including password hashing. PASSWORD_COST
+defaults to the scheme's minimum here so the numbers are about the
+database path; set it to the production cost to see the hashing bound
+(bench_passwords.py sizes that cost).
+
+Usage: python benchmarks/bench_registration.py [--users N] [--chunk-size N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_registration.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('PASSWORD_COST', '4')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from auth import register_user
+from db_connection import get_connection, initialize_database
+from passwords import hash_password
+from roster_import import register_users
+
+
+def legacy_register_user(username, password, email):
+    """The original path, kept here as the baseline: pre-SELECT, commit, then a second connection for the profile"""
+    password_hash = hash_password(password)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+        if cursor.fetchone():
+            return False, "Username already exists"
+        cursor.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+                       (username, password_hash, email))
+        user_id = cursor.lastrowid
+        conn.commit()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        cursor.execute("""
+            INSERT INTO patient_profiles (user_id, first_name, last_name, blood_type, allergies)
+            VALUES (?, ?, '', 'Not provided', 'Not provided')
+        """, (user_id, user['username']))
+        conn.commit()
+    return True, {"id": user_id, "username": username}
+
+
+def roster(prefix, count):
+    return [{'username': f"{prefix}{i:07d}", 'password': f"pass-{i}", 'email': f"{prefix}{i:07d}@example.com"}
+            for i in range(count)]
+
+
+def one_by_one(register, rows):
+    for row in rows:
+        ok, result = register(row['username'], row['password'], row['email'])
+        assert ok, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000, help="registrations per method")
+    parser.add_argument('--chunk-size', type=int, default=500, help="rows per bulk transaction")
+    args = parser.parse_args()
+
+    initialize_database()
+    runs = [
+        ('legacy register_user', lambda rows: one_by_one(legacy_register_user, rows)),
+        ('register_user', lambda rows: one_by_one(register_user, rows)),
+        ('register_users (bulk)', lambda rows: register_users(rows, chunk_size=args.chunk_size)),
+    ]
+    print(f"{args.users} registrations per method, PASSWORD_COST={os.environ['PASSWORD_COST']}")
+    for index, (name, run) in enumerate(runs):
+        rows = roster(f"bench{index}_", args.users)
+        start = time.perf_counter()
+        report = run(rows)
+        elapsed = time.perf_counter() - start
+        if report is not None:
+            assert report.imported == args.users, report.rejected[:5]
+        print(f"{name:24} {elapsed:8.2f} s {args.users / elapsed:10.0f} registrations/s")
+
+    with get_connection() as conn:
+        orphans = conn.execute("""
+            SELECT COUNT(*) FROM users u LEFT JOIN patient_profiles p ON p.user_id = u.id WHERE p.id IS NULL
+        """).fetchone()[0]
+    print(f"Users without a profile: {orphans}")
+
+
+if __name__ == '__main__':
+    main()